@@ -0,0 +1,31 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "records" ADD "hit_count" INT NOT NULL  DEFAULT 0;
+ALTER TABLE "records" ADD "last_used_at" TIMESTAMP;
+CREATE INDEX IF NOT EXISTS "idx_records_last_us_6c1a3e" ON "records" ("last_used_at");
+CREATE INDEX IF NOT EXISTS "idx_usage_logs_timesta_1d7e0b" ON "usage_logs" ("timestamp");
+CREATE TABLE IF NOT EXISTS "usage_rollups" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "day" DATE NOT NULL,
+    "hits" INT NOT NULL  DEFAULT 0,
+    "record_id" INT NOT NULL REFERENCES "records" ("id") ON DELETE CASCADE,
+    CONSTRAINT "uid_usage_rollu_record__8b2f4c" UNIQUE ("record_id", "day")
+) /* Number of uses of a cache record per day, maintained from the usage stream */;
+CREATE INDEX IF NOT EXISTS "idx_usage_rollu_day_3f9a21" ON "usage_rollups" ("day");
+UPDATE "records" SET
+    "hit_count" = (SELECT COUNT(*) FROM "usage_logs" WHERE "usage_logs"."record_id" = "records"."id"),
+    "last_used_at" = (SELECT MAX("timestamp") FROM "usage_logs" WHERE "usage_logs"."record_id" = "records"."id");
+INSERT INTO "usage_rollups" ("record_id", "day", "hits")
+    SELECT "record_id", DATE("timestamp"), COUNT(*) FROM "usage_logs" GROUP BY "record_id", DATE("timestamp");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "usage_rollups";
+DROP INDEX IF EXISTS "idx_usage_logs_timesta_1d7e0b";
+DROP INDEX IF EXISTS "idx_records_last_us_6c1a3e";
+ALTER TABLE "records" DROP COLUMN "last_used_at";
+ALTER TABLE "records" DROP COLUMN "hit_count";"""
@@ -0,0 +1,15 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "records" ADD "size_bytes" BIGINT NOT NULL  DEFAULT 0;
+ALTER TABLE "records" ADD "pinned" INT NOT NULL  DEFAULT 0;
+CREATE INDEX IF NOT EXISTS "idx_records_avatarI_4d2b7a" ON "records" ("avatarId");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP INDEX IF EXISTS "idx_records_avatarI_4d2b7a";
+ALTER TABLE "records" DROP COLUMN "pinned";
+ALTER TABLE "records" DROP COLUMN "size_bytes";"""
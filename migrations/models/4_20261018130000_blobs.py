@@ -0,0 +1,19 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        CREATE TABLE IF NOT EXISTS "blobs" (
+    "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    "name" VARCHAR(255) NOT NULL UNIQUE,
+    "path" VARCHAR(1024) NOT NULL,
+    "size_bytes" BIGINT NOT NULL  DEFAULT 0,
+    "refcount" INT NOT NULL  DEFAULT 1,
+    "created" TIMESTAMP NOT NULL  DEFAULT CURRENT_TIMESTAMP
+) /* A file in a content-addressed storage, shared by every record with the same content */;
+CREATE INDEX IF NOT EXISTS "idx_blobs_path_7e3c91" ON "blobs" ("path");"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        DROP TABLE IF EXISTS "blobs";"""
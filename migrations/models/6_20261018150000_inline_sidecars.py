@@ -0,0 +1,17 @@
+from tortoise import BaseDBAsyncClient
+
+
+async def upgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "records" ADD "visemes" JSON   /* visemes kept inline in the record instead of storage */;
+        ALTER TABLE "records" ADD "word_timestamps" JSON   /* word timestamps kept inline in the record instead of storage */;
+        ALTER TABLE "messages" ADD "visemes" JSON   /* visemes from agent, when sent inline */;
+        ALTER TABLE "messages" ADD "word_timestamps" JSON   /* word timestamps from agent, when sent inline */;"""
+
+
+async def downgrade(db: BaseDBAsyncClient) -> str:
+    return """
+        ALTER TABLE "records" DROP COLUMN "visemes";
+        ALTER TABLE "records" DROP COLUMN "word_timestamps";
+        ALTER TABLE "messages" DROP COLUMN "visemes";
+        ALTER TABLE "messages" DROP COLUMN "word_timestamps";"""
@@ -1,13 +1,33 @@
-from typing import AsyncGenerator
+import io
+from typing import AsyncGenerator, Optional
 
 from aiohttp import ClientSession
 
 
+async def read_all(data: bytes | AsyncGenerator[bytes, None] | io.IOBase) -> bytes:
+    """
+    Read media given as bytes, a stream such as a download, or a file-like object into memory
+
+    Parameters:
+        data (bytes | AsyncGenerator[bytes, None] | io.IOBase): The media
+
+    Returns:
+        The bytes of the media
+    """
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    if isinstance(data, io.IOBase):
+        return data.read()
+    return b"".join([chunk async for chunk in data])
+
+
 class APIClient:
     """
     Singleton class for the API Client to make api requests using async functions
     """
     _instance = None
+    # large reads keep the number of iterations of a download low for videos of tens of MB
+    DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -71,12 +91,13 @@ class APIClient:
                 raise Exception(f"Error in API: {resp.status}")
             return await resp.json()
         
-    async def download(self, url) -> AsyncGenerator[bytes, None]:
+    async def download(self, url, chunk_size: Optional[int] = None) -> AsyncGenerator[bytes, None]:
         """
         Download the content from the given URL
         
         Parameters:
             url (str): The URL to download the content from
+            chunk_size (Optional[int]): Most bytes per chunk, `DOWNLOAD_CHUNK_SIZE` if None
             
         Returns:
             The content of the response as async stream of bytes
@@ -84,6 +105,6 @@ class APIClient:
         async with self.session.get(url) as resp:
             if resp.status >= 400:
                 raise Exception(f"Error in API: {resp.status}")
-            async for chunk in resp.content.iter_chunked(1024):
+            async for chunk in resp.content.iter_chunked(chunk_size or self.DOWNLOAD_CHUNK_SIZE):
                 yield chunk
         
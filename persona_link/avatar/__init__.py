@@ -1,15 +1,22 @@
-from .models import (Avatar, AvatarInput, AvatarPydantic, Webhook,
-                     WebhookPydantic, WebhookResponseData)
-from .utils import call_webhook, get_avatar_info, speak
+from .models import (Avatar, AvatarInput, AvatarPydantic, PrewarmProgress,
+                     PrewarmState, PrewarmStatus, Webhook, WebhookPydantic,
+                     WebhookResponseData)
+from .prewarmer import Prewarmer
+from .utils import call_webhook, get_avatar_info, prewarm, speak
 
 __all__ = [
     "Avatar",
     "AvatarInput",
     "AvatarPydantic",
+    "PrewarmProgress",
+    "PrewarmState",
+    "PrewarmStatus",
+    "Prewarmer",
     "Webhook",
     "WebhookPydantic",
     "WebhookResponseData",
     "call_webhook",
     "speak",
+    "prewarm",
     "get_avatar_info",
 ]
@@ -1,5 +1,6 @@
+from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel
 from tortoise import fields
@@ -43,6 +44,75 @@ class AvatarInput(BaseModel):
     text: str  # text to speak
     personalize: bool = False  # whether to personalize the avatar
     
+class PrewarmProgress(BaseModel):
+    """
+    A class that represents the progress of filling the cache of an Avatar with a list of texts.
+
+    Attributes:
+        total (int): Number of distinct texts to prewarm.
+        cached (int): Number of texts that were already cached.
+        generated (int): Number of texts generated and put in the cache.
+        failed (int): Number of texts that failed to generate.
+        elapsed_seconds (float): Seconds since the prewarm started.
+    """
+
+    total: int = 0
+    cached: int = 0
+    generated: int = 0
+    failed: int = 0
+    elapsed_seconds: float = 0.0
+
+    @property
+    def done(self) -> int:
+        """Number of texts processed so far"""
+        return self.cached + self.generated + self.failed
+
+    @property
+    def rate(self) -> float:
+        """Texts generated per second"""
+        return self.generated / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+
+class PrewarmState(Enum):
+    """
+    Enum for the state of the background prewarm of an Avatar
+
+    Values:
+    ```
+        QUEUED  : Waiting for a worker
+        RUNNING : Generating the texts that are not cached
+        DONE    : Every text is cached
+        FAILED  : The prewarm failed or some texts failed to generate
+    ```
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class PrewarmStatus(BaseModel):
+    """
+    A class that represents the status of the background prewarm of an Avatar.
+
+    Attributes:
+        avatar_slug (str): Slug of the Avatar.
+        state (PrewarmState): State of the prewarm.
+        progress (PrewarmProgress): Counts of the texts processed so far.
+        error (Optional[str]): Why the prewarm failed.
+        queued_at (datetime): When the prewarm was queued.
+        finished_at (Optional[datetime]): When the prewarm finished.
+    """
+
+    avatar_slug: str
+    state: PrewarmState = PrewarmState.QUEUED
+    progress: PrewarmProgress = PrewarmProgress()
+    error: Optional[str] = None
+    queued_at: datetime
+    finished_at: Optional[datetime] = None
+
+
 class AvatarifyRequest(BaseModel):
     """
     A class that represents the request to the Avatarify API.
@@ -166,6 +236,7 @@ class Avatar(Model):
         updated_at (Datetime):
             The time of the last update of the Avatar instance in the database.
         initial_message (str): Initial message the avatar should speak upon first conversation.
+        phrases (List[str]): Phrases the avatar often speaks, generated ahead of time so they are served from the cache.
     """
 
     id = fields.IntField(pk=True, description="Primary Key")
@@ -194,6 +265,9 @@ class Avatar(Model):
     initial_message = fields.CharField(
         1000, null=True, description="Initial message for the avatar"
     )
+    phrases = fields.JSONField(
+        null=True, description="Phrases to generate ahead of time"
+    )
 
     def instance(self):
         return persona_link_providers[self.provider.value]()
@@ -204,6 +278,7 @@ class Avatar(Model):
         data: AvatarPydantic,
         webhook: WebhookPydantic | None = None,
         initial_message: str = None,
+        phrases: Optional[List[str]] = None,
     ):
         """
         Create an avatar with the given data
@@ -212,6 +287,7 @@ class Avatar(Model):
             data (AvatarPydantic): The data for the avatar
             webhook (WebhookPydantic): The data for the webhook
             initial_message (str): The initial message for the avatar to speak
+            phrases (Optional[List[str]]): Phrases to generate ahead of time
         """
         if not data.provider:
             raise ValueError("Provider not specified")
@@ -245,6 +321,7 @@ class Avatar(Model):
             settings=data.settings,
             webhook=w,
             initial_message=initial_message,
+            phrases=phrases,
         )
         await avatar.save()
         return avatar
@@ -254,6 +331,7 @@ class Avatar(Model):
         data: AvatarPydantic,
         webhook: WebhookPydantic | None = None,
         initial_message: str = None,
+        phrases: Optional[List[str]] = None,
     ):
         """
         Update the avatar with the given data
@@ -262,6 +340,7 @@ class Avatar(Model):
             data (AvatarPydantic): The data for the avatar
             webhook (WebhookPydantic): The data for the webhook
             initial_message (str): The initial message for the avatar to speak
+            phrases (Optional[List[str]]): Phrases to generate ahead of time, replacing the current ones
         """
         if data.provider and data.provider not in persona_link_providers:
             raise ValueError(f"Provider '{data.provider}' not found")
@@ -282,6 +361,8 @@ class Avatar(Model):
 
         if initial_message:
             self.initial_message = initial_message
+        if phrases is not None:
+            self.phrases = phrases
 
         await self.save()
         return self
@@ -0,0 +1,158 @@
+"""
+Background prewarm of the initial message and phrases of avatars
+"""
+
+import asyncio
+from collections import defaultdict
+from datetime import UTC, datetime
+from typing import Dict, Iterable, List, Optional, Set
+
+from persona_link.cache import Cache
+
+from .models import Avatar, PrewarmProgress, PrewarmState, PrewarmStatus
+from .utils import prewarm
+
+
+class Prewarmer:
+    """
+    Queue of avatars whose initial message and phrases are generated into the cache in the background,
+    so that the first conversation after an avatar is created or updated never waits for a render.
+
+    The initial message is pinned so that it is never evicted. Queueing an avatar that is already
+    waiting in the queue does not queue it twice.
+    """
+
+    def __init__(self, cache: Cache, concurrency: int = 4, workers: int = 1):
+        """
+        Constructor for Prewarmer class.
+
+        Parameters:
+            cache (Cache): The cache to fill
+            concurrency (int): Maximum number of texts of an avatar generated at a time
+            workers (int): Number of avatars prewarmed at a time
+        """
+        if cache is None:
+            raise ValueError("cache cannot be None")
+        self.cache = cache
+        self.concurrency = concurrency
+        self.workers = workers
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._jobs: Dict[str, PrewarmStatus] = {}
+        self._unpin: Dict[str, Set[str]] = defaultdict(set)
+        self._tasks: List[asyncio.Task] = []
+
+    def initial_message_key(self, avatar: Avatar) -> Optional[str]:
+        """
+        Get the cache key of the initial message of the avatar with its current settings
+
+        Parameters:
+            avatar (Avatar): The avatar
+
+        Returns:
+            The key, None if the avatar has no initial message or its settings are invalid
+        """
+        if not avatar.initial_message:
+            return None
+        settings = avatar.instance().validate(avatar.settings)
+        if not settings:
+            return None
+        return self.cache.key(avatar.slug, avatar.initial_message, settings)
+
+    def enqueue(self, avatar_slug: str, unpin: Iterable[Optional[str]] = ()) -> PrewarmStatus:
+        """
+        Queue the prewarm of the avatar with the given slug
+
+        Parameters:
+            avatar_slug (str): The slug of the avatar
+            unpin (Iterable[Optional[str]]): Keys of records pinned for a previous initial message or settings of the avatar
+
+        Returns:
+            The status of the queued prewarm
+        """
+        self._unpin[avatar_slug].update(key for key in unpin if key)
+        job = self._jobs.get(avatar_slug)
+        if job is not None and job.state == PrewarmState.QUEUED:
+            return job
+        job = PrewarmStatus(avatar_slug=avatar_slug, queued_at=datetime.now(UTC))
+        self._jobs[avatar_slug] = job
+        self._queue.put_nowait(avatar_slug)
+        return job
+
+    def status(self, avatar_slug: str) -> Optional[PrewarmStatus]:
+        """
+        Get the status of the latest prewarm of the avatar with the given slug
+
+        Parameters:
+            avatar_slug (str): The slug of the avatar
+
+        Returns:
+            The status, None if the avatar was never queued
+        """
+        return self._jobs.get(avatar_slug)
+
+    async def _prewarm(self, job: PrewarmStatus) -> None:
+        avatar = await Avatar.get_or_none(slug=job.avatar_slug)
+        if avatar is None:
+            raise ValueError(f"Avatar '{job.avatar_slug}' not found")
+        texts = [avatar.initial_message, *(avatar.phrases or [])]
+
+        def progress(status: PrewarmProgress):
+            job.progress = status
+
+        await prewarm(
+            avatar.slug,
+            self.cache,
+            [text for text in texts if text],
+            concurrency=self.concurrency,
+            progress=progress,
+        )
+
+        key = self.initial_message_key(avatar)
+        for stale in self._unpin.pop(avatar.slug, set()) - {key}:
+            await self.cache.pin(stale, False)
+        if key is not None:
+            await self.cache.pin(key)
+
+        if job.progress.failed:
+            job.state = PrewarmState.FAILED
+            job.error = f"{job.progress.failed} of {job.progress.total} texts failed to generate"
+        else:
+            job.state = PrewarmState.DONE
+
+    async def _work(self) -> None:
+        while True:
+            avatar_slug = await self._queue.get()
+            job = self._jobs[avatar_slug]
+            job.state = PrewarmState.RUNNING
+            try:
+                await self._prewarm(job)
+            except Exception as e:
+                print(f"Prewarm of avatar '{avatar_slug}' failed: {e}")
+                job.state = PrewarmState.FAILED
+                job.error = str(e)
+            finally:
+                job.finished_at = datetime.now(UTC)
+                self._queue.task_done()
+
+    async def join(self) -> None:
+        """
+        Wait until every queued prewarm has finished
+        """
+        await self._queue.join()
+
+    def start(self) -> None:
+        """
+        Start the workers in the running event loop
+        """
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._work()))
+
+    async def stop(self) -> None:
+        """
+        Stop the workers. Prewarms still in the queue are dropped.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
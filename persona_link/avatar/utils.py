@@ -1,3 +1,7 @@
+import asyncio
+import time
+from typing import Callable, Iterable, Optional
+
 from persona_link.api_client import APIClient
 from persona_link.cache import Cache
 from persona_link.persona_provider import PersonaBase
@@ -6,7 +10,7 @@ from persona_link.persona_provider.models import (AudioProviderSettings,
                                                   SpeakingAvatarInstance, VideoProviderSettings)
 from persona_link.persona_provider.sprite.models import SpriteAvatarSettings
 
-from .models import Avatar, AvatarInput, WebhookResponseData
+from .models import Avatar, AvatarInput, PrewarmProgress, WebhookResponseData
 
 
 async def get_avatar_info(avatar_slug: str) -> tuple[Avatar, AvatarType]:
@@ -39,6 +43,17 @@ async def get_avatar_info(avatar_slug: str) -> tuple[Avatar, AvatarType]:
         return avatar, AvatarType.TEXT
     
 
+async def _get_provider(avatar_slug: str) -> tuple[Avatar, PersonaBase, AudioProviderSettings | VideoProviderSettings]:
+    avatar = await Avatar.get_or_none(slug=avatar_slug)
+    if avatar is None:
+        raise ValueError(f"Avatar '{avatar_slug}' not found")
+    instance: PersonaBase = avatar.instance()
+    settings = instance.validate(avatar.settings) # type: ignore
+    if not settings:
+        raise ValueError(f"Settings for provider '{avatar.provider}' are invalid")
+    return avatar, instance, settings
+
+
 async def speak(avatar_slug: str, cache: Cache, input: AvatarInput) -> SpeakingAvatarInstance:
     """
     Speak the input text using the avatar with the given slug
@@ -51,16 +66,62 @@ async def speak(avatar_slug: str, cache: Cache, input: AvatarInput) -> SpeakingA
     Returns:
         SpeakingAvatarInstance: The instance of the speaking avatar
     """
-    avatar = await Avatar.get_or_none(slug=avatar_slug)
-    if avatar is None:
-        raise ValueError(f"Avatar '{avatar_slug}' not found")
-    instance: PersonaBase = avatar.instance()
-    settings = instance.validate(avatar.settings) # type: ignore
-    if not settings:
-        raise ValueError(f"Settings for provider '{avatar.provider}' are invalid")
+    avatar, instance, settings = await _get_provider(avatar_slug)
     
     return await instance.speak(cache, avatar.slug, input.text, settings, avatar.provider.value)
 
+
+async def prewarm(
+    avatar_slug: str,
+    cache: Cache,
+    texts: Iterable[str],
+    concurrency: int = 4,
+    progress: Optional[Callable[[PrewarmProgress], None]] = None,
+) -> PrewarmProgress:
+    """
+    Fill the cache of the avatar with the given slug so that speaking the texts later is a cache hit.
+    Texts already cached are resolved in a single batch and only the misses are generated.
+    
+    Parameters:
+        avatar_slug (str): The slug of the avatar to use
+        cache (Cache): The cache object to use
+        texts (Iterable[str]): The texts to prewarm
+        concurrency (int): Maximum number of texts generated at a time
+        progress (Optional[Callable[[PrewarmProgress], None]]): Called after every processed text
+        
+    Returns:
+        PrewarmProgress: The final counts of the prewarm
+    """
+    avatar, instance, settings = await _get_provider(avatar_slug)
+    texts = list(dict.fromkeys(text for text in texts if text.strip()))
+    status = PrewarmProgress(total=len(texts))
+    start = time.monotonic()
+
+    def report():
+        status.elapsed_seconds = time.monotonic() - start
+        if progress is not None:
+            progress(status)
+
+    records = await cache.get_many(avatar.slug, texts, settings)
+    misses = [text for text, record in records.items() if record is None]
+    status.cached = len(texts) - len(misses)
+    report()
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _render(text: str):
+        async with semaphore:
+            try:
+                await instance.render(cache, avatar.slug, text, settings, avatar.provider.value)
+                status.generated += 1
+            except Exception as e:
+                print(f"Prewarm of '{text}' failed: {e}")
+                status.failed += 1
+            report()
+
+    await asyncio.gather(*[_render(text) for text in misses])
+    return status
+
 async def call_webhook(avatar_slug: str, data: WebhookResponseData):
     """
     Call the user response webhook of the avatar with the given slug. 
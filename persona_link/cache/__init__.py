@@ -1,6 +1,16 @@
 from .cache import Cache
 from .db import RelationalDB
-from .hashing import md5hash, sha256hash
+from .eviction import CacheEvictor, EvictionPolicy, Quota
+from .hashing import (blake2bhash, derive_key, md5hash, settings_fingerprint,
+                      sha256hash)
+from .memory import MemoryCache
+from .metrics import CacheMetrics
+from .negative import NegativeCache
+from .normalization import TextNormalizer
+from .sidecar import SidecarFormat, decode_sidecar, encode_sidecar
+from .singleflight import SingleFlight
 from .storage import AzureStorage, LocalStorage
+from .tee import MediaTee
+from .usage import UsageAggregator
 
-__all__ = [ "Cache", "LocalStorage", "AzureStorage", "RelationalDB", "md5hash", "sha256hash" ]
+__all__ = [ "Cache", "CacheEvictor", "CacheMetrics", "EvictionPolicy", "Quota", "MediaTee", "MemoryCache", "NegativeCache", "SidecarFormat", "SingleFlight", "TextNormalizer", "UsageAggregator", "LocalStorage", "AzureStorage", "RelationalDB", "blake2bhash", "derive_key", "md5hash", "decode_sidecar", "encode_sidecar", "settings_fingerprint", "sha256hash" ]
@@ -1,13 +1,74 @@
+import asyncio
+import hashlib
 import json
-from datetime import datetime
-from typing import Any, Callable, Optional
+import time
+from datetime import UTC, date, datetime, timedelta
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional, Tuple
+from uuid import uuid4
 
-from persona_link.persona_provider.models import Urls
+from pydantic import BaseModel
+
+from persona_link.api_client import APIClient
+from persona_link.persona_provider.models import Urls, Viseme, WordTimestamp
 
 from .db import BaseCacheDB
-from .models import (EXTENSION_MAPPING, ContentType, DataToStore, Record,
-                     StoragePaths)
+from .hashing import derive_key
+from .memory import MemoryCache
+from .metrics import CacheMetrics
+from .models import (EXTENSION_MAPPING, ContentType, DataToStore, PathType,
+                     Record, StoragePaths)
+from .negative import NegativeCache
+from .normalization import TextNormalizer
+from .sidecar import (SidecarFormat, decode_json_visemes,
+                      decode_json_word_timestamps, decode_sidecar,
+                      encode_sidecar)
+from .singleflight import SingleFlight
 from .storage import BaseCacheStorage
+from .tee import MediaTee
+from .usage import UsageAggregator
+
+
+class _ByteCounter:
+    """
+    Counts the bytes of the files of a record as they are uploaded,
+    including media that is streamed from an async generator.
+    Optionally computes the SHA-256 digest of the bytes on the way.
+    """
+
+    def __init__(self, digest: bool = False):
+        self.total = 0
+        self.sha256 = hashlib.sha256() if digest else None
+
+    def _count(self, chunk: bytes) -> None:
+        self.total += len(chunk)
+        if self.sha256 is not None:
+            self.sha256.update(chunk)
+
+    def wrap(
+        self, data: bytes | AsyncGenerator[bytes, None] | "_SourceUrl"
+    ) -> bytes | AsyncGenerator[bytes, None] | "_SourceUrl":
+        if isinstance(data, (bytes, bytearray)):
+            self._count(data)
+            return data
+        if isinstance(data, _SourceUrl):
+            # counted once copied
+            return data
+        return self._stream(data)
+
+    async def _stream(self, data: AsyncGenerator[bytes, None]) -> AsyncGenerator[bytes, None]:
+        async for chunk in data:
+            self._count(chunk)
+            yield chunk
+
+
+class _SourceUrl:
+    """
+    Media to copy into storage from a url, with the size of the copy once done
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.size_bytes = 0
 
 
 class Cache:
@@ -16,10 +77,41 @@ class Cache:
     avatar type. Caching requires a blob storage for files,
     database for metadata, and a hashing method to generate
     unique keys for the data.
+
+    Keys are derived from the avatar ID, a fingerprint of the avatar settings
+    and the normalized text, so a change of settings never serves stale media.
+
+    In content-addressed mode files are stored once per content, keyed by their SHA-256 digest,
+    in the `BLOB_FOLDER` folder and shared by every record with the same content. The database
+    counts the references to each blob, and a blob is deleted with its last reference. The
+    delete of a blob is serialized with puts of the same content, which revive the blob until
+    its file is deleted.
+
+    In the binary sidecar format the visemes and word timestamps of a record are stored in one
+    compact file instead of a JSON file each. Records stored as JSON remain readable.
+    Small visemes and word timestamps can be kept inline in the record, which saves their
+    storage writes on a miss and their downloads for the client.
+
+    With a tee, media streamed from a provider is served to clients from memory while it is
+    uploaded, so they do not wait for the upload to start playing it.
     """
 
+    BLOB_FOLDER = "_blobs"
+
     def __init__(
-        self, storage: BaseCacheStorage, db: BaseCacheDB, hashFn: Callable[[Any], str]
+        self,
+        storage: BaseCacheStorage,
+        db: BaseCacheDB,
+        hashFn: Callable[[Any], str],
+        memory: Optional[MemoryCache] = None,
+        normalizer: Optional[TextNormalizer] = None,
+        usage: Optional[UsageAggregator] = None,
+        negative: Optional[NegativeCache] = None,
+        content_addressed: bool = False,
+        sidecar_format: SidecarFormat = SidecarFormat.JSON,
+        inline_sidecar_bytes: int = 0,
+        metrics: Optional[CacheMetrics] = None,
+        tee: Optional[MediaTee] = None,
     ):
         """
         Constructor for Cache class.
@@ -28,6 +120,15 @@ class Cache:
             storage (BaseCacheStorage): The storage for the cache
             db (BaseCacheDB): The database for the cache
             hashFn (Callable[[Any], str]): The hashing function to generate keys
+            memory (Optional[MemoryCache]): Optional in-process tier in front of the database and storage
+            normalizer (Optional[TextNormalizer]): Normalization applied to text before hashing, None to hash text verbatim
+            usage (Optional[UsageAggregator]): Buffers usage increments and flushes them in bulk, None to write each increment
+            negative (Optional[NegativeCache]): Remembers failed generations so they are not retried right away, None to always retry
+            content_addressed (bool): Store files once per content and share them between records
+            sidecar_format (SidecarFormat): Format the visemes and word timestamps of new records are stored in
+            inline_sidecar_bytes (int): Visemes and word timestamps of at most this many bytes encoded are kept in the record instead of storage, 0 to never inline them
+            metrics (Optional[CacheMetrics]): Records hits, misses, latencies, bytes written and storage transfers, None to record nothing
+            tee (Optional[MediaTee]): Serves media streamed into the cache while it is uploaded, None to serve media once stored
         """
         if storage is None:
             raise ValueError("storage cannot be None")
@@ -38,24 +139,154 @@ class Cache:
         if hashFn is None:
             raise ValueError("hashFn cannot be None")
         self.hashFn = hashFn
+        self.memory = memory
+        self.inflight = SingleFlight()
+        self.normalizer = normalizer
+        self.normalizers: Dict[str, Optional[TextNormalizer]] = {}
+        self.usage = usage
+        self.negative = negative
+        self.content_addressed = content_addressed
+        self.sidecar_format = sidecar_format
+        self.inline_sidecar_bytes = inline_sidecar_bytes
+        self.metrics = metrics
+        self.tee = tee
+        if metrics is not None and storage.on_transfer is None:
+            storage.on_transfer = metrics.transferred
+
+    def _observe(self, operation: str, start: float) -> None:
+        if self.metrics is not None:
+            self.metrics.since(operation, start)
+
+    async def start(self) -> None:
+        """
+        Start the background work of the cache. Call once the event loop is running.
+        """
+        await self.storage.start()
+        if self.usage is not None:
+            self.usage.start()
 
-    async def get(self, avatarId: str, text: str) -> Optional[Record]:
+    async def close(self) -> None:
+        """
+        Stop the background work of the cache and flush what is buffered
+        """
+        if self.usage is not None:
+            await self.usage.stop()
+        await self.storage.close()
+
+    def set_normalizer(self, avatarId: str, normalizer: Optional[TextNormalizer]) -> None:
+        """
+        Override the text normalization for the given avatar
+
+        Parameters:
+            avatarId (str): The avatar ID
+            normalizer (Optional[TextNormalizer]): Normalization for the avatar, None to hash its text verbatim
+        """
+        self.normalizers[avatarId] = normalizer
+
+    def normalize(self, avatarId: str, text: str) -> str:
+        """
+        Normalize the text as configured for the given avatar
+
+        Parameters:
+            avatarId (str): The avatar ID
+            text (str): The text
+
+        Returns:
+            The normalized text
+        """
+        normalizer = self.normalizers.get(avatarId, self.normalizer)
+        return text if normalizer is None else normalizer(text)
+
+    def _count_merge(self, avatarId: str, text: str) -> None:
+        # a hit whose text changed under normalization would have been a separate key
+        if self.metrics is not None and text != self.normalize(avatarId, text):
+            self.metrics.merged(avatarId)
+
+    def key(self, avatarId: str, text: str, settings: Optional[BaseModel | dict] = None) -> str:
+        """
+        Get the cache key for the given avatar, text and settings
+
+        Parameters:
+            avatarId (str): The avatar ID
+            text (str): The text, normalized before hashing
+            settings (Optional[BaseModel | dict]): The settings of the avatar
+
+        Returns:
+            The key of the record for the given avatar ID, text and settings
+        """
+        return derive_key(avatarId, self.normalize(avatarId, text), settings, self.hashFn)
+
+    async def get(
+        self, avatarId: str, text: str, settings: Optional[BaseModel | dict] = None
+    ) -> Optional[Record]:
         """
         Get the record from the cache
 
         Parameters:
             avatarId (str): The avatar ID
             text (str): The text to get the record for
+            settings (Optional[BaseModel | dict]): The settings of the avatar
 
         Returns:
-            The record for the given avatar ID and text
+            The record for the given avatar ID, text and settings
         """
-        key = self.hashFn(avatarId + text)
+        key = self.key(avatarId, text, settings)
+        if self.memory is not None:
+            record = self.memory.get_record(key)
+            if record is not None:
+                self._count_merge(avatarId, text)
+                return record
+        start = time.perf_counter()
         record = await self.db.get(key)
+        self._observe("db_get", start)
         if record is None:
             return None
+        self._count_merge(avatarId, text)
+        if self.memory is not None:
+            self.memory.put_record(record)
         return record
 
+    async def get_many(
+        self,
+        avatarId: str,
+        texts: List[str],
+        settings: Optional[BaseModel | dict] = None,
+    ) -> Dict[str, Optional[Record]]:
+        """
+        Get the records for many texts of an avatar. Records not held in memory
+        are resolved by the database in a single batch.
+
+        Parameters:
+            avatarId (str): The avatar ID
+            texts (List[str]): The texts to get the records for
+            settings (Optional[BaseModel | dict]): The settings of the avatar
+
+        Returns:
+            The record for each text, None for texts that are not cached
+        """
+        keys = {text: self.key(avatarId, text, settings) for text in texts}
+        found: Dict[str, Record] = {}
+        if self.memory is not None:
+            for key in keys.values():
+                record = self.memory.get_record(key)
+                if record is not None:
+                    found[key] = record
+
+        missing = [key for key in set(keys.values()) if key not in found]
+        if missing:
+            start = time.perf_counter()
+            records = await self.db.get_many(missing)
+            self._observe("db_get_many", start)
+            if self.memory is not None:
+                for record in records.values():
+                    self.memory.put_record(record)
+            found.update(records)
+
+        for text, key in keys.items():
+            if key in found:
+                self._count_merge(avatarId, text)
+        return {text: found.get(key) for text, key in keys.items()}
+
     async def get_urls(self, record: Record) -> Urls:
         """
         Get the URLs for the media, visemes, and word timestamps
@@ -66,14 +297,76 @@ class Cache:
         Returns:
             The URLs for the media, visemes, and word timestamps
         """
+        if self.memory is not None:
+            urls = self.memory.get_urls(record.key)
+            if urls is not None:
+                return urls
 
-        return Urls(
-            media_url=await self.storage.get(record.storage_paths.media_path),
-            visemes_url=await self.storage.get(record.storage_paths.visemes_path),
-            word_timestamps_url=await self.storage.get(
-                record.storage_paths.word_timestamps_path
-            ),
+        start = time.perf_counter()
+        media_url, visemes_url, word_timestamps_url, sidecar_url = await asyncio.gather(
+            self.storage.get(record.storage_paths.media_path),
+            self.storage.get(record.storage_paths.visemes_path),
+            self.storage.get(record.storage_paths.word_timestamps_path),
+            self.storage.get(record.storage_paths.sidecar_path),
+        )
+        urls = Urls(
+            media_url=media_url,
+            visemes_url=visemes_url,
+            word_timestamps_url=word_timestamps_url,
+            sidecar_url=sidecar_url,
+        )
+        self._observe("url_sign", start)
+        if self.memory is not None:
+            self.memory.put_urls(record.key, urls, self.storage.url_expiry_seconds)
+        return urls
+
+    async def read_media(self, record: Record) -> bytes:
+        """
+        Read the media of the record from the storage
+
+        Parameters:
+            record (Record): The record to read the media of
+
+        Returns:
+            The media data
+        """
+        return await self._read(record.storage_paths.media_path)
+
+    async def _read(self, path: str) -> bytes:
+        start = time.perf_counter()
+        data = await self.storage.read(path)
+        self._observe("storage_read", start)
+        return data
+
+    async def read_sidecars(
+        self, record: Record
+    ) -> Tuple[Optional[List[Viseme]], Optional[List[WordTimestamp]]]:
+        """
+        Read the visemes and word timestamps of the record, from its binary sidecar
+        or its JSON files in the storage, or from the record itself if they are inline
+
+        Parameters:
+            record (Record): The record to read the sidecars of
+
+        Returns:
+            The visemes and the word timestamps, None for those the record does not have
+        """
+        paths = record.storage_paths
+        if not (paths.sidecar_path or paths.visemes_path or paths.word_timestamps_path):
+            return record.visemes, record.word_timestamps
+        if record.storage_paths.sidecar_path:
+            return decode_sidecar(await self._read(record.storage_paths.sidecar_path))
+
+        async def _read(path: Optional[str], decode: Callable[[bytes], list]) -> Optional[list]:
+            if not path:
+                return None
+            return decode(await self._read(path))
+
+        visemes, word_timestamps = await asyncio.gather(
+            _read(record.storage_paths.visemes_path, decode_json_visemes),
+            _read(record.storage_paths.word_timestamps_path, decode_json_word_timestamps),
         )
+        return visemes, word_timestamps
 
     async def getUsageCount(self, key: str) -> int:
         """
@@ -85,71 +378,329 @@ class Cache:
         Returns:
             The usage count for the given key
         """
-        return await self.db.getUsageCount(key)
+        count = await self.db.getUsageCount(key)
+        if self.usage is not None:
+            count += self.usage.pending(key)
+        return count
 
-    async def put(
+    async def getDailyUsage(self, key: str, days: int = 30) -> Dict[date, int]:
+        """
+        Get the number of uses per day of the record for the given key
+
+        Parameters:
+            key (str): The key for the record
+            days (int): Number of most recent days to include
+
+        Returns:
+            The number of uses by day, days without use are absent
+        """
+        since = datetime.now(UTC).date() - timedelta(days=days - 1)
+        return await self.db.getDailyUsage(key, since)
+
+    async def pruneUsageLogs(self, retention: timedelta) -> int:
+        """
+        Delete the raw usage logs older than the retention window.
+        Usage counts and daily rollups are kept.
+
+        Parameters:
+            retention (timedelta): How long raw usage logs are kept
+
+        Returns:
+            The number of logs deleted
+        """
+        return await self.db.pruneUsageLogs(datetime.now(UTC) - retention)
+
+    def _is_blob(self, path: str) -> bool:
+        return self.storage.folder(path) == self.BLOB_FOLDER
+
+    async def _put_blob(
+        self, data: bytes | AsyncGenerator[bytes, None], content_type: ContentType
+    ) -> str:
+        """
+        Put the data in the content-addressed storage, or reference the blob with the same content
+
+        Parameters:
+            data (bytes | AsyncGenerator[bytes, None]): The data to store
+            content_type (ContentType): The content type of the data
+
+        Returns:
+            The storage path of the blob
+        """
+        extension = EXTENSION_MAPPING[content_type]
+        name = None
+        if isinstance(data, (bytes, bytearray)):
+            name = f"{hashlib.sha256(data).hexdigest()}{extension}"
+            path = await self.db.acquireBlob(name)
+            if path is not None:
+                return path
+
+        # every upload gets a file of its own, so dropping a released blob never deletes the
+        # file of a concurrent put of the same content. The digest of a stream is known once
+        # it is uploaded.
+        counter = _ByteCounter(digest=name is None)
+        uploaded = await self.storage.put(
+            self.BLOB_FOLDER, counter.wrap(data), f"{uuid4().hex}{extension}", content_type
+        )
+        if name is None:
+            name = f"{counter.sha256.hexdigest()}{extension}"
+            path = await self.db.acquireBlob(name)
+            if path is not None:
+                await self.storage.delete(uploaded)
+                return path
+        path = await self.db.createBlob(name, uploaded, counter.total)
+        if path != uploaded:
+            # another writer created the blob first
+            await self.storage.delete(uploaded)
+        return path
+
+    async def _remove_files(self, paths: List[str], concurrency: int = 16) -> None:
+        """
+        Delete the files at the given paths, with at most `concurrency` deletes running at a time.
+        Blobs are only deleted once no record references them anymore.
+        Files that fail to delete are reported and left behind.
+
+        Parameters:
+            paths (List[str]): The storage paths
+            concurrency (int): Maximum number of concurrent storage deletes
+        """
+        paths = [path for path in paths if path]
+        blobs = [path for path in paths if self._is_blob(path)]
+        targets = [path for path in paths if not self._is_blob(path)]
+        released = await self.db.releaseBlobs(blobs) if blobs else []
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _delete(path: str) -> None:
+            async with semaphore:
+                await self.storage.delete(path)
+
+        async def _drop(path: str) -> None:
+            async with semaphore:
+                await self.db.dropBlob(path, self.storage.delete)
+
+        results = await asyncio.gather(
+            *[_delete(path) for path in targets],
+            *[_drop(path) for path in released],
+            return_exceptions=True,
+        )
+        for path, result in zip(targets + released, results):
+            if isinstance(result, BaseException):
+                print(f"Deleting {path} failed: {result}")
+
+    async def _put_all(
         self,
         avatarId: str,
-        text: str,
-        data: DataToStore,
-    ) -> Record:
+        uploads: Dict[PathType, Tuple[bytes | AsyncGenerator[bytes, None], str, ContentType]],
+    ) -> Dict[PathType, str]:
         """
-        Put the record in the cache
+        Upload the independent files of a record concurrently. If any upload fails,
+        the files that were uploaded are deleted and the first error is raised.
 
         Parameters:
             avatarId (str): The avatar ID
-            text (str): The text to put the record for
-            data (DataToStore): The data to store in the cache
+            uploads (Dict[PathType, Tuple]): data or source url, filename and content type to upload for each path type
 
         Returns:
-            The record that was put in the cache
+            The storage path for each path type
         """
-        key = self.hashFn(avatarId + text)
-        media_path = await self.storage.put(
-            avatarId,
-            data.binary_data,
-            f"{key}{EXTENSION_MAPPING[data.content_type]}",
-            data.content_type,
+        async def _put(
+            data: bytes | AsyncGenerator[bytes, None] | _SourceUrl,
+            filename: str,
+            content_type: ContentType,
+        ) -> str:
+            if isinstance(data, _SourceUrl):
+                path, data.size_bytes = await self.storage.put_from_url(
+                    avatarId, data.url, filename, content_type
+                )
+                return path
+            if self.content_addressed:
+                return await self._put_blob(data, content_type)
+            return await self.storage.put(avatarId, data, filename, content_type)
+
+        results = await asyncio.gather(
+            *[_put(*upload) for upload in uploads.values()],
+            return_exceptions=True,
         )
-        visemes_path = None
-        word_timestamps_path = None
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            await self._remove_files([r for r in results if isinstance(r, str)])
+            raise errors[0]
+        return dict(zip(uploads.keys(), results))
+
+    def _sidecar_files(
+        self, key: str, data: DataToStore
+    ) -> Dict[PathType, Tuple[bytes, str, ContentType]]:
+        """
+        Encode the visemes and word timestamps of the data in the sidecar format of the cache
+
+        Returns:
+            The data, file name and content type of each sidecar file, by path type
+        """
+        files: Dict[PathType, Tuple[bytes, str, ContentType]] = {}
+        if self.sidecar_format == SidecarFormat.BINARY:
+            if data.visemes is not None or data.word_timestamps is not None:
+                files[PathType.SIDECAR] = (
+                    encode_sidecar(data.visemes, data.word_timestamps),
+                    f"{key}-sidecar{EXTENSION_MAPPING[ContentType.BINARY]}",
+                    ContentType.BINARY,
+                )
+            return files
+
         if data.visemes is not None:
             viseme_bytes = json.dumps([v.model_dump() for v in data.visemes]).encode(
                 "utf-8"
             )  # Convert Viseme instances to dict, then to JSON string, then to bytes
-            visemes_path = await self.storage.put(
-                avatarId, viseme_bytes, f"{key}-visemes.json", ContentType.JSON
-            )
+            files[PathType.VISEMES] = (viseme_bytes, f"{key}-visemes.json", ContentType.JSON)
 
         if data.word_timestamps is not None:
             word_timestamps_json = json.dumps(
                 [w.model_dump() for w in data.word_timestamps]
             )
             word_timestamps_bytes = word_timestamps_json.encode("utf-8")
-            word_timestamps_path = await self.storage.put(
-                avatarId,
+            files[PathType.WORD_TIMESTAMPS] = (
                 word_timestamps_bytes,
                 f"{key}-word-timestamps.json",
                 ContentType.JSON,
             )
+        return files
+
+    async def put(
+        self,
+        avatarId: str,
+        text: str,
+        data: DataToStore,
+        settings: Optional[BaseModel | dict] = None,
+    ) -> Record:
+        """
+        Put the record in the cache.
+        With a tee, streamed media is served from memory to readers while it is uploaded.
+        Media given by a source url is copied into storage by the storage itself, without
+        passing through this process, when the storage can and the cache is not content-addressed.
+        Otherwise it is downloaded and streamed like any other media. While a copy runs, readers
+        of the tee are redirected to the source url.
+
+        Parameters:
+            avatarId (str): The avatar ID
+            text (str): The text to put the record for
+            data (DataToStore): The data to store in the cache
+            settings (Optional[BaseModel | dict]): The settings the data was generated with
+
+        Returns:
+            The record that was put in the cache
+        """
+        key = self.key(avatarId, text, settings)
+        media = data.binary_data
+        if media is None:
+            if data.source_url is None:
+                raise ValueError("data must have binary_data or a source_url")
+            if self.content_addressed or not self.storage.copies_from_url:
+                # the media passes through, for its digest or because the storage cannot copy it
+                media = APIClient().download(data.source_url)
+            else:
+                media = _SourceUrl(data.source_url)
+        teed = self.tee is not None and not isinstance(media, (bytes, bytearray))
+        if teed:
+            if isinstance(media, _SourceUrl):
+                self.tee.open(key, data, redirect=media.url)
+            else:
+                media = self.tee.open(key, data).wrap(media)
+        try:
+            return await self._put(avatarId, text, key, data, media)
+        finally:
+            if teed:
+                self.tee.close(key)
+
+    async def _put(
+        self,
+        avatarId: str,
+        text: str,
+        key: str,
+        data: DataToStore,
+        media: bytes | AsyncGenerator[bytes, None] | _SourceUrl,
+    ) -> Record:
+        size = _ByteCounter()
+        uploads = {
+            PathType.MEDIA: (
+                size.wrap(media),
+                f"{key}{EXTENSION_MAPPING[data.content_type]}",
+                data.content_type,
+            )
+        }
+        sidecars = self._sidecar_files(key, data)
+        inline = bool(sidecars) and (
+            sum(len(sidecar) for sidecar, _, _ in sidecars.values()) <= self.inline_sidecar_bytes
+        )
+        if not inline:
+            for path_type, (sidecar, filename, content_type) in sidecars.items():
+                uploads[path_type] = (size.wrap(sidecar), filename, content_type)
+
+        start = time.perf_counter()
+        paths = await self._put_all(avatarId, uploads)
+        self._observe("storage_put", start)
+        if isinstance(media, _SourceUrl):
+            size.total += media.size_bytes
+        if self.metrics is not None:
+            self.metrics.stored(avatarId, size.total)
 
         record = Record(
             key=key,
             avatarId=avatarId,
-            text=text,
+            text=self.normalize(avatarId, text),
             created=datetime.now(),
             metadata=data.metadata,
             storage_paths=StoragePaths(
-                media_path=media_path,
-                visemes_path=visemes_path,
-                word_timestamps_path=word_timestamps_path,
+                media_path=paths[PathType.MEDIA],
+                visemes_path=paths.get(PathType.VISEMES),
+                word_timestamps_path=paths.get(PathType.WORD_TIMESTAMPS),
+                sidecar_path=paths.get(PathType.SIDECAR),
             ),
+            size_bytes=size.total,
+            visemes=data.visemes if inline else None,
+            word_timestamps=data.word_timestamps if inline else None,
         )
 
-        await self.db.put(record)
+        if not await self.db.put(record):
+            # another writer stored the key first, keep its record and files
+            if self.content_addressed:
+                await self._remove_files(record.storage_paths.all())
+            existing = await self.db.get(key)
+            if existing is not None:
+                record = existing
+        if self.memory is not None:
+            self.memory.put_record(record)
 
         return record
 
+    async def put_many(
+        self,
+        avatarId: str,
+        items: Dict[str, DataToStore],
+        settings: Optional[BaseModel | dict] = None,
+        concurrency: int = 4,
+    ) -> Dict[str, Record]:
+        """
+        Put many records in the cache with at most `concurrency` puts running at a time
+
+        Parameters:
+            avatarId (str): The avatar ID
+            items (Dict[str, DataToStore]): The data to store for each text
+            settings (Optional[BaseModel | dict]): The settings of the avatar
+            concurrency (int): Maximum number of concurrent puts
+
+        Returns:
+            The record that was put in the cache for each text
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _put(text: str, data: DataToStore) -> Record:
+            async with semaphore:
+                return await self.put(avatarId, text, data, settings)
+
+        records = await asyncio.gather(
+            *[_put(text, data) for text, data in items.items()]
+        )
+        return dict(zip(items.keys(), records))
+
     async def delete(self, key: str) -> None:
         """
         Delete the record for the given key
@@ -157,25 +708,65 @@ class Cache:
         Parameters:
             key (str): The key for the record
         """
+        if self.memory is not None:
+            self.memory.invalidate(key)
         record: Record = await self.db.get(key)
         if record is None:
             return
-        await self.storage.delete(record.storage_paths.media_path)
-        if record.storage_paths.visemes_path:
-            await self.storage.delete(record.storage_paths.visemes_path)
-        if record.storage_paths.word_timestamps_path:
-            await self.storage.delete(record.storage_paths.word_timestamps_path)
         await self.db.delete(key)
+        await self._remove_files(record.storage_paths.all())
 
-    async def deleteAll(self, avatarId: str) -> None:
+    async def delete_many(self, records: List[Record], concurrency: int = 16) -> None:
         """
-        Delete all the records for the given avatar
+        Delete many records, with at most `concurrency` storage deletes running at a time.
+        The database rows are deleted first so that no reader is served a record whose
+        files are being deleted. Files that fail to delete are reported and left behind.
+
+        Parameters:
+            records (List[Record]): The records to delete
+            concurrency (int): Maximum number of concurrent storage deletes
+        """
+        if self.memory is not None:
+            for record in records:
+                self.memory.invalidate(record.key)
+        await self.db.delete_many([record.key for record in records])
+        await self._remove_files(
+            [path for record in records for path in record.storage_paths.all()],
+            concurrency,
+        )
+
+    async def pin(self, key: str, pinned: bool = True) -> None:
+        """
+        Pin the record for the given key so that it is never evicted, or unpin it
+
+        Parameters:
+            key (str): The key for the record
+            pinned (bool): Whether the record is pinned
+        """
+        await self.db.setPinned(key, pinned)
+        if self.memory is not None:
+            self.memory.invalidate(key)
+
+    async def deleteAll(
+        self, avatarId: str, progress: Optional[Callable[[int], None]] = None
+    ) -> None:
+        """
+        Delete all the records for the given avatar. The database rows are deleted first,
+        in chunks, releasing the blobs of each chunk, then the files of the avatar in batches.
 
         Parameters:
             avatarId (str): The avatar ID
+            progress (Optional[Callable[[int], None]]): Called with the number of files of the avatar deleted so far
         """
-        await self.storage.deleteAll(avatarId)
-        await self.db.deleteAll(avatarId)
+        if self.memory is not None:
+            self.memory.invalidateAll(avatarId)
+
+        async def release(paths: List[str]) -> None:
+            # blobs live outside the folder of the avatar and may be shared with other avatars
+            await self._remove_files([path for path in paths if self._is_blob(path)])
+
+        await self.db.deleteAll(avatarId, release)
+        await self.storage.deleteAll(avatarId, progress)
 
     async def incrementUsage(self, key: str) -> None:
         """
@@ -184,4 +775,7 @@ class Cache:
         Parameters:
             key (str): The key for the record
         """
+        if self.usage is not None:
+            self.usage.increment(key)
+            return
         await self.db.incrementUsage(key)
@@ -1,5 +1,5 @@
 from .base_db import BaseCacheDB
-from .models import Record, UsageLog
+from .models import Blob, Record, UsageLog, UsageRollup
 from .relational import RelationalDB
 
-__all__ = ["BaseCacheDB", "Record", "UsageLog", "RelationalDB"]
+__all__ = ["BaseCacheDB", "Blob", "Record", "UsageLog", "UsageRollup", "RelationalDB"]
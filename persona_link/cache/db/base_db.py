@@ -1,7 +1,8 @@
 from abc import ABC, abstractmethod
-from typing import Optional
+from datetime import date, datetime
+from typing import Awaitable, Callable, Dict, List, Optional
 
-from persona_link.cache.models import Record
+from persona_link.cache.models import Record, StorageUsage
 
 
 class BaseCacheDB(ABC):
@@ -20,12 +21,28 @@ class BaseCacheDB(ABC):
         pass
 
     @abstractmethod
-    async def put(self, record: Record) -> None:
+    async def get_many(self, keys: List[str]) -> Dict[str, Record]:
         """
-        Put the record in the database
+        Get the records for the given keys in a single query
+        
+        Parameters:
+            keys (List[str]): The keys for the records
+            
+        Returns:
+            The records found, by key. Keys without a record are absent.
+        """
+        pass
+
+    @abstractmethod
+    async def put(self, record: Record) -> bool:
+        """
+        Put the record in the database, keeping the record of another writer with the same key
         
         Parameters:
             record (Record): The record to put in the database
+            
+        Returns:
+            Whether the record was inserted
         """
         pass
 
@@ -39,6 +56,16 @@ class BaseCacheDB(ABC):
         """
         pass
     
+    @abstractmethod
+    async def incrementUsageMany(self, counts: Dict[str, int]) -> None:
+        """
+        Increment the usage counts of many records in bulk
+        
+        Parameters:
+            counts (Dict[str, int]): The number of uses to add, by key of the record
+        """
+        pass
+    
     @abstractmethod
     async def getUsageCount(self, key: str) -> int:
         """
@@ -49,6 +76,134 @@ class BaseCacheDB(ABC):
         """
         pass
     
+    @abstractmethod
+    async def getDailyUsage(self, key: str, since: date) -> Dict[date, int]:
+        """
+        Get the number of uses per day of the record for the given key
+        
+        Parameters:
+            key (str): The key for the record
+            since (date): The first day to include
+        """
+        pass
+    
+    @abstractmethod
+    async def pruneUsageLogs(self, before: datetime) -> int:
+        """
+        Delete the raw usage logs older than the given time. Usage counts and daily rollups are kept.
+        
+        Parameters:
+            before (datetime): Logs older than this are deleted
+            
+        Returns:
+            The number of logs deleted
+        """
+        pass
+    
+    @abstractmethod
+    async def getStorageUsage(self) -> List[StorageUsage]:
+        """
+        Get the storage used by the records of each avatar
+        
+        Returns:
+            The total size and number of records, per avatar
+        """
+        pass
+    
+    @abstractmethod
+    async def getEvictionCandidates(
+        self, avatarId: Optional[str], limit: int, by_frequency: bool = False
+    ) -> List[Record]:
+        """
+        Get the unpinned records that are evicted first, least recently used first
+        or, by frequency, least used first with ties broken by recency
+        
+        Parameters:
+            avatarId (Optional[str]): The avatar ID, None for records of all avatars
+            limit (int): Maximum number of records to return
+            by_frequency (bool): Order by usage count instead of last use
+        """
+        pass
+    
+    @abstractmethod
+    async def setPinned(self, key: str, pinned: bool) -> None:
+        """
+        Pin or unpin the record for the given key
+        
+        Parameters:
+            key (str): The key for the record
+            pinned (bool): Whether the record is pinned
+        """
+        pass
+    
+    @abstractmethod
+    async def getStoragePaths(self, avatarId: str) -> List[str]:
+        """
+        Get the storage paths of the files of all the records of the given avatar
+        
+        Parameters:
+            avatarId (str): The avatar ID
+        """
+        pass
+    
+    @abstractmethod
+    async def acquireBlob(self, name: str) -> Optional[str]:
+        """
+        Add a reference to the blob with the given name, if it exists, reviving it if it was released
+        
+        Parameters:
+            name (str): The digest of the content with the file extension
+            
+        Returns:
+            The storage path of the blob, None if there is no such blob
+        """
+        pass
+    
+    @abstractmethod
+    async def createBlob(self, name: str, path: str, size_bytes: int) -> str:
+        """
+        Create the blob with one reference, or add a reference if another writer created it first
+        
+        Parameters:
+            name (str): The digest of the content with the file extension
+            path (str): The storage path of the blob
+            size_bytes (int): The size of the blob
+            
+        Returns:
+            The storage path of the blob
+        """
+        pass
+    
+    @abstractmethod
+    async def releaseBlobs(self, paths: List[str]) -> List[str]:
+        """
+        Remove a reference from each of the blobs at the given paths. Blobs without
+        references left are kept as tombstones until dropped with `dropBlob`, so that a put
+        of the same content revives them. Paths that are not blobs are ignored.
+        
+        Parameters:
+            paths (List[str]): The storage paths, once per reference
+            
+        Returns:
+            The storage paths of the blobs that are no longer referenced
+        """
+        pass
+    
+    @abstractmethod
+    async def dropBlob(self, path: str, remove: Callable[[str], Awaitable[None]]) -> bool:
+        """
+        Delete the file of the blob at the given path and then the blob, if it is still
+        unreferenced. A blob whose file is being deleted cannot be revived by `acquireBlob`.
+        
+        Parameters:
+            path (str): The storage path of the blob
+            remove (Callable[[str], Awaitable[None]]): Deletes the file at the path from storage
+            
+        Returns:
+            Whether the blob was dropped
+        """
+        pass
+    
     @abstractmethod
     async def delete(self, key: str) -> None:
         """
@@ -60,11 +215,24 @@ class BaseCacheDB(ABC):
         pass
 
     @abstractmethod
-    async def deleteAll(self, avatarId: str) -> None:
+    async def delete_many(self, keys: List[str]) -> None:
+        """
+        Delete the records for the given keys in bulk
+        
+        Parameters:
+            keys (List[str]): The keys for the records
+        """
+        pass
+
+    @abstractmethod
+    async def deleteAll(
+        self, avatarId: str, deleted: Optional[Callable[[List[str]], Awaitable[None]]] = None
+    ) -> None:
         """
         Delete all the records for the given avatar
         
         Parameters:
             avatarId (str): The avatar ID
+            deleted (Optional[Callable[[List[str]], Awaitable[None]]]): Called with the storage paths of each batch of records once it is deleted
         """
         pass
\ No newline at end of file
@@ -15,15 +15,27 @@ class Record(Model):
         created (datetime): timestamp when the record was created
         updated (datetime): timestamp of the last update of the record
         metadata (dict): metadata about the record
+        hit_count (int): number of times the record was used
+        last_used_at (datetime): timestamp of the last use of the record
+        size_bytes (int): total size of the files of the record in storage
+        pinned (bool): pinned records are never evicted
+        visemes (list): visemes kept inline in the record instead of storage
+        word_timestamps (list): word timestamps kept inline in the record instead of storage
     """
     id = fields.IntField(pk=True)
     key = fields.CharField(max_length=255, unique=True)   # unique key (also filename) for the file stored in storage.
-    avatarId = fields.CharField(max_length=255)   # unique key for the avatar, also the folder in storage
+    avatarId = fields.CharField(max_length=255, index=True)   # unique key for the avatar, also the folder in storage
     text = fields.TextField()   # text to be converted to audio/video
     storage_paths = fields.JSONField()   # paths where the media and related files are stored
     created = fields.DatetimeField(auto_now_add=True)
     updated = fields.DatetimeField(auto_now=True, null=True)
     metadata = fields.JSONField(null=True)  # metadata about the record
+    hit_count = fields.IntField(default=0)  # number of times the record was used
+    last_used_at = fields.DatetimeField(null=True, index=True)  # timestamp of the last use of the record
+    size_bytes = fields.BigIntField(default=0)  # total size of the files of the record in storage
+    pinned = fields.BooleanField(default=False)  # pinned records are never evicted
+    visemes = fields.JSONField(null=True)  # visemes kept inline in the record instead of storage
+    word_timestamps = fields.JSONField(null=True)  # word timestamps kept inline in the record instead of storage
     
     class Meta:
         table = "records"
@@ -39,8 +51,49 @@ class UsageLog(Model):
         timestamp (datetime): timestamp of the usage
     """
     record = fields.ForeignKeyField('persona_link.Record', related_name='usage_logs', on_delete='CASCADE')
-    timestamp = fields.DatetimeField(auto_now_add=True)
+    timestamp = fields.DatetimeField(auto_now_add=True, index=True)
     
     class Meta:
         app = "persona_link"
-        table = "usage_logs"
\ No newline at end of file
+        table = "usage_logs"
+
+class UsageRollup(Model):
+    """
+    Number of uses of a cache record per day, maintained from the usage stream
+    
+    Attributes:
+        id (int): Primary key for the rollup, managed by the database.
+        record (Record): the record for which the usage is rolled up
+        day (date): the day of the usage
+        hits (int): number of uses of the record on that day
+    """
+    record = fields.ForeignKeyField('persona_link.Record', related_name='usage_rollups', on_delete='CASCADE')
+    day = fields.DateField(index=True)
+    hits = fields.IntField(default=0)
+    
+    class Meta:
+        app = "persona_link"
+        table = "usage_rollups"
+        unique_together = (("record", "day"),)
+
+class Blob(Model):
+    """
+    A file in a content-addressed storage, shared by every record with the same content
+    
+    Attributes:
+        id (int): Primary key for the blob, managed by the database.
+        name (str): digest of the content with the file extension
+        path (str): path of the file in storage
+        size_bytes (int): size of the file
+        refcount (int): number of references from records to the blob
+        created (datetime): timestamp when the blob was created
+    """
+    name = fields.CharField(max_length=255, unique=True)
+    path = fields.CharField(max_length=1024, index=True)
+    size_bytes = fields.BigIntField(default=0)
+    refcount = fields.IntField(default=1)
+    created = fields.DatetimeField(auto_now_add=True)
+    
+    class Meta:
+        app = "persona_link"
+        table = "blobs"
\ No newline at end of file
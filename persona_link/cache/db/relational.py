@@ -1,14 +1,20 @@
 import os
-from typing import Optional
+from collections import Counter, defaultdict
+from datetime import UTC, date, datetime
+from typing import Awaitable, Callable, Dict, List, Optional
 
 from tortoise import Tortoise
-from tortoise.exceptions import DoesNotExist
+from tortoise.exceptions import DoesNotExist, IntegrityError
+from tortoise.expressions import F
+from tortoise.functions import Coalesce, Count, Sum
+from tortoise.transactions import in_transaction
 
-from persona_link.cache.models import Record
+from persona_link.cache.models import Record, StorageUsage
 
 from .base_db import BaseCacheDB
+from .models import Blob
 from .models import Record as DBRecord
-from .models import UsageLog
+from .models import UsageLog, UsageRollup
 
 
 class RelationalDB(BaseCacheDB):
@@ -17,6 +23,10 @@ class RelationalDB(BaseCacheDB):
     Relational DB implementation of the BaseCacheDB. Should work with most Relation DB that [Tortoise ORM](https://tortoise.github.io/) supports.
     """
 
+    QUERY_CHUNK_SIZE = 500
+    # refcount of a released blob whose file is being deleted by `dropBlob`
+    CLAIMED = -1
+
     def __init__(self):
         self.DB_URL = os.getenv("DB_URL", None)
         if not self.DB_URL:
@@ -42,12 +52,34 @@ class RelationalDB(BaseCacheDB):
         except DoesNotExist:
             return None
 
-    async def put(self, record: Record) -> None:
+    async def get_many(self, keys: List[str]) -> Dict[str, Record]:
         """
-        Put the record in the database
+        Get the records for the given keys using `IN (...)` queries
+        
+        Parameters:
+            keys (List[str]): The keys for the records
+            
+        Returns:
+            The records found, by key
+        """
+        records: Dict[str, Record] = {}
+        # stay well below the bound parameter limit of the database
+        for i in range(0, len(keys), self.QUERY_CHUNK_SIZE):
+            chunk = keys[i : i + self.QUERY_CHUNK_SIZE]
+            for record in await DBRecord.filter(key__in=chunk):
+                records[record.key] = Record.model_validate(record.__dict__)
+        return records
+
+    async def put(self, record: Record) -> bool:
+        """
+        Put the record in the database. If another writer has already inserted
+        a record with the same key, that record is kept.
         
         Parameters:
             record (Record): The record to put in the database
+            
+        Returns:
+            Whether the record was inserted, False if a record with the same key was kept
         """
         record_dict = record.model_dump()
         
@@ -56,7 +88,12 @@ class RelationalDB(BaseCacheDB):
         if record.metadata:
             record_dict['metadata'] = record.metadata.model_dump()
             
-        await DBRecord.create(**record_dict)
+        try:
+            await DBRecord.create(**record_dict)
+        except IntegrityError:
+            # same key means the same avatar and text, so the existing record is equivalent
+            return False
+        return True
 
     async def incrementUsage(self, key: str) -> None:
         """
@@ -65,10 +102,64 @@ class RelationalDB(BaseCacheDB):
         Parameters:
             key (str): The key for the record
         """
-        record: DBRecord = await DBRecord.get_or_none(key=key)
-        if not record:
-            print(f"No record found with key {key}")
-        await UsageLog.create(record=record)
+        await self.incrementUsageMany({key: 1})
+
+    async def incrementUsageMany(self, counts: Dict[str, int]) -> None:
+        """
+        Increment the usage counts of many records in bulk. Per chunk of keys this updates the
+        denormalized hit_count and last_used_at of the records, upserts the daily rollups and
+        appends the raw usage logs, in one transaction.
+        
+        Parameters:
+            counts (Dict[str, int]): The number of uses to add, by key of the record
+        """
+        now = datetime.now(UTC)
+        today = now.date()
+        keys = list(counts.keys())
+        for i in range(0, len(keys), self.QUERY_CHUNK_SIZE):
+            chunk = keys[i : i + self.QUERY_CHUNK_SIZE]
+            async with in_transaction():
+                records = await DBRecord.filter(key__in=chunk).only("id", "key")
+                if not records:
+                    continue
+
+                # most keys are used once between flushes, so group the updates by count
+                ids_by_count: Dict[int, List[int]] = defaultdict(list)
+                for record in records:
+                    ids_by_count[counts[record.key]].append(record.id)
+                for count, ids in ids_by_count.items():
+                    await DBRecord.filter(id__in=ids).update(
+                        hit_count=F("hit_count") + count, last_used_at=now
+                    )
+
+                rollups = {
+                    rollup.record_id: rollup.id
+                    for rollup in await UsageRollup.filter(
+                        record_id__in=[record.id for record in records], day=today
+                    ).only("id", "record_id")
+                }
+                rollup_ids_by_count: Dict[int, List[int]] = defaultdict(list)
+                new_rollups = []
+                for record in records:
+                    count = counts[record.key]
+                    if record.id in rollups:
+                        rollup_ids_by_count[count].append(rollups[record.id])
+                    else:
+                        new_rollups.append(
+                            UsageRollup(record_id=record.id, day=today, hits=count)
+                        )
+                for count, ids in rollup_ids_by_count.items():
+                    await UsageRollup.filter(id__in=ids).update(hits=F("hits") + count)
+                if new_rollups:
+                    await UsageRollup.bulk_create(new_rollups)
+
+                await UsageLog.bulk_create(
+                    [
+                        UsageLog(record_id=record.id)
+                        for record in records
+                        for _ in range(counts[record.key])
+                    ]
+                )
         
     async def getUsageCount(self, key: str) -> int:
         """
@@ -77,10 +168,190 @@ class RelationalDB(BaseCacheDB):
         Parameters:
             key (str): The key for the record
         """
-        record = await DBRecord.get_or_none(key=key)
-        if record is None:
-            return 0
-        return await UsageLog.filter(record=record).count()
+        hit_count = await DBRecord.filter(key=key).first().values_list("hit_count", flat=True)
+        return hit_count or 0
+
+    async def getDailyUsage(self, key: str, since: date) -> Dict[date, int]:
+        """
+        Get the number of uses per day of the record for the given key
+        
+        Parameters:
+            key (str): The key for the record
+            since (date): The first day to include
+        """
+        rollups = await UsageRollup.filter(record__key=key, day__gte=since).order_by("day")
+        return {rollup.day: rollup.hits for rollup in rollups}
+
+    async def pruneUsageLogs(self, before: datetime) -> int:
+        """
+        Delete the raw usage logs older than the given time. Usage counts and daily rollups are kept.
+        
+        Parameters:
+            before (datetime): Logs older than this are deleted
+            
+        Returns:
+            The number of logs deleted
+        """
+        return await UsageLog.filter(timestamp__lt=before).delete()
+
+    async def getStorageUsage(self) -> List[StorageUsage]:
+        """
+        Get the storage used by the records of each avatar in one grouped query
+        
+        Returns:
+            The total size and number of records, per avatar
+        """
+        rows = await DBRecord.annotate(
+            total_bytes=Sum("size_bytes"), records=Count("id")
+        ).group_by("avatarId").values("avatarId", "total_bytes", "records")
+        return [
+            StorageUsage(
+                avatarId=row["avatarId"],
+                size_bytes=row["total_bytes"] or 0,
+                records=row["records"],
+            )
+            for row in rows
+        ]
+
+    async def getEvictionCandidates(
+        self, avatarId: Optional[str], limit: int, by_frequency: bool = False
+    ) -> List[Record]:
+        """
+        Get the unpinned records that are evicted first. Records that were never used
+        count as last used when they were created.
+        
+        Parameters:
+            avatarId (Optional[str]): The avatar ID, None for records of all avatars
+            limit (int): Maximum number of records to return
+            by_frequency (bool): Order by usage count instead of last use
+        """
+        query = DBRecord.filter(pinned=False)
+        if avatarId is not None:
+            query = query.filter(avatarId=avatarId)
+        query = query.annotate(used=Coalesce("last_used_at", F("created")))
+        order = ("hit_count", "used") if by_frequency else ("used",)
+        records = await query.order_by(*order).limit(limit)
+        return [Record.model_validate(record.__dict__) for record in records]
+
+    async def setPinned(self, key: str, pinned: bool) -> None:
+        """
+        Pin or unpin the record for the given key
+        
+        Parameters:
+            key (str): The key for the record
+            pinned (bool): Whether the record is pinned
+        """
+        await DBRecord.filter(key=key).update(pinned=pinned)
+
+    async def getStoragePaths(self, avatarId: str) -> List[str]:
+        """
+        Get the storage paths of the files of all the records of the given avatar
+        
+        Parameters:
+            avatarId (str): The avatar ID
+        """
+        rows = await DBRecord.filter(avatarId=avatarId).values_list("storage_paths", flat=True)
+        return [path for paths in rows for path in paths.values() if path]
+
+    async def acquireBlob(self, name: str) -> Optional[str]:
+        """
+        Add a reference to the blob with the given name, if it exists, reviving it if it was released
+        
+        Parameters:
+            name (str): The digest of the content with the file extension
+            
+        Returns:
+            The storage path of the blob, None if there is no such blob
+        """
+        async with in_transaction():
+            # a claimed blob is losing its file, it cannot be revived
+            if not await Blob.filter(name=name, refcount__gte=0).update(refcount=F("refcount") + 1):
+                return None
+            return await Blob.filter(name=name).first().values_list("path", flat=True)
+
+    async def createBlob(self, name: str, path: str, size_bytes: int) -> str:
+        """
+        Create the blob with one reference, or add a reference if another writer created it first
+        
+        Parameters:
+            name (str): The digest of the content with the file extension
+            path (str): The storage path of the blob
+            size_bytes (int): The size of the blob
+            
+        Returns:
+            The storage path of the blob
+        """
+        while True:
+            try:
+                await Blob.create(name=name, path=path, size_bytes=size_bytes)
+                return path
+            except IntegrityError:
+                # another writer created it, unless it was released again in between
+                existing = await self.acquireBlob(name)
+                if existing is not None:
+                    return existing
+                # the file of a claimed blob is being deleted, take the row over for this file
+                if await Blob.filter(name=name, refcount=self.CLAIMED).update(
+                    path=path, size_bytes=size_bytes, refcount=1
+                ):
+                    return path
+
+    async def releaseBlobs(self, paths: List[str]) -> List[str]:
+        """
+        Remove a reference from each of the blobs at the given paths. Blobs without
+        references left are kept as tombstones until dropped with `dropBlob`, so that a put
+        of the same content revives them instead of uploading them again. Paths that are not
+        blobs are ignored.
+        
+        Parameters:
+            paths (List[str]): The storage paths, once per reference
+            
+        Returns:
+            The storage paths of the blobs that are no longer referenced
+        """
+        counts = Counter(paths)
+        unique = list(counts.keys())
+        released: List[str] = []
+        for i in range(0, len(unique), self.QUERY_CHUNK_SIZE):
+            chunk = unique[i : i + self.QUERY_CHUNK_SIZE]
+            async with in_transaction():
+                paths_by_count: Dict[int, List[str]] = defaultdict(list)
+                for path in chunk:
+                    paths_by_count[counts[path]].append(path)
+                for count, grouped in paths_by_count.items():
+                    await Blob.filter(path__in=grouped).update(
+                        refcount=F("refcount") - count
+                    )
+                released.extend(
+                    await Blob.filter(path__in=chunk, refcount=0).values_list("path", flat=True)
+                )
+        return released
+
+    async def dropBlob(self, path: str, remove: Callable[[str], Awaitable[None]]) -> bool:
+        """
+        Delete the file of the blob at the given path and then the blob, if it is still
+        unreferenced. The blob is first claimed with a conditional update, so no transaction or
+        lock is held while the file is deleted. A concurrent `acquireBlob` either revives the
+        blob before the claim or finds it claimed, and `createBlob` then takes the row over
+        for its own file. If the file cannot be deleted the blob is released again.
+        
+        Parameters:
+            path (str): The storage path of the blob
+            remove (Callable[[str], Awaitable[None]]): Deletes the file at the path from storage
+            
+        Returns:
+            Whether the blob was dropped
+        """
+        blob_id = await Blob.filter(path=path, refcount=0).first().values_list("id", flat=True)
+        if blob_id is None or not await Blob.filter(id=blob_id, refcount=0).update(refcount=self.CLAIMED):
+            return False
+        try:
+            await remove(path)
+        except BaseException:
+            await Blob.filter(id=blob_id, refcount=self.CLAIMED).update(refcount=0)
+            raise
+        await Blob.filter(id=blob_id, refcount=self.CLAIMED).delete()
+        return True
 
     async def delete(self, key: str) -> None:
         """
@@ -93,12 +364,33 @@ class RelationalDB(BaseCacheDB):
         if record:
             await record.delete()
 
-    async def deleteAll(self, avatarId: str) -> None:
+    async def delete_many(self, keys: List[str]) -> None:
+        """
+        Delete the records for the given keys using `IN (...)` queries
+        
+        Parameters:
+            keys (List[str]): The keys for the records
+        """
+        for i in range(0, len(keys), self.QUERY_CHUNK_SIZE):
+            await DBRecord.filter(key__in=keys[i : i + self.QUERY_CHUNK_SIZE]).delete()
+
+    async def deleteAll(
+        self, avatarId: str, deleted: Optional[Callable[[List[str]], Awaitable[None]]] = None
+    ) -> None:
         """
-        Delete all the records for the given avatar
+        Delete all the records for the given avatar, `QUERY_CHUNK_SIZE` records per statement
+        so that a large purge never holds a long transaction nor loads every record at once
         
         Parameters:
             avatarId (str): The avatar ID
+            deleted (Optional[Callable[[List[str]], Awaitable[None]]]): Called with the storage paths of each chunk of records once it is deleted
         """
-        records = DBRecord.filter(avatarId=avatarId)
-        await records.delete()
\ No newline at end of file
+        while True:
+            rows = await DBRecord.filter(avatarId=avatarId).limit(self.QUERY_CHUNK_SIZE).values_list(
+                "id", "storage_paths"
+            )
+            if not rows:
+                break
+            await DBRecord.filter(id__in=[id for id, _ in rows]).delete()
+            if deleted is not None:
+                await deleted([path for _, paths in rows for path in paths.values() if path])
\ No newline at end of file
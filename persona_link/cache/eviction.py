@@ -0,0 +1,244 @@
+"""
+Quota based eviction of cache records
+"""
+
+import asyncio
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from .cache import Cache
+from .models import Record, StorageUsage
+
+
+class EvictionPolicy(Enum):
+    """
+    Enum for the order in which records are evicted
+
+    Values:
+    ```
+        LRU  : Least recently used first
+        LFU  : Least frequently used first, ties broken by recency
+        GDSF : Greedy-dual size frequency, lowest frequency * cost / size first
+    ```
+    """
+    LRU = 'lru'
+    LFU = 'lfu'
+    GDSF = 'gdsf'
+
+
+class Quota(BaseModel):
+    """
+    Limits on the storage used by cache records
+
+    Attributes:
+        max_bytes (Optional[int]): Maximum total size of the files of the records, None for no limit
+        max_records (Optional[int]): Maximum number of records, None for no limit
+    """
+    max_bytes: Optional[int] = None
+    max_records: Optional[int] = None
+
+    @property
+    def unlimited(self) -> bool:
+        return self.max_bytes is None and self.max_records is None
+
+    def exceeded(self, size_bytes: int, records: int) -> bool:
+        """
+        Check whether the given usage is over the quota
+
+        Parameters:
+            size_bytes (int): Total size of the files of the records
+            records (int): Number of records
+        """
+        return (self.max_bytes is not None and size_bytes > self.max_bytes) or (
+            self.max_records is not None and records > self.max_records
+        )
+
+    def scaled(self, factor: float) -> "Quota":
+        """
+        Get the quota with its limits multiplied by the given factor
+        """
+        return Quota(
+            max_bytes=None if self.max_bytes is None else int(self.max_bytes * factor),
+            max_records=None if self.max_records is None else int(self.max_records * factor),
+        )
+
+
+class CacheEvictor:
+    """
+    Background sweeper that keeps the cache within a global quota and per-avatar quotas.
+
+    Each sweep reads the storage used per avatar from the database and keeps it as `usage`,
+    for the metrics to export without a query of their own. For every quota that is
+    exceeded it deletes unpinned records in batches, in the order of the eviction policy,
+    until the usage is below the quota minus the headroom. The headroom keeps a cache that is
+    at its limit from being swept again on every new record.
+
+    GDSF ranks a window of the least recently used records by usage count * cost / size, so
+    large records that are rarely used go first and recency ages out formerly popular ones.
+    """
+
+    GDSF_WINDOW = 4
+
+    def __init__(
+        self,
+        cache: Cache,
+        policy: EvictionPolicy = EvictionPolicy.LRU,
+        quota: Optional[Quota] = None,
+        avatar_quota: Optional[Quota] = None,
+        interval: float = 300.0,
+        batch_size: int = 100,
+        headroom: float = 0.1,
+        cost: Optional[Callable[[Record], float]] = None,
+    ):
+        """
+        Constructor for CacheEvictor class.
+
+        Parameters:
+            cache (Cache): The cache to evict records from
+            policy (EvictionPolicy): The order in which records are evicted
+            quota (Optional[Quota]): Quota for the records of all avatars together
+            avatar_quota (Optional[Quota]): Default quota for the records of each avatar
+            interval (float): Seconds between periodic sweeps
+            batch_size (int): Maximum number of records deleted at a time
+            headroom (float): Fraction of a quota freed below its limit once it is exceeded
+            cost (Optional[Callable[[Record], float]]): Cost of generating a record again, used by GDSF. Defaults to 1 for every record
+        """
+        if cache is None:
+            raise ValueError("cache cannot be None")
+        self.cache = cache
+        self.policy = policy
+        self.quota = quota or Quota()
+        self.avatar_quota = avatar_quota or Quota()
+        self.avatar_quotas: Dict[str, Quota] = {}
+        self.interval = interval
+        self.batch_size = batch_size
+        self.headroom = headroom
+        self.cost = cost or (lambda record: 1.0)
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self.usage: Optional[List[StorageUsage]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def set_quota(self, avatarId: str, quota: Optional[Quota]) -> None:
+        """
+        Override the quota for the given avatar
+
+        Parameters:
+            avatarId (str): The avatar ID
+            quota (Optional[Quota]): Quota for the avatar, None to use the default avatar quota
+        """
+        if quota is None:
+            self.avatar_quotas.pop(avatarId, None)
+        else:
+            self.avatar_quotas[avatarId] = quota
+
+    def _rank(self, candidates: List[Record]) -> List[Record]:
+        if self.policy != EvictionPolicy.GDSF:
+            return candidates
+        return sorted(
+            candidates,
+            key=lambda r: (r.hit_count + 1) * self.cost(r) / max(r.size_bytes, 1),
+        )
+
+    async def _enforce(
+        self, quota: Quota, size_bytes: int, records: int, avatarId: Optional[str] = None
+    ) -> Tuple[int, int]:
+        """
+        Evict records until the usage is below the quota minus the headroom
+
+        Returns:
+            The number of records and bytes evicted
+        """
+        if not quota.exceeded(size_bytes, records):
+            return 0, 0
+        target = quota.scaled(1 - self.headroom)
+        window = self.batch_size
+        if self.policy == EvictionPolicy.GDSF:
+            window *= self.GDSF_WINDOW
+
+        evicted_records = evicted_bytes = 0
+        while target.exceeded(size_bytes - evicted_bytes, records - evicted_records):
+            candidates = await self.cache.db.getEvictionCandidates(
+                avatarId, window, by_frequency=self.policy == EvictionPolicy.LFU
+            )
+            if not candidates:
+                # everything left is pinned
+                break
+            victims = []
+            for record in self._rank(candidates)[: self.batch_size]:
+                if not target.exceeded(
+                    size_bytes - evicted_bytes, records - evicted_records
+                ):
+                    break
+                victims.append(record)
+                evicted_records += 1
+                evicted_bytes += record.size_bytes
+            await self.cache.delete_many(victims)
+        return evicted_records, evicted_bytes
+
+    async def sweep(self) -> int:
+        """
+        Read the storage used per avatar, then enforce the per-avatar quotas and the global quota
+
+        Returns:
+            The number of records evicted
+        """
+        usage = self.usage = await self.cache.db.getStorageUsage()
+        if (
+            self.quota.unlimited
+            and self.avatar_quota.unlimited
+            and not self.avatar_quotas
+        ):
+            return 0
+
+        total_bytes = sum(u.size_bytes for u in usage)
+        total_records = sum(u.records for u in usage)
+        evicted_records = evicted_bytes = 0
+        for u in usage:
+            quota = self.avatar_quotas.get(u.avatarId, self.avatar_quota)
+            records, size_bytes = await self._enforce(
+                quota, u.size_bytes, u.records, u.avatarId
+            )
+            evicted_records += records
+            evicted_bytes += size_bytes
+
+        records, size_bytes = await self._enforce(
+            self.quota, total_bytes - evicted_bytes, total_records - evicted_records
+        )
+        evicted_records += records
+        evicted_bytes += size_bytes
+
+        self.evicted += evicted_records
+        self.evicted_bytes += evicted_bytes
+        if evicted_records:
+            self.usage = await self.cache.db.getStorageUsage()
+        return evicted_records
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Cache eviction sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """
+        Start the periodic sweeping in the running event loop
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the periodic sweeping
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -1,8 +1,15 @@
 """
-Hash methods that can be used to hash data.
+Hash methods that can be used to hash data, and derivation of cache keys from them.
 """
 
 import hashlib
+import json
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel
+
+# settings that choose how the media is produced, not the voice or text it has
+UNKEYED_SETTINGS = frozenset({"segmented"})
 
 
 def sha256hash(data: any) -> str:
@@ -29,3 +36,65 @@ def md5hash(data: any) -> str:
     """
     return hashlib.md5(str(data).encode()).hexdigest()
 
+def blake2bhash(data: any) -> str:
+    """
+    Generate a 128 bit BLAKE2b hash for the given data. It is faster than MD5 and SHA256
+    and gives a compact fixed length key of 32 hex characters.
+    
+    Parameters:
+        data (any): The data to hash
+        
+    Returns:
+        str: The BLAKE2b hash of the data
+    """
+    return hashlib.blake2b(str(data).encode(), digest_size=16).hexdigest()
+
+def _keyed(settings: Any) -> Any:
+    if isinstance(settings, dict):
+        return {k: _keyed(v) for k, v in settings.items() if k not in UNKEYED_SETTINGS}
+    return settings
+
+def settings_fingerprint(settings: Optional[BaseModel | dict]) -> str:
+    """
+    Generate a fingerprint of the validated settings of an avatar. Any change
+    of the settings changes the fingerprint, except for the settings in `UNKEYED_SETTINGS`.
+    
+    Parameters:
+        settings (Optional[BaseModel | dict]): The settings, validated or as a dict
+        
+    Returns:
+        str: The fingerprint of the settings, empty if there are no settings
+    """
+    if settings is None:
+        return ""
+    if isinstance(settings, BaseModel):
+        # serialize_as_any keeps the fields of subclasses such as the audio settings of a sprite
+        settings = settings.model_dump(mode="json", serialize_as_any=True)
+    return blake2bhash(json.dumps(_keyed(settings), sort_keys=True, separators=(",", ":")))
+
+def derive_key(
+    avatarId: str,
+    text: str,
+    settings: Optional[BaseModel | dict] = None,
+    hashFn: Callable[[Any], str] = blake2bhash,
+) -> str:
+    """
+    Derive the cache key for the text spoken by an avatar with the given settings.
+    The fields are encoded unambiguously before hashing, so different avatar and
+    text pairs never share a key, and a change of settings switches to a new set of keys.
+    
+    Parameters:
+        avatarId (str): The avatar ID
+        text (str): The text, already normalized
+        settings (Optional[BaseModel | dict]): The settings of the avatar
+        hashFn (Callable[[Any], str]): The hashing function
+        
+    Returns:
+        str: The cache key
+    """
+    payload = json.dumps(
+        [avatarId, settings_fingerprint(settings), text],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashFn(payload)
@@ -0,0 +1,177 @@
+"""
+In-process memory tier for the cache
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from persona_link.persona_provider.models import Urls
+
+from .models import Record
+
+
+@dataclass
+class _Entry:
+    record: Record
+    record_expiry: float
+    urls: Optional[Urls] = None
+    urls_expiry: float = 0.0
+
+
+class MemoryCache:
+    """
+    Bounded in-process LRU tier that sits in front of the cache database and storage.
+    It holds cache records and their resolved urls so that repeated lookups of the
+    same text never touch the database or the blob storage.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 300,
+        url_margin_seconds: float = 60,
+    ):
+        """
+        Constructor for MemoryCache class.
+
+        Parameters:
+            max_entries (int): Maximum number of records to keep, least recently used are evicted first
+            ttl_seconds (float): Time to live of an entry in seconds
+            url_margin_seconds (float): Urls are dropped this many seconds before the storage expires them
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.url_margin_seconds = url_margin_seconds
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.url_hits = 0
+        self.url_misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.record_expiry <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_record(self, key: str) -> Optional[Record]:
+        """
+        Get the record for the given key
+
+        Parameters:
+            key (str): The key for the record
+
+        Returns:
+            The record if it is held and not expired, None otherwise
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.record
+
+    def put_record(self, record: Record) -> None:
+        """
+        Hold the record, evicting the least recently used records beyond max_entries
+
+        Parameters:
+            record (Record): The record to hold
+        """
+        entry = self._entries.get(record.key)
+        expiry = time.monotonic() + self.ttl_seconds
+        if entry is None:
+            self._entries[record.key] = _Entry(record=record, record_expiry=expiry)
+        else:
+            entry.record = record
+            entry.record_expiry = expiry
+        self._entries.move_to_end(record.key)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_urls(self, key: str) -> Optional[Urls]:
+        """
+        Get the resolved urls for the record with the given key
+
+        Parameters:
+            key (str): The key for the record
+
+        Returns:
+            The urls if they are held and still valid, None otherwise
+        """
+        entry = self._lookup(key)
+        if entry is None or entry.urls is None or entry.urls_expiry <= time.monotonic():
+            self.url_misses += 1
+            return None
+        self.url_hits += 1
+        return entry.urls
+
+    def put_urls(self, key: str, urls: Urls, expiry_seconds: Optional[float] = None) -> None:
+        """
+        Hold the resolved urls for a record that is already held
+
+        Parameters:
+            key (str): The key for the record
+            urls (Urls): The resolved urls
+            expiry_seconds (Optional[float]): Seconds after which the storage expires the urls, None if they never expire
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        ttl = self.ttl_seconds
+        if expiry_seconds is not None:
+            ttl = min(ttl, expiry_seconds - self.url_margin_seconds)
+        if ttl <= 0:
+            return
+        entry.urls = urls
+        entry.urls_expiry = time.monotonic() + ttl
+
+    def invalidate(self, key: str) -> None:
+        """
+        Drop the entry for the given key
+
+        Parameters:
+            key (str): The key for the record
+        """
+        self._entries.pop(key, None)
+
+    def invalidateAll(self, avatarId: str) -> None:
+        """
+        Drop all the entries for the given avatar
+
+        Parameters:
+            avatarId (str): The avatar ID
+        """
+        for key in [k for k, e in self._entries.items() if e.record.avatarId == avatarId]:
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        """
+        Get the counters of the memory tier
+
+        Returns:
+            dict with size, hits, misses, url_hits, url_misses and evictions
+        """
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "url_hits": self.url_hits,
+            "url_misses": self.url_misses,
+            "evictions": self.evictions,
+        }
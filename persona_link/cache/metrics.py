@@ -0,0 +1,257 @@
+"""
+In-process metrics of the cache and of the generation of avatars, exported in the Prometheus text format
+"""
+
+import bisect
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from .models import StorageUsage, TransferStats
+
+# seconds, from a memory lookup to a video render
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+)
+
+
+class Histogram:
+    """
+    Cumulative histogram of observed values, as Prometheus histograms are
+
+    Attributes:
+        buckets (Tuple[float, ...]): Upper bounds of the buckets, ascending
+        counts (List[int]): Number of observations in each bucket and above the last one
+        sum (float): Sum of the observed values
+        count (int): Number of observations
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Add an observation
+
+        Parameters:
+            value (float): The observed value
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels: str) -> str:
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+class CacheMetrics:
+    """
+    Counters of cache hits and misses per avatar and provider, latency histograms per
+    operation and provider, and the bytes written to storage per avatar. Hits that only matched
+    their record after text normalization are counted per avatar as merged.
+
+    Recording is a dictionary update, cheap enough for every call. The operations timed by the
+    cache are `db_get`, `db_get_many`, `storage_put`, `storage_read` and `url_sign`, and the
+    persona providers time `generate`. Streaming uploads reported by the storage are timed as
+    `storage_transfer`, with their bytes, block retries and the most memory one held.
+    """
+
+    PREFIX = "persona_link"
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        Constructor for CacheMetrics class.
+
+        Parameters:
+            buckets (Tuple[float, ...]): Upper bounds of the latency buckets in seconds
+        """
+        self.buckets = buckets
+        self.lookups: Counter[Tuple[str, str, str]] = Counter()
+        self.bytes_written: Counter[str] = Counter()
+        self.merges: Counter[str] = Counter()
+        self.latencies: Dict[Tuple[str, str], Histogram] = {}
+        self.transfer_bytes = 0
+        self.transfer_retries = 0
+        self.transfer_peak_buffered_bytes = 0
+
+    def hit(self, avatarId: str, provider: str) -> None:
+        """
+        Count a lookup that was served from the cache
+
+        Parameters:
+            avatarId (str): The avatar ID
+            provider (str): The name of the provider of the avatar
+        """
+        self.lookups[(avatarId, provider, "hit")] += 1
+
+    def miss(self, avatarId: str, provider: str) -> None:
+        """
+        Count a lookup that had to be generated
+
+        Parameters:
+            avatarId (str): The avatar ID
+            provider (str): The name of the provider of the avatar
+        """
+        self.lookups[(avatarId, provider, "miss")] += 1
+
+    def merged(self, avatarId: str) -> None:
+        """
+        Count a hit whose text only matched the key of its record once normalized
+
+        Parameters:
+            avatarId (str): The avatar ID
+        """
+        self.merges[avatarId] += 1
+
+    def hit_ratio(self, avatarId: Optional[str] = None) -> Optional[float]:
+        """
+        Get the share of lookups served from the cache
+
+        Parameters:
+            avatarId (Optional[str]): The avatar ID, None for all avatars
+
+        Returns:
+            The hit ratio, None if there were no lookups
+        """
+        hits = misses = 0
+        for (avatar, _, result), count in self.lookups.items():
+            if avatarId is not None and avatar != avatarId:
+                continue
+            if result == "hit":
+                hits += count
+            else:
+                misses += count
+        return hits / (hits + misses) if hits + misses else None
+
+    def observe(self, operation: str, seconds: float, provider: str = "") -> None:
+        """
+        Record the latency of an operation
+
+        Parameters:
+            operation (str): The name of the operation
+            seconds (float): How long the operation took
+            provider (str): The name of the provider, for operations of a provider
+        """
+        histogram = self.latencies.get((operation, provider))
+        if histogram is None:
+            histogram = self.latencies[(operation, provider)] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def since(self, operation: str, start: float, provider: str = "") -> None:
+        """
+        Record the latency of an operation that started at the given `time.perf_counter()`
+
+        Parameters:
+            operation (str): The name of the operation
+            start (float): The `time.perf_counter()` when the operation started
+            provider (str): The name of the provider, for operations of a provider
+        """
+        self.observe(operation, time.perf_counter() - start, provider)
+
+    def stored(self, avatarId: str, size_bytes: int) -> None:
+        """
+        Count the bytes written to storage for a record
+
+        Parameters:
+            avatarId (str): The avatar ID
+            size_bytes (int): The size of the files of the record
+        """
+        self.bytes_written[avatarId] += size_bytes
+
+    def transferred(self, stats: TransferStats) -> None:
+        """
+        Record a streaming upload to storage
+
+        Parameters:
+            stats (TransferStats): The statistics of the upload
+        """
+        self.observe("storage_transfer", stats.seconds)
+        self.transfer_bytes += stats.size_bytes
+        self.transfer_retries += stats.retries
+        self.transfer_peak_buffered_bytes = max(
+            self.transfer_peak_buffered_bytes, stats.peak_buffered_bytes
+        )
+
+    def render(self, usage: Optional[List[StorageUsage]] = None) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format
+
+        Parameters:
+            usage (Optional[List[StorageUsage]]): Storage used per avatar, exported as gauges if given
+
+        Returns:
+            The metrics
+        """
+        p = self.PREFIX
+        lines = [
+            f"# HELP {p}_cache_lookups_total Lookups of rendered avatars by result",
+            f"# TYPE {p}_cache_lookups_total counter",
+        ]
+        for (avatar, provider, result), count in sorted(self.lookups.items()):
+            lines.append(
+                f"{p}_cache_lookups_total{_labels(avatar=avatar, provider=provider, result=result)} {count}"
+            )
+
+        lines += [
+            f"# HELP {p}_cache_merged_total Hits whose text only matched the record once normalized",
+            f"# TYPE {p}_cache_merged_total counter",
+        ]
+        for avatar, count in sorted(self.merges.items()):
+            lines.append(f"{p}_cache_merged_total{_labels(avatar=avatar)} {count}")
+
+        lines += [
+            f"# HELP {p}_cache_written_bytes_total Bytes written to storage",
+            f"# TYPE {p}_cache_written_bytes_total counter",
+        ]
+        for avatar, size in sorted(self.bytes_written.items()):
+            lines.append(f"{p}_cache_written_bytes_total{_labels(avatar=avatar)} {size}")
+
+        lines += [
+            f"# HELP {p}_storage_transfer_bytes_total Bytes uploaded by streaming transfers",
+            f"# TYPE {p}_storage_transfer_bytes_total counter",
+            f"{p}_storage_transfer_bytes_total {self.transfer_bytes}",
+            f"# HELP {p}_storage_transfer_retries_total Block uploads retried by streaming transfers",
+            f"# TYPE {p}_storage_transfer_retries_total counter",
+            f"{p}_storage_transfer_retries_total {self.transfer_retries}",
+            f"# HELP {p}_storage_transfer_buffered_bytes_peak Most memory held by one streaming transfer",
+            f"# TYPE {p}_storage_transfer_buffered_bytes_peak gauge",
+            f"{p}_storage_transfer_buffered_bytes_peak {self.transfer_peak_buffered_bytes}",
+        ]
+
+        if usage is not None:
+            lines += [
+                f"# HELP {p}_cache_stored_bytes Bytes in storage",
+                f"# TYPE {p}_cache_stored_bytes gauge",
+            ]
+            lines += [
+                f"{p}_cache_stored_bytes{_labels(avatar=u.avatarId)} {u.size_bytes}"
+                for u in usage
+            ]
+            lines += [
+                f"# HELP {p}_cache_records Records in the cache",
+                f"# TYPE {p}_cache_records gauge",
+            ]
+            lines += [f"{p}_cache_records{_labels(avatar=u.avatarId)} {u.records}" for u in usage]
+
+        lines += [
+            f"# HELP {p}_operation_seconds Latency of cache operations and generations",
+            f"# TYPE {p}_operation_seconds histogram",
+        ]
+        for (operation, provider), histogram in sorted(self.latencies.items()):
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                cumulative += count
+                labels = _labels(operation=operation, provider=provider, le=str(bound))
+                lines.append(f"{p}_operation_seconds_bucket{labels} {cumulative}")
+            labels = _labels(operation=operation, provider=provider)
+            lines.append(f"{p}_operation_seconds_sum{labels} {histogram.sum}")
+            lines.append(f"{p}_operation_seconds_count{labels} {histogram.count}")
+        return "\n".join(lines) + "\n"
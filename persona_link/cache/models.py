@@ -14,11 +14,12 @@ class ContentType(Enum):
     
     Values:
     ```
-        MP4  : MP4 video content type
-        MP3  : MP3 audio content type
-        WAV  : WAV audio content type
-        WEBM : WEBM video content type
-        JSON : JSON metadata content type
+        MP4    : MP4 video content type
+        MP3    : MP3 audio content type
+        WAV    : WAV audio content type
+        WEBM   : WEBM video content type
+        JSON   : JSON metadata content type
+        BINARY : Binary sidecar content type
     ```
     """
     MP4 = 'video/mp4'
@@ -26,13 +27,15 @@ class ContentType(Enum):
     WAV = 'audio/wav'
     WEBM = 'video/webm'
     JSON = 'application/json'
+    BINARY = 'application/octet-stream'
 
 EXTENSION_MAPPING = {
     ContentType.MP4: '.mp4',
     ContentType.MP3: '.mp3',
     ContentType.WAV: '.wav',
     ContentType.WEBM: '.webm',
-    ContentType.JSON: '.json'
+    ContentType.JSON: '.json',
+    ContentType.BINARY: '.bin'
 }
 class PathType(Enum):
     """
@@ -43,11 +46,13 @@ class PathType(Enum):
         MEDIA           : Media path
         VISEMES         : Visemes path
         WORD_TIMESTAMPS : Word timestamps path
+        SIDECAR         : Binary sidecar path
     ```
     """
     MEDIA = 'media'
     VISEMES = 'visemes'
     WORD_TIMESTAMPS = 'word_timestamps'
+    SIDECAR = 'sidecar'
 class StoragePaths(BaseModel):
     """
     Model for the storage paths of the data
@@ -56,10 +61,22 @@ class StoragePaths(BaseModel):
         media_path (str): Media path
         viseme_path (Optional[str]): Visemes path
         word_timestamp_path (Optional[str]): Word timestamps path
+        sidecar_path (Optional[str]): Binary sidecar path, with both the visemes and the word timestamps
     """
     media_path: str
     visemes_path: Optional[str]
     word_timestamps_path: Optional[str]
+    sidecar_path: Optional[str] = None
+
+    def all(self) -> List[str]:
+        """
+        Get the paths of all the files of the record
+        """
+        return [
+            path
+            for path in (self.media_path, self.visemes_path, self.word_timestamps_path, self.sidecar_path)
+            if path
+        ]
 
     
 class DataToStore(BaseModel):
@@ -68,7 +85,8 @@ class DataToStore(BaseModel):
     
     Attributes:
         data_type (AvatarType): Type of the data
-        binary_data (bytes | AsyncGenerator[bytes, None]): Binary data to be stored
+        binary_data (Optional[bytes | AsyncGenerator[bytes, None]]): Binary data to be stored, None if given by source_url
+        source_url (Optional[str]): Url the storage copies the data from, instead of binary_data
         content_type (ContentType): Content type of the data
         visemes (Optional[List[Viseme]]): Visemes for the data
         word_timestamps (Optional[List[WordTimestamp]]): Word timestamps for the data
@@ -77,7 +95,8 @@ class DataToStore(BaseModel):
     model_config = ConfigDict(arbitrary_types_allowed=True)
     
     data_type: AvatarType
-    binary_data: bytes | AsyncGenerator[bytes, None]    # binary data to be stored
+    binary_data: Optional[bytes | AsyncGenerator[bytes, None]] = None    # binary data to be stored
+    source_url: Optional[str] = None    # url to copy the data from, instead of binary data
     content_type: ContentType
     visemes:  Optional[List[Viseme]] = None
     word_timestamps: Optional[List[WordTimestamp]] = None
@@ -95,6 +114,12 @@ class Record(BaseModel):
         created (datetime): timestamp when the record was created
         updated (Optional[datetime]): timestamp of the last update of the record
         metadata (Optional[Metadata]): metadata about the record
+        hit_count (int): number of times the record was used
+        last_used_at (Optional[datetime]): timestamp of the last use of the record
+        size_bytes (int): total size of the files of the record in storage
+        pinned (bool): pinned records are never evicted
+        visemes (Optional[List[Viseme]]): visemes kept inline in the record instead of storage
+        word_timestamps (Optional[List[WordTimestamp]]): word timestamps kept inline in the record instead of storage
     """
     model_config = ConfigDict(from_attributes = True)
     
@@ -105,11 +130,53 @@ class Record(BaseModel):
     created: datetime
     updated: Optional[datetime] = None
     metadata: Optional[Metadata] = None
+    hit_count: int = 0
+    last_used_at: Optional[datetime] = None
+    size_bytes: int = 0
+    pinned: bool = False
+    visemes: Optional[List[Viseme]] = None
+    word_timestamps: Optional[List[WordTimestamp]] = None
 
     @classmethod
     def from_db(cls, record: Dict) -> "Record":
         return cls(**record)
 
+class StorageUsage(BaseModel):
+    """
+    Storage used by the cache records of an avatar
+    
+    Attributes:
+        avatarId (str): unique key for the avatar
+        size_bytes (int): total size of the files of the records in storage
+        records (int): number of records
+    """
+    avatarId: str
+    size_bytes: int
+    records: int
+
+class TransferStats(BaseModel):
+    """
+    Statistics of a streaming transfer of a file into storage
+    
+    Attributes:
+        path (str): path of the file in storage
+        size_bytes (int): bytes transferred
+        seconds (float): duration of the transfer
+        blocks (int): number of blocks the file was uploaded in
+        retries (int): number of block uploads that were retried
+        peak_buffered_bytes (int): most bytes held in memory at a time during the transfer
+    """
+    path: str
+    size_bytes: int
+    seconds: float
+    blocks: int = 1
+    retries: int = 0
+    peak_buffered_bytes: int = 0
+
+    @property
+    def throughput_bytes_per_second(self) -> float:
+        return self.size_bytes / self.seconds if self.seconds > 0 else 0.0
+
 class UsageLog(BaseModel):
     """
     A log of usage of a cache record
@@ -0,0 +1,131 @@
+"""
+Negative caching of failed generations
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class Failure:
+    """
+    A failed generation held by the negative cache
+
+    Attributes:
+        reason (str): Why the generation failed
+        failures (int): Number of consecutive failures
+        retry_at (float): Monotonic time after which the generation may be retried
+        forget_at (float): Monotonic time after which the failures are forgotten
+    """
+    reason: str
+    failures: int
+    retry_at: float
+    forget_at: float
+
+    @property
+    def retry_after(self) -> float:
+        """
+        Seconds until the generation may be retried
+        """
+        return max(self.retry_at - time.monotonic(), 0.0)
+
+
+class NegativeCache:
+    """
+    Bounded in-process record of generations that failed, by cache key.
+
+    After a failure the key is blocked for `base_seconds`, and every consecutive failure
+    multiplies the block by `factor` up to `max_seconds`, so that a text the provider rejects
+    is not sent to it again on every request. A success clears the key. Failures that are
+    not followed by another attempt within `max_seconds` of their block ending are forgotten.
+    """
+
+    def __init__(
+        self,
+        base_seconds: float = 30,
+        max_seconds: float = 3600,
+        factor: float = 2.0,
+        max_entries: int = 10000,
+    ):
+        """
+        Constructor for NegativeCache class.
+
+        Parameters:
+            base_seconds (float): Seconds a key is blocked after its first failure
+            max_seconds (float): Maximum seconds a key is blocked
+            factor (float): Multiplier of the block for every consecutive failure
+            max_entries (int): Maximum number of failed keys to keep, oldest are dropped first
+        """
+        if max_entries <= 0:
+            raise ValueError("max_entries must be positive")
+        self.base_seconds = base_seconds
+        self.max_seconds = max_seconds
+        self.factor = factor
+        self.max_entries = max_entries
+        self._failures: OrderedDict[str, Failure] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._failures)
+
+    def get(self, key: str) -> Optional[Failure]:
+        """
+        Get the failure of the given key while the key is blocked
+
+        Parameters:
+            key (str): The cache key
+
+        Returns:
+            The failure, None if the key is not blocked
+        """
+        failure = self._failures.get(key)
+        if failure is None:
+            return None
+        now = time.monotonic()
+        if now >= failure.forget_at:
+            del self._failures[key]
+            return None
+        if now >= failure.retry_at:
+            return None
+        return failure
+
+    def add(self, key: str, reason: str) -> Failure:
+        """
+        Record a failed generation and block the key with exponential backoff
+
+        Parameters:
+            key (str): The cache key
+            reason (str): Why the generation failed
+
+        Returns:
+            The failure with the time after which the generation may be retried
+        """
+        now = time.monotonic()
+        previous = self._failures.pop(key, None)
+        failures = 1
+        if previous is not None and now < previous.forget_at:
+            failures = previous.failures + 1
+        # bound the exponent, the block is capped long before it would overflow
+        block = min(
+            self.base_seconds * self.factor ** min(failures - 1, 64), self.max_seconds
+        )
+        failure = Failure(
+            reason=reason,
+            failures=failures,
+            retry_at=now + block,
+            forget_at=now + block + self.max_seconds,
+        )
+        self._failures[key] = failure
+        while len(self._failures) > self.max_entries:
+            self._failures.popitem(last=False)
+        return failure
+
+    def clear(self, key: str) -> None:
+        """
+        Forget the failures of the given key, after a successful generation
+
+        Parameters:
+            key (str): The cache key
+        """
+        self._failures.pop(key, None)
@@ -0,0 +1,89 @@
+"""
+Normalization of text before it is hashed into a cache key
+"""
+
+import re
+import unicodedata
+
+_WHITESPACE = re.compile(r"\s+")
+_SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([,.!?;:])")
+
+QUOTES = str.maketrans(
+    {
+        "‘": "'",  # left single quotation mark
+        "’": "'",  # right single quotation mark
+        "‚": "'",  # single low-9 quotation mark
+        "′": "'",  # prime
+        "“": '"',  # left double quotation mark
+        "”": '"',  # right double quotation mark
+        "„": '"',  # double low-9 quotation mark
+        "«": '"',  # left-pointing double angle quotation mark
+        "»": '"',  # right-pointing double angle quotation mark
+    }
+)
+
+PUNCTUATION = str.maketrans(
+    {
+        "…": "...",  # horizontal ellipsis
+        "‐": "-",  # hyphen
+        "‑": "-",  # non-breaking hyphen
+        "–": "-",  # en dash
+        "—": "-",  # em dash
+    }
+)
+
+
+class TextNormalizer:
+    """
+    Normalizes text so that texts which would be spoken the same way map to the same cache key.
+
+    Normalization applies, in order: Unicode NFC, optional quote canonicalization, optional
+    punctuation canonicalization, whitespace collapsing and trimming.
+    """
+
+    def __init__(
+        self,
+        nfc: bool = True,
+        collapse_whitespace: bool = True,
+        strip: bool = True,
+        canonicalize_quotes: bool = False,
+        canonicalize_punctuation: bool = False,
+    ):
+        """
+        Constructor for TextNormalizer class.
+
+        Parameters:
+            nfc (bool): Compose the text to Unicode normalization form C
+            collapse_whitespace (bool): Replace runs of whitespace with a single space
+            strip (bool): Remove leading and trailing whitespace
+            canonicalize_quotes (bool): Replace typographic quotes with ASCII quotes
+            canonicalize_punctuation (bool): Replace ellipsis and dashes with ASCII and drop whitespace before punctuation
+        """
+        self.nfc = nfc
+        self.collapse_whitespace = collapse_whitespace
+        self.strip = strip
+        self.canonicalize_quotes = canonicalize_quotes
+        self.canonicalize_punctuation = canonicalize_punctuation
+
+    def __call__(self, text: str) -> str:
+        """
+        Normalize the text
+
+        Parameters:
+            text (str): The text to normalize
+
+        Returns:
+            The normalized text
+        """
+        if self.nfc:
+            text = unicodedata.normalize("NFC", text)
+        if self.canonicalize_quotes:
+            text = text.translate(QUOTES)
+        if self.canonicalize_punctuation:
+            text = text.translate(PUNCTUATION)
+            text = _SPACE_BEFORE_PUNCTUATION.sub(r"\1", text)
+        if self.collapse_whitespace:
+            text = _WHITESPACE.sub(" ", text)
+        if self.strip:
+            text = text.strip()
+        return text
@@ -0,0 +1,191 @@
+"""
+Compact binary sidecar bundling the visemes and word timestamps of a record in one file.
+
+Layout, little endian:
+```
+    header : magic "PLSC", version (u8), flags (u8)
+    body   : zlib compressed if the flags say so
+        counts  : number of visemes (u32), number of word timestamps (u32)
+        columns : i32 arrays in this order
+                  viseme offset deltas, viseme ids,
+                  word offset deltas, word durations, word text offset deltas,
+                  word lengths, UTF-8 byte lengths of the words
+        words   : the UTF-8 words, concatenated
+```
+Offsets are stored as the difference to the previous offset, which keeps the columns
+small and repetitive so that they compress well.
+"""
+
+import json
+import struct
+import zlib
+from enum import Enum
+from itertools import accumulate
+from typing import List, Optional, Tuple
+
+from persona_link.persona_provider.models import Viseme, WordTimestamp
+
+MAGIC = b"PLSC"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sBB")
+_COUNTS = struct.Struct("<II")
+
+_COMPRESSED = 0x01
+_HAS_VISEMES = 0x02
+_HAS_WORD_TIMESTAMPS = 0x04
+
+# bodies smaller than this are not worth the zlib header
+_MIN_COMPRESS_BYTES = 64
+
+
+class SidecarFormat(Enum):
+    """
+    Enum for the format the visemes and word timestamps of a record are stored in
+
+    Values:
+    ```
+        JSON   : A JSON file each for the visemes and the word timestamps
+        BINARY : One compact binary sidecar with both
+    ```
+    """
+    JSON = 'json'
+    BINARY = 'binary'
+
+
+def _deltas(values: List[int]) -> List[int]:
+    return [value - previous for previous, value in zip([0, *values], values)]
+
+
+def encode_sidecar(
+    visemes: Optional[List[Viseme]],
+    word_timestamps: Optional[List[WordTimestamp]],
+    compress: bool = True,
+) -> bytes:
+    """
+    Encode the visemes and word timestamps into a binary sidecar
+
+    Parameters:
+        visemes (Optional[List[Viseme]]): The visemes, None if the record has none
+        word_timestamps (Optional[List[WordTimestamp]]): The word timestamps, None if the record has none
+        compress (bool): Whether to compress the body when that makes it smaller
+
+    Returns:
+        The sidecar
+    """
+    flags = 0
+    if visemes is not None:
+        flags |= _HAS_VISEMES
+    if word_timestamps is not None:
+        flags |= _HAS_WORD_TIMESTAMPS
+    visemes = visemes or []
+    word_timestamps = word_timestamps or []
+
+    words = [w.word.encode("utf-8") for w in word_timestamps]
+    columns = [
+        *_deltas([v.offset for v in visemes]),
+        *(v.viseme for v in visemes),
+        *_deltas([w.offset for w in word_timestamps]),
+        *(w.duration for w in word_timestamps),
+        *_deltas([w.text_offset for w in word_timestamps]),
+        *(w.word_length for w in word_timestamps),
+        *(len(word) for word in words),
+    ]
+    body = (
+        _COUNTS.pack(len(visemes), len(word_timestamps))
+        + struct.pack(f"<{len(columns)}i", *columns)
+        + b"".join(words)
+    )
+    if compress and len(body) >= _MIN_COMPRESS_BYTES:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= _COMPRESSED
+    return _HEADER.pack(MAGIC, VERSION, flags) + body
+
+
+def decode_sidecar(
+    data: bytes,
+) -> Tuple[Optional[List[Viseme]], Optional[List[WordTimestamp]]]:
+    """
+    Decode a binary sidecar
+
+    Parameters:
+        data (bytes): The sidecar
+
+    Returns:
+        The visemes and the word timestamps, None for those the sidecar does not have
+    """
+    magic, version, flags = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a version {VERSION} sidecar")
+    body = data[_HEADER.size :]
+    if flags & _COMPRESSED:
+        body = zlib.decompress(body)
+
+    n_visemes, n_words = _COUNTS.unpack_from(body)
+    n_columns = 2 * n_visemes + 5 * n_words
+    columns = struct.unpack_from(f"<{n_columns}i", body, _COUNTS.size)
+    text = body[_COUNTS.size + 4 * n_columns :]
+
+    def column(start: int, length: int) -> List[int]:
+        return list(columns[start : start + length])
+
+    viseme_offsets = accumulate(column(0, n_visemes))
+    viseme_ids = column(n_visemes, n_visemes)
+    i = 2 * n_visemes
+    word_offsets = accumulate(column(i, n_words))
+    durations = column(i + n_words, n_words)
+    text_offsets = accumulate(column(i + 2 * n_words, n_words))
+    word_lengths = column(i + 3 * n_words, n_words)
+    ends = accumulate(column(i + 4 * n_words, n_words))
+
+    visemes = [
+        Viseme(offset=offset, viseme=viseme)
+        for offset, viseme in zip(viseme_offsets, viseme_ids)
+    ]
+    word_timestamps = []
+    start = 0
+    for offset, duration, text_offset, word_length, end in zip(
+        word_offsets, durations, text_offsets, word_lengths, ends
+    ):
+        word_timestamps.append(
+            WordTimestamp(
+                word=text[start:end].decode("utf-8"),
+                offset=offset,
+                duration=duration,
+                text_offset=text_offset,
+                word_length=word_length,
+            )
+        )
+        start = end
+    return (
+        visemes if flags & _HAS_VISEMES else None,
+        word_timestamps if flags & _HAS_WORD_TIMESTAMPS else None,
+    )
+
+
+def decode_json_visemes(data: bytes) -> List[Viseme]:
+    """
+    Decode the visemes of a record stored in the JSON format
+
+    Parameters:
+        data (bytes): The JSON file
+
+    Returns:
+        The visemes
+    """
+    return [Viseme(**v) for v in json.loads(data)]
+
+
+def decode_json_word_timestamps(data: bytes) -> List[WordTimestamp]:
+    """
+    Decode the word timestamps of a record stored in the JSON format
+
+    Parameters:
+        data (bytes): The JSON file
+
+    Returns:
+        The word timestamps
+    """
+    return [WordTimestamp(**w) for w in json.loads(data)]
@@ -0,0 +1,52 @@
+"""
+Coalescing of concurrent work for the same key
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key so that only the first caller runs
+    the work and every other caller awaits the same result.
+
+    The work runs in its own task. A caller that is cancelled stops waiting but does
+    not cancel the work for the other callers. If the work raises, every caller
+    waiting on it receives the same exception.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Task] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved in case every caller has gone away
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run the work for the given key unless it is already in flight, then await its result
+
+        Parameters:
+            key (str): The key identifying the work
+            fn (Callable[[], Awaitable[T]]): Function returning the awaitable that does the work
+
+        Returns:
+            The result of the work
+        """
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
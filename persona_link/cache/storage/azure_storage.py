@@ -2,16 +2,24 @@
 Azure storage for cache
 """
 
+import asyncio
+import base64
 import os
-from datetime import UTC, datetime, timedelta
-from typing import AsyncGenerator
+import time
+from collections import OrderedDict
+from datetime import UTC, datetime
+from typing import AsyncGenerator, Callable, List, Optional, Tuple
 
-from azure.core.exceptions import ResourceNotFoundError
-from azure.storage.blob import (BlobSasPermissions, ContentSettings,
-                                generate_blob_sas)
-from azure.storage.blob.aio import BlobClient, BlobServiceClient
+import aiohttp
+from azure.core.exceptions import AzureError, ResourceNotFoundError
+from azure.core.pipeline.transport import AioHttpTransport
+from azure.storage.blob import BlobBlock, BlobProperties, BlobSasPermissions
+from azure.storage.blob import BlobServiceClient as SyncBlobServiceClient
+from azure.storage.blob import ContentSettings, generate_blob_sas
+from azure.storage.blob.aio import (BlobClient, BlobServiceClient,
+                                    ContainerClient)
 
-from persona_link.cache.models import ContentType
+from persona_link.cache.models import ContentType, TransferStats
 
 from .base_storage import BaseCacheStorage
 
@@ -20,11 +28,31 @@ class AzureStorage(BaseCacheStorage):
     """
     Azure storage for cache.
     Requires ENV vars to be set for connection string and container name
+
+    Signed urls are held per path and reused. Their expiry is aligned to buckets of
+    `url_refresh_seconds`, so every request for a path within a bucket gets the same url, which
+    browsers and CDNs can cache. A url is re-signed when the bucket ends, at which point it is still
+    valid for `url_expiry_seconds`.
+
+    All operations share one client and its pool of connections, created by `start` or on first use
+    and closed by `close`.
+
+    Streams are uploaded as blocks of `block_size` staged in parallel, so a provider-to-blob copy
+    runs at network speed while at most `upload_concurrency + 1` blocks are held in memory.
+    A failed block is retried on its own. Files at a url are copied by the service itself.
     """
 
-    def _getUrl(self, blob_client: BlobClient) -> str:
+    url_expiry_seconds = 3600
+    copies_from_url = True
+    # blobs per batch request, the maximum the service accepts
+    DELETE_BATCH_SIZE = 256
+    DELETE_CONCURRENCY = 8
+    RETRY_BACKOFF_SECONDS = 0.5
+    COPY_TIMEOUT_SECONDS = 600
+    COPY_MAX_POLL_SECONDS = 2.0
+
+    def _getUrl(self, blob_client: BlobClient, expiry: datetime) -> str:
         # get temporary url to the resource that is publicly accessible for streaming
-        expiry = datetime.now(UTC) + timedelta(hours=1)
         sas_token = generate_blob_sas(
             blob_client.account_name,
             blob_client.container_name,
@@ -37,7 +65,26 @@ class AzureStorage(BaseCacheStorage):
         blob_sas_url = f"{blob_client.url}?{sas_token}"
         return blob_sas_url
 
-    def __init__(self):
+    def __init__(
+        self,
+        url_refresh_seconds: int = 900,
+        url_cache_size: int = 10000,
+        max_connections: int = 100,
+        block_size: int = 8 * 1024 * 1024,
+        upload_concurrency: int = 4,
+        block_retries: int = 3,
+    ):
+        """
+        Constructor for AzureStorage class.
+
+        Parameters:
+            url_refresh_seconds (int): Seconds a signed url is reused for, the width of the expiry buckets
+            url_cache_size (int): Maximum number of signed urls to hold, least recently used are dropped first
+            max_connections (int): Maximum number of connections to the service kept open at a time
+            block_size (int): Size of the blocks streams are uploaded in
+            upload_concurrency (int): Maximum number of blocks of an upload staged at a time
+            block_retries (int): Number of times a failed block is retried
+        """
         self.connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
         self.container_name = os.getenv("AZURE_STORAGE_CONTAINER_NAME")
 
@@ -45,6 +92,154 @@ class AzureStorage(BaseCacheStorage):
             raise ValueError("AZURE_STORAGE_CONNECTION_STRING must be set in ENV")
         if self.container_name is None:
             raise ValueError("AZURE_STORAGE_CONTAINER_NAME must be set in ENV")
+        if url_refresh_seconds <= 0:
+            raise ValueError("url_refresh_seconds must be positive")
+        if block_size <= 0 or upload_concurrency <= 0:
+            raise ValueError("block_size and upload_concurrency must be positive")
+
+        self.url_refresh_seconds = url_refresh_seconds
+        self.url_cache_size = url_cache_size
+        # signing needs the account name, key and url only, no connection to the service
+        self._signer = SyncBlobServiceClient.from_connection_string(
+            self.connection_string
+        ).get_container_client(self.container_name)
+        self._urls: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self.max_connections = max_connections
+        self._client: Optional[BlobServiceClient] = None
+        self._container_client: Optional[ContainerClient] = None
+        self.block_size = block_size
+        self.upload_concurrency = upload_concurrency
+        self.block_retries = block_retries
+
+    async def start(self) -> None:
+        """
+        Create the client shared by all operations. Call once the event loop is running.
+        """
+        if self._client is not None:
+            return
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            ),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            auto_decompress=False,
+            trust_env=True,
+        )
+        self._client = BlobServiceClient.from_connection_string(
+            self.connection_string,
+            transport=AioHttpTransport(session=session, session_owner=True),
+        )
+        self._container_client = self._client.get_container_client(self.container_name)
+
+    async def close(self) -> None:
+        """
+        Close the shared client and its connections
+        """
+        client, self._client, self._container_client = self._client, None, None
+        if client is not None:
+            await client.close()
+
+    async def _container(self) -> ContainerClient:
+        if self._container_client is None:
+            await self.start()
+        return self._container_client
+
+    def _sign(self, path: str) -> str:
+        now = time.time()
+        cached = self._urls.get(path)
+        if cached is not None and cached[1] - now > self.url_expiry_seconds:
+            self._urls.move_to_end(path)
+            return cached[0]
+
+        bucket_end = (now // self.url_refresh_seconds + 1) * self.url_refresh_seconds
+        expiry = bucket_end + self.url_expiry_seconds
+        url = self._getUrl(
+            self._signer.get_blob_client(path), datetime.fromtimestamp(expiry, UTC)
+        )
+        self._urls[path] = (url, expiry)
+        self._urls.move_to_end(path)
+        while len(self._urls) > self.url_cache_size:
+            self._urls.popitem(last=False)
+        return url
+
+    async def _stage_block(
+        self, blob_client: BlobClient, block_id: str, block: bytes, stats: TransferStats
+    ) -> None:
+        for attempt in range(self.block_retries + 1):
+            try:
+                await blob_client.stage_block(block_id, block, length=len(block))
+                return
+            except (AzureError, aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.block_retries:
+                    raise
+                stats.retries += 1
+                await asyncio.sleep(self.RETRY_BACKOFF_SECONDS * 2**attempt)
+
+    async def _upload_blocks(
+        self,
+        path: str,
+        first: bytes,
+        rest: AsyncGenerator[bytes, None],
+        content_type: ContentType,
+        stats: TransferStats,
+    ) -> None:
+        """
+        Upload a stream as blocks of `block_size`, staging up to `upload_concurrency` blocks at a
+        time while the next block is read, and commit the blocks once all are staged
+        """
+        blob_client = (await self._container()).get_blob_client(path)
+        slots = asyncio.Semaphore(self.upload_concurrency)
+        tasks: List[asyncio.Task] = []
+        block_ids: List[str] = []
+        buffered = 0
+
+        async def stage(block_id: str, block: bytes) -> None:
+            nonlocal buffered
+            try:
+                await self._stage_block(blob_client, block_id, block, stats)
+            finally:
+                buffered -= len(block)
+                slots.release()
+
+        async def submit(block: bytes) -> None:
+            nonlocal buffered
+            await slots.acquire()
+            for task in tasks:
+                # stop reading the stream as soon as a block failed for good
+                if task.done() and task.exception() is not None:
+                    slots.release()
+                    raise task.exception()
+            block_id = base64.b64encode(f"{len(block_ids):08d}".encode()).decode()
+            block_ids.append(block_id)
+            buffered += len(block)
+            stats.peak_buffered_bytes = max(stats.peak_buffered_bytes, buffered)
+            tasks.append(asyncio.create_task(stage(block_id, block)))
+
+        try:
+            pending = bytearray(first)
+            async for chunk in rest:
+                pending += chunk
+                stats.peak_buffered_bytes = max(stats.peak_buffered_bytes, buffered + len(pending))
+                while len(pending) >= self.block_size:
+                    await submit(bytes(pending[: self.block_size]))
+                    del pending[: self.block_size]
+            if pending:
+                await submit(bytes(pending))
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        await blob_client.commit_block_list(
+            [BlobBlock(block_id) for block_id in block_ids],
+            content_settings=ContentSettings(content_type=content_type),
+        )
+        stats.blocks = len(block_ids)
 
     async def put(
         self,
@@ -54,7 +249,9 @@ class AzureStorage(BaseCacheStorage):
         content_type: ContentType,
     ) -> str:
         """
-        Put the data in the storage
+        Put the data in the storage.
+        Streams longer than a block are uploaded as blocks in parallel, with at most
+        `upload_concurrency + 1` blocks held in memory, and reported to `on_transfer`.
 
         Parameters:
             avatarId (str): The avatar ID
@@ -63,43 +260,118 @@ class AzureStorage(BaseCacheStorage):
             content_type (ContentType): The content type of the data
         """
         path = f"{avatarId}/{filename}"
-        blob_service_client = BlobServiceClient.from_connection_string(
-            self.connection_string
-        )
-
-        async with blob_service_client:
-            container_client = blob_service_client.get_container_client(
-                self.container_name
-            )
+        container_client = await self._container()
+        if isinstance(data, (bytes, bytearray)):
             await container_client.upload_blob(
                 path,
                 data,
                 overwrite=True,
                 content_settings=ContentSettings(content_type=content_type),
+                max_concurrency=self.upload_concurrency,
+            )
+            return path
+
+        start = time.perf_counter()
+        stats = TransferStats(path=path, size_bytes=0, seconds=0)
+
+        async def counted() -> AsyncGenerator[bytes, None]:
+            async for chunk in data:
+                stats.size_bytes += len(chunk)
+                yield chunk
+
+        stream = counted()
+        first = bytearray()
+        async for chunk in stream:
+            first += chunk
+            if len(first) >= self.block_size:
+                break
+        if len(first) < self.block_size:
+            # the whole stream fits in one block, upload it in one request
+            stats.peak_buffered_bytes = len(first)
+            await container_client.upload_blob(
+                path,
+                bytes(first),
+                overwrite=True,
+                content_settings=ContentSettings(content_type=content_type),
             )
+        else:
+            await self._upload_blocks(path, bytes(first), stream, content_type, stats)
+
+        stats.seconds = time.perf_counter() - start
+        if self.on_transfer is not None:
+            self.on_transfer(stats)
         return path
 
+    async def put_from_url(
+        self, avatarId: str, url: str, filename: str, content_type: ContentType
+    ) -> Tuple[str, int]:
+        """
+        Copy the file at the url into the storage on the service side, so that its bytes never
+        pass through this process. The url must be readable by the service, as signed provider urls are.
+
+        Parameters:
+            avatarId (str): The avatar ID
+            url (str): The url to copy the file from
+            filename (str): The filename to store the data as
+            content_type (ContentType): The content type of the data
+
+        Returns:
+            The path and the size of the file
+        """
+        path = f"{avatarId}/{filename}"
+        blob_client = (await self._container()).get_blob_client(path)
+        properties = await self._copy(blob_client, url)
+        # the copy takes the content type the source was served with
+        await blob_client.set_http_headers(ContentSettings(content_type=content_type))
+        return path, properties.size
+
     async def get(self, path: str) -> str:
         """
-        Get the data from the storage
+        Get a signed url to the data in the storage, valid for at least `url_expiry_seconds`
 
         Parameters:
             path (str): The path to the data in the storage
         """
         if not path:
             return None
-        # get temporary url to the resource that is publicly accessible for streaming
-        blob_service_client = BlobServiceClient.from_connection_string(
-            self.connection_string
-        )
+        return self._sign(path)
 
-        async with blob_service_client:
-            container_client = blob_service_client.get_container_client(
-                self.container_name
-            )
-            blob_client = container_client.get_blob_client(path)
+    async def read(self, path: str) -> bytes:
+        """
+        Read the data from the storage
+
+        Parameters:
+            path (str): The path to the data in the storage
+        """
+        container_client = await self._container()
+        stream = await container_client.download_blob(path)
+        return await stream.readall()
 
-            return self._getUrl(blob_client)
+    async def _copy(self, target: BlobClient, url: str) -> BlobProperties:
+        """
+        Copy the file at the url to the target blob on the service, polling with backoff
+        until the copy is done. A copy that is not done within `COPY_TIMEOUT_SECONDS` is aborted.
+
+        Returns:
+            The properties of the copied blob
+        """
+        copy = await target.start_copy_from_url(url)
+        deadline = time.monotonic() + self.COPY_TIMEOUT_SECONDS
+        delay = 0.1
+        properties = await target.get_blob_properties()
+        while properties.copy.status == "pending":
+            if time.monotonic() > deadline:
+                await target.abort_copy(copy["copy_id"])
+                raise IOError(f"Copying {url} to {target.blob_name} timed out")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.COPY_MAX_POLL_SECONDS)
+            properties = await target.get_blob_properties()
+        if properties.copy.status != "success":
+            raise IOError(
+                f"Copying {url} to {target.blob_name} failed: "
+                f"{properties.copy.status} {properties.copy.status_description or ''}".strip()
+            )
+        return properties
 
     async def delete(self, path: str) -> None:
         """
@@ -108,34 +380,60 @@ class AzureStorage(BaseCacheStorage):
         Parameters:
             path (str): The path to the data in the storage
         """
-        blob_service_client = BlobServiceClient.from_connection_string(
-            self.connection_string
-        )
-        async with blob_service_client:
-            container_client = blob_service_client.get_container_client(
-                self.container_name
-            )
-            try:
-                blob_client = container_client.get_blob_client(path)
-            except ResourceNotFoundError:
-                return
+        container_client = await self._container()
+        try:
+            blob_client = container_client.get_blob_client(path)
+        except ResourceNotFoundError:
+            return
 
-            await blob_client.delete_blob()
+        await blob_client.delete_blob()
 
-    async def deleteAll(self, avatarId: str) -> None:
+    async def deleteAll(
+        self, avatarId: str, progress: Optional[Callable[[int], None]] = None
+    ) -> None:
         """
-        Delete all the data for the given avatar
+        Delete all the data for the given avatar, `DELETE_BATCH_SIZE` blobs per batch request
+        with at most `DELETE_CONCURRENCY` requests running at a time, while the blobs are listed
 
         Parameters:
             avatarId (str): The avatar ID
+            progress (Optional[Callable[[int], None]]): Called with the number of blobs deleted so far, after every batch
         """
-        blob_service_client = BlobServiceClient.from_connection_string(
-            self.connection_string
-        )
-        async with blob_service_client:
-            container_client = blob_service_client.get_container_client(
-                self.container_name
-            )
-            blobs = container_client.list_blobs(name_starts_with=avatarId)
-            async for blob in blobs:
-                await container_client.delete_blob(blob.name)
+        container_client = await self._container()
+        semaphore = asyncio.Semaphore(self.DELETE_CONCURRENCY)
+        deleted = 0
+
+        async def _delete(names: List[str]) -> None:
+            nonlocal deleted
+            async with semaphore:
+                responses = await container_client.delete_blobs(
+                    *names, raise_on_any_failure=False
+                )
+                # blobs deleted in the meantime are gone all the same
+                failed = [r async for r in responses if r.status_code not in (202, 404)]
+            if failed:
+                raise IOError(f"Deleting {len(failed)} blobs of avatar '{avatarId}' failed")
+            deleted += len(names)
+            if progress is not None:
+                progress(deleted)
+
+        tasks: List[asyncio.Task] = []
+        batch: List[str] = []
+        try:
+            async for blob in container_client.list_blobs(name_starts_with=f"{avatarId}/"):
+                batch.append(blob.name)
+                if len(batch) == self.DELETE_BATCH_SIZE:
+                    tasks.append(asyncio.create_task(_delete(batch)))
+                    batch = []
+            if batch:
+                tasks.append(asyncio.create_task(_delete(batch)))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise errors[0]
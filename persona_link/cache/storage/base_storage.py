@@ -1,7 +1,9 @@
+import os
 from abc import ABC, abstractmethod
-from typing import AsyncGenerator, Optional
+from typing import AsyncGenerator, Callable, Optional, Tuple
 
-from persona_link.cache.models import ContentType
+from persona_link.api_client import APIClient
+from persona_link.cache.models import ContentType, TransferStats
 
 
 class BaseCacheStorage(ABC):
@@ -9,8 +11,38 @@ class BaseCacheStorage(ABC):
     Base class for storage of video/audio files. Storage can be file system, 
     cloud storage, etc. The storage will store files in avatarId/file format.
     This way it will be possible to delete all files for a given persona_link.
+
+    Attributes:
+        url_expiry_seconds (Optional[int]): Seconds after which urls returned by get expire, None if they never expire
+        on_transfer (Optional[Callable[[TransferStats], None]]): Called with the statistics of each streaming upload, for storages that report them
+        copies_from_url (bool): Whether put_from_url copies the file within the storage service, without passing it through this process
     """
-    
+
+    url_expiry_seconds: Optional[int] = None
+    copies_from_url: bool = False
+    on_transfer: Optional[Callable[[TransferStats], None]] = None
+
+    async def start(self) -> None:
+        """
+        Open the connections of the storage, if it keeps any. Call once the event loop is running.
+        """
+        pass
+
+    async def close(self) -> None:
+        """
+        Close the connections of the storage, if it keeps any
+        """
+        pass
+
+    def folder(self, path: str) -> str:
+        """
+        Get the avatarId folder of the given path
+
+        Parameters:
+            path (str): The path of the file in the storage
+        """
+        return os.path.basename(os.path.dirname(path))
+
     @abstractmethod
     async def get(self, path: str) -> Optional[str]:
         """
@@ -34,6 +66,40 @@ class BaseCacheStorage(ABC):
         """
         pass
 
+    async def put_from_url(
+        self, avatarId: str, url: str, filename: str, content_type: ContentType
+    ) -> Tuple[str, int]:
+        """
+        Put the file at the given url in the avatarId folder and return the path and the size.
+        Storages that cannot copy from a url themselves stream the file through this process.
+
+        Parameters:
+            avatarId (str): The avatar ID
+            url (str): The url to copy the file from
+            filename (str): The filename of the file
+            content_type (ContentType): The content type of the file
+        """
+        size = 0
+
+        async def counted() -> AsyncGenerator[bytes, None]:
+            nonlocal size
+            async for chunk in APIClient().download(url):
+                size += len(chunk)
+                yield chunk
+
+        path = await self.put(avatarId, counted(), filename, content_type)
+        return path, size
+
+    @abstractmethod
+    async def read(self, path: str) -> bytes:
+        """
+        Read the data of the file at the given path
+        
+        Parameters:
+            path (str): The path of the file in the storage
+        """
+        pass
+
     @abstractmethod
     async def delete(self, path: str) -> None:
         """
@@ -45,11 +111,14 @@ class BaseCacheStorage(ABC):
         pass
 
     @abstractmethod
-    async def deleteAll(self, avatarId: str) -> None:
+    async def deleteAll(
+        self, avatarId: str, progress: Optional[Callable[[int], None]] = None
+    ) -> None:
         """
         Delete all the data for the given avatar
         
         Parameters:
             avatarId (str): The avatar ID
+            progress (Optional[Callable[[int], None]]): Called with the number of files deleted so far
         """
         pass
\ No newline at end of file
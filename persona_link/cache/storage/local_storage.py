@@ -2,33 +2,180 @@
 Local storage for cache
 """
 import asyncio
+import base64
+import functools
+import hashlib
+import hmac
 import os
-import shutil
-from typing import AsyncGenerator
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncGenerator, Callable, List, Optional, TypeVar
+from urllib.parse import quote
+from uuid import uuid4
 
 import aiofiles
-import aiofiles.os
 
 from persona_link.cache.models import ContentType
 
 from .base_storage import BaseCacheStorage
 
+T = TypeVar("T")
+
 
 class LocalStorage(BaseCacheStorage):
     """
     Local storage for cache
     Requires ENV vars to be set for the path to the storage
+
+    If a base url is set, `get` returns urls to a media route serving the files, signed with an
+    HMAC of the path and the expiry so that only urls handed out by the cache are served.
+    The expiry is aligned to buckets of `url_refresh_seconds` so that a file keeps the same url
+    for the length of a bucket, and every url is valid for at least `url_expiry_seconds`.
+    Otherwise `get` returns the path of the file.
+
+    Files are stored as `avatarId/ab/cd/filename`, fanned out by a hash of the filename so that
+    no directory grows past a few hundred entries at millions of files. Files stored in the
+    earlier flat `avatarId/filename` layout are still found under their paths, and are moved into
+    the sharded layout by `migrate_layout`. Every filesystem call runs on a pool of
+    `io_workers` threads, off the event loop.
     """
 
-    def __init__(self):
+    SHARD_LEVELS = 2
+    TEMPORARY_SUFFIX = ".tmp"
+
+    def __init__(self, url_refresh_seconds: int = 900, io_workers: int = 32):
+        """
+        Constructor for LocalStorage class.
+        Reads LOCAL_STORAGE_PATH, and LOCAL_STORAGE_BASE_URL with LOCAL_STORAGE_URL_SECRET to return urls
+
+        Parameters:
+            url_refresh_seconds (int): Seconds a url is handed out for, the width of the expiry buckets
+            io_workers (int): Number of threads running the filesystem calls
+        """
         self.path = os.getenv("LOCAL_STORAGE_PATH")
 
         if self.path is None:
             raise ValueError("LOCAL_STORAGE_PATH must be set in ENV")
 
+        self.base_url = os.getenv("LOCAL_STORAGE_BASE_URL")
+        self.url_secret = os.getenv("LOCAL_STORAGE_URL_SECRET")
+        if self.base_url:
+            if not self.url_secret:
+                raise ValueError("LOCAL_STORAGE_URL_SECRET must be set in ENV with LOCAL_STORAGE_BASE_URL")
+            if url_refresh_seconds <= 0:
+                raise ValueError("url_refresh_seconds must be positive")
+            self.base_url = self.base_url.rstrip("/")
+            self.url_expiry_seconds = 3600
+        self.url_refresh_seconds = url_refresh_seconds
+        if io_workers <= 0:
+            raise ValueError("io_workers must be positive")
+        self.io_workers = io_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _signature(self, relative_path: str, expires: int) -> str:
+        digest = hmac.new(
+            self.url_secret.encode(), f"{relative_path}:{expires}".encode(), hashlib.sha256
+        ).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    def sign(self, full_path: str) -> str:
+        """
+        Get the signed url of a file in the storage
+
+        Parameters:
+            full_path (str): The path of the file as returned by put
+
+        Returns:
+            The url of the file on the media route
+        """
+        relative_path = os.path.relpath(full_path, self.path).replace(os.sep, "/")
+        now = time.time()
+        bucket_end = (int(now) // self.url_refresh_seconds + 1) * self.url_refresh_seconds
+        expires = bucket_end + self.url_expiry_seconds
+        return (
+            f"{self.base_url}/{quote(relative_path)}"
+            f"?expires={expires}&signature={self._signature(relative_path, expires)}"
+        )
+
+    def verify(self, relative_path: str, expires: int, signature: str) -> Optional[str]:
+        """
+        Check a signed url handed out by `get`
+
+        Parameters:
+            relative_path (str): The path of the file relative to the storage, as in the url
+            expires (int): The expiry in the url, in seconds since the epoch
+            signature (str): The signature in the url
+
+        Returns:
+            The full path of the file, None if the url is not signed by this storage, has expired or points outside the storage
+        """
+        if not self.base_url or expires < time.time():
+            return None
+        if not hmac.compare_digest(self._signature(relative_path, expires), signature):
+            return None
+        root = os.path.realpath(self.path)
+        full_path = os.path.realpath(os.path.join(root, relative_path))
+        if os.path.commonpath([root, full_path]) != root:
+            return None
+        return full_path
+
+    def _shard(self, filename: str) -> str:
+        digest = hashlib.blake2b(filename.encode(), digest_size=self.SHARD_LEVELS).hexdigest()
+        return os.path.join(*(digest[2 * i : 2 * i + 2] for i in range(self.SHARD_LEVELS)))
+
+    def _file_path(self, avatarId: str, filename: str) -> str:
+        return os.path.join(self.path, avatarId, self._shard(filename), filename)
+
+    def _legacy_path(self, full_path: str) -> Optional[str]:
+        """
+        Get the sharded path of a file stored in the flat `avatarId/filename` layout
+
+        Returns:
+            The sharded path, None if the path is not in the flat layout
+        """
+        parts = os.path.relpath(full_path, self.path).split(os.sep)
+        if len(parts) != 2 or ".." in parts:
+            return None
+        return self._file_path(*parts)
+
+    def folder(self, path: str) -> str:
+        """
+        Get the avatarId folder of the given path
+
+        Parameters:
+            path (str): The path of the file in the storage
+        """
+        return os.path.relpath(os.path.join(self.path, path), self.path).split(os.sep)[0]
+
+    def _locate(self, path: str) -> Optional[str]:
+        # files stored before the sharded layout are found whether or not they were migrated
+        full_path = os.path.join(self.path, path)
+        sharded = self._legacy_path(full_path)
+        for candidate in (sharded, full_path):
+            if candidate is not None and os.path.isfile(candidate):
+                return candidate
+        return None
+
+    async def _run(self, function: Callable[..., T], *args) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self._io(), function, *args)
+
+    def _io(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.io_workers, thread_name_prefix="local-storage")
+        return self._executor
+
+    async def close(self) -> None:
+        """
+        Shut down the I/O threads, they are started again on the next operation
+        """
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
     async def put(self, avatarId: str, data: bytes | AsyncGenerator[bytes, None], filename: str, content_type: ContentType) -> str:
         """
-        Put the data in the storage
+        Put the data in the storage. The data is written to a temporary file that is renamed
+        into place once complete, so the file is never seen partially written.
         
         Parameters:
             avatarId (str): The avatar ID
@@ -36,21 +183,22 @@ class LocalStorage(BaseCacheStorage):
             filename (str): The name of the file
             content_type (ContentType): The content type of the data
         """
-        path = os.path.join(self.path, avatarId, filename)
-        
+        path = self._file_path(avatarId, filename)
         folder = os.path.dirname(path)
-  
-        # check if directory exists
-        if not os.path.exists(folder): 
-            # if the directory doesn't exists, create it
-            os.makedirs(folder)
-            
-        async with aiofiles.open(path, "wb") as f:
-            if isinstance(data, AsyncGenerator):
-                async for chunk in data:
-                    await f.write(chunk)
-            else:
-                await f.write(data)
+        await self._run(functools.partial(os.makedirs, folder, exist_ok=True))
+
+        temporary = os.path.join(folder, f".{filename}.{uuid4().hex}{self.TEMPORARY_SUFFIX}")
+        try:
+            async with aiofiles.open(temporary, "wb", executor=self._io()) as f:
+                if isinstance(data, AsyncGenerator):
+                    async for chunk in data:
+                        await f.write(chunk)
+                else:
+                    await f.write(data)
+            await self._run(os.replace, temporary, path)
+        except BaseException:
+            await self._run(self._remove, temporary)
+            raise
 
         return path
 
@@ -63,10 +211,28 @@ class LocalStorage(BaseCacheStorage):
         """
         if not path:
             return None
-        full_path = os.path.join(self.path, path)
-        if os.path.exists(full_path):
-            return full_path
-        return None
+        full_path = await self._run(self._locate, path)
+        if full_path is None:
+            return None
+        return self.sign(full_path) if self.base_url else full_path
+
+    async def read(self, path: str) -> bytes:
+        """
+        Read the data of the file in the storage
+        
+        Parameters:
+            path (str): The path to the file in the storage
+        """
+        full_path = await self._run(self._locate, path) or os.path.join(self.path, path)
+        async with aiofiles.open(full_path, "rb", executor=self._io()) as f:
+            return await f.read()
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
     async def delete(self, path: str) -> None:
         """
@@ -75,18 +241,77 @@ class LocalStorage(BaseCacheStorage):
         Parameters:
             path (str): The path to the file in the storage
         """
-        full_path = os.path.join(self.path, path)
-        if os.path.exists(full_path):
-            await aiofiles.os.remove(full_path)
+        full_path = await self._run(self._locate, path)
+        if full_path is not None:
+            await self._run(self._remove, full_path)
+
+    @staticmethod
+    def _remove_tree(directory: str) -> int:
+        files = 0
+        if not os.path.isdir(directory):
+            return files
+        for root, dirs, names in os.walk(directory, topdown=False):
+            for name in names:
+                os.remove(os.path.join(root, name))
+                files += 1
+            for name in dirs:
+                os.rmdir(os.path.join(root, name))
+        os.rmdir(directory)
+        return files
 
-    async def deleteAll(self, avatarId: str) -> None:
+    async def deleteAll(
+        self, avatarId: str, progress: Optional[Callable[[int], None]] = None
+    ) -> None:
         """
         Delete all the files for the given avatar
         
         Parameters:
             avatarId (str): The avatar ID
+            progress (Optional[Callable[[int], None]]): Called with the number of files deleted
+        """
+        files = await self._run(self._remove_tree, os.path.join(self.path, avatarId))
+        if progress is not None and files:
+            progress(files)
+
+    def _folders(self) -> List[str]:
+        with os.scandir(self.path) as entries:
+            return [entry.path for entry in entries if entry.is_dir(follow_symlinks=False)]
+
+    def _migrate_folder(self, folder: str) -> int:
+        moved = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                if entry.name.endswith(self.TEMPORARY_SUFFIX):
+                    # left behind by an interrupted write
+                    os.remove(entry.path)
+                    continue
+                target = self._legacy_path(entry.path)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(entry.path, target)
+                moved += 1
+        return moved
+
+    async def migrate_layout(self, progress: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Move the files stored in the flat `avatarId/filename` layout into the sharded layout.
+        The paths of the records need no update, the storage finds the moved files under their
+        old paths. The storage stays usable while the files are moved.
+
+        Parameters:
+            progress (Optional[Callable[[int], None]]): Called with the number of files moved in each avatar folder
+
+        Returns:
+            The number of files moved
         """
-        directory = os.path.join(self.path, avatarId)
-        if os.path.exists(directory):
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, shutil.rmtree, directory)
\ No newline at end of file
+        if not await self._run(os.path.isdir, self.path):
+            return 0
+        folders = await self._run(self._folders)
+        moved = 0
+        for folder in folders:
+            files = await self._run(self._migrate_folder, folder)
+            moved += files
+            if progress is not None and files:
+                progress(files)
+        return moved
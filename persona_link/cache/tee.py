@@ -0,0 +1,237 @@
+"""
+Tee of media streamed from a provider into storage, served to clients while it is uploaded
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import time
+from typing import AsyncGenerator, Dict, List, Optional, Set
+
+from .models import DataToStore
+
+
+class TeeBuffer:
+    """
+    Buffer of the media of a record being put in the cache.
+
+    The chunks are kept as they pass to storage, so a reader that joins late first gets the
+    prefix received so far and then follows the stream until it ends.
+
+    Attributes:
+        data (DataToStore): The data being stored, for its content type, metadata and sidecars
+        chunks (List[bytes]): The chunks received so far
+        size (int): The number of bytes received so far
+        done (bool): Whether the whole media was received
+        error (Optional[BaseException]): The error that ended the stream early, if any
+        redirect (Optional[str]): Url readers are sent to instead, for media the storage copies itself
+    """
+
+    def __init__(self, data: DataToStore, redirect: Optional[str] = None):
+        self.data = data
+        self.redirect = redirect
+        self.chunks: List[bytes] = []
+        self.size = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wrap(self, data: AsyncGenerator[bytes, None]) -> AsyncGenerator[bytes, None]:
+        """
+        Pass the stream through to storage, buffering its chunks for the readers
+
+        Parameters:
+            data (AsyncGenerator[bytes, None]): The stream of the media
+
+        Returns:
+            The same stream
+        """
+        try:
+            async for chunk in data:
+                self.chunks.append(chunk)
+                self.size += len(chunk)
+                self._notify()
+                yield chunk
+        except BaseException as e:
+            self.error = e
+            self._notify()
+            raise
+        self.done = True
+        self._notify()
+
+    async def read(self) -> AsyncGenerator[bytes, None]:
+        """
+        Read the media from the start, waiting for chunks that were not received yet
+
+        Returns:
+            The stream of the media
+
+        Raises:
+            IOError: If the stream from the provider failed
+        """
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+            if self.error is not None:
+                raise IOError(f"The media stream failed: {self.error}") from self.error
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+class MediaTee:
+    """
+    Registry of the media being streamed into the cache, by record key.
+
+    While a record is put, its media is served at `url(key)` from the buffer. Once the record is
+    stored the buffer is dropped, and the url is expected to redirect to the stored media, so
+    urls handed out during the upload stay valid. A buffer holds the whole media of the record
+    for the duration of its upload.
+
+    Urls are signed like those of `LocalStorage`, with an expiry aligned to buckets of
+    `url_refresh_seconds` and an HMAC of the key and the expiry, checked by `verify`.
+    """
+
+    url_expiry_seconds = 3600
+
+    def __init__(self, base_url: str, url_refresh_seconds: int = 900):
+        """
+        Constructor for MediaTee class.
+        Reads CACHE_TEE_URL_SECRET to sign urls
+
+        Parameters:
+            base_url (str): The url of the route serving the buffers, the key is appended to it
+            url_refresh_seconds (int): Seconds a url is handed out for, the width of the expiry buckets
+        """
+        if not base_url:
+            raise ValueError("base_url cannot be empty")
+        self.url_secret = os.getenv("CACHE_TEE_URL_SECRET")
+        if not self.url_secret:
+            raise ValueError("CACHE_TEE_URL_SECRET must be set in ENV")
+        if url_refresh_seconds <= 0:
+            raise ValueError("url_refresh_seconds must be positive")
+        self.base_url = base_url.rstrip("/")
+        self.url_refresh_seconds = url_refresh_seconds
+        self.buffers: Dict[str, TeeBuffer] = {}
+        self._opened: Dict[str, asyncio.Future] = {}
+        self._tasks: Set[asyncio.Future] = set()
+
+    def _signature(self, key: str, expires: int) -> str:
+        digest = hmac.new(self.url_secret.encode(), f"{key}:{expires}".encode(), hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+    def url(self, key: str) -> str:
+        """
+        Get the signed url the media of the record with the given key is served at
+
+        Parameters:
+            key (str): The key of the record
+
+        Returns:
+            The url
+        """
+        bucket_end = (int(time.time()) // self.url_refresh_seconds + 1) * self.url_refresh_seconds
+        expires = bucket_end + self.url_expiry_seconds
+        return f"{self.base_url}/{key}?expires={expires}&signature={self._signature(key, expires)}"
+
+    def verify(self, key: str, expires: int, signature: str) -> bool:
+        """
+        Check a signed url handed out by `url`
+
+        Parameters:
+            key (str): The key of the record, as in the url
+            expires (int): The expiry in the url, in seconds since the epoch
+            signature (str): The signature in the url
+
+        Returns:
+            Whether the url is signed by this tee and has not expired
+        """
+        if expires < time.time():
+            return False
+        return hmac.compare_digest(self._signature(key, expires), signature)
+
+    def get(self, key: str) -> Optional[TeeBuffer]:
+        """
+        Get the buffer of the record with the given key
+
+        Parameters:
+            key (str): The key of the record
+
+        Returns:
+            The buffer, None if the record is not being put
+        """
+        return self.buffers.get(key)
+
+    def open(self, key: str, data: DataToStore, redirect: Optional[str] = None) -> TeeBuffer:
+        """
+        Open the buffer for a record that is being put
+
+        Parameters:
+            key (str): The key of the record
+            data (DataToStore): The data being stored
+            redirect (Optional[str]): Url to send readers to, when the media does not pass through this process
+
+        Returns:
+            The buffer
+        """
+        buffer = self.buffers[key] = TeeBuffer(data, redirect)
+        opened = self._opened.pop(key, None)
+        if opened is not None and not opened.done():
+            opened.set_result(buffer)
+        return buffer
+
+    def close(self, key: str) -> None:
+        """
+        Drop the buffer of a record once it is stored or failed, readers of the buffer finish reading it
+
+        Parameters:
+            key (str): The key of the record
+        """
+        self.buffers.pop(key, None)
+
+    async def first(self, key: str, rendering: asyncio.Future) -> Optional[TeeBuffer]:
+        """
+        Wait until the buffer for the record is opened or the rendering of the record is done
+
+        Parameters:
+            key (str): The key of the record
+            rendering (asyncio.Future): The rendering that puts the record
+
+        Returns:
+            The buffer, None if the rendering finished without opening one
+        """
+        buffer = self.buffers.get(key)
+        if buffer is not None:
+            return buffer
+        opened = self._opened.get(key)
+        if opened is None:
+            opened = self._opened[key] = asyncio.get_running_loop().create_future()
+        await asyncio.wait([opened, rendering], return_when=asyncio.FIRST_COMPLETED)
+        if opened.done():
+            return opened.result()
+        if self._opened.get(key) is opened:
+            del self._opened[key]
+        return None
+
+    def detach(self, rendering: asyncio.Future) -> None:
+        """
+        Let a rendering finish in the background once its buffer is being served
+
+        Parameters:
+            rendering (asyncio.Future): The rendering that puts the record
+        """
+        self._tasks.add(rendering)
+        rendering.add_done_callback(self._finished)
+
+    def _finished(self, rendering: asyncio.Future) -> None:
+        self._tasks.discard(rendering)
+        if not rendering.cancelled() and rendering.exception() is not None:
+            print(f"Rendering of teed media failed: {rendering.exception()}")
@@ -0,0 +1,107 @@
+"""
+Buffered, aggregated usage counting for the cache
+"""
+
+import asyncio
+from collections import Counter
+from typing import Optional
+
+from .db import BaseCacheDB
+
+
+class UsageAggregator:
+    """
+    Coalesces usage increments per key in memory and writes them to the database
+    in periodic bulk flushes, instead of one database write per cache hit.
+
+    A flush happens every `flush_interval` seconds, as soon as `max_buffer` increments
+    are pending, and when the aggregator is stopped.
+    """
+
+    def __init__(
+        self, db: BaseCacheDB, flush_interval: float = 5.0, max_buffer: int = 1000
+    ):
+        """
+        Constructor for UsageAggregator class.
+
+        Parameters:
+            db (BaseCacheDB): The database to flush the usage to
+            flush_interval (float): Seconds between periodic flushes
+            max_buffer (int): Number of pending increments that triggers an early flush
+        """
+        if db is None:
+            raise ValueError("db cannot be None")
+        self.db = db
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._counts: Counter[str] = Counter()
+        self._buffered = 0
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Task] = None
+
+    def increment(self, key: str, count: int = 1) -> None:
+        """
+        Buffer a usage increment for the given key
+
+        Parameters:
+            key (str): The key for the record
+            count (int): The number of uses to add
+        """
+        self._counts[key] += count
+        self._buffered += count
+        if self._buffered >= self.max_buffer and (
+            self._flushing is None or self._flushing.done()
+        ):
+            self._flushing = asyncio.ensure_future(self.flush())
+
+    def pending(self, key: str) -> int:
+        """
+        Get the number of buffered uses of the given key not yet flushed
+
+        Parameters:
+            key (str): The key for the record
+        """
+        return self._counts.get(key, 0)
+
+    async def flush(self) -> None:
+        """
+        Write all buffered increments to the database in one bulk operation.
+        If the write fails, the increments are buffered again for the next flush.
+        """
+        async with self._lock:
+            if not self._counts:
+                return
+            counts, self._counts = self._counts, Counter()
+            self._buffered = 0
+            try:
+                await self.db.incrementUsageMany(dict(counts))
+            except Exception as e:
+                print(f"Flushing usage of {len(counts)} keys failed: {e}")
+                self._counts.update(counts)
+                self._buffered += sum(counts.values())
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self) -> None:
+        """
+        Start the periodic flushing in the running event loop
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the periodic flushing and flush the remaining increments
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -31,7 +31,8 @@ def persona_link_provider(klass):
 from .audio import AudioAvatar
 from .azure import AzureAvatar
 from .base import PersonaBase
+from .errors import GenerationError
 from .heygen import HeygenAvatar
 from .sprite import SpriteAvatar
 
-__all__ = [ "AzureAvatar", "PersonaBase", "HeygenAvatar", "SpriteAvatar", "AudioAvatar", "persona_link_provider", "persona_link_providers" ]
+__all__ = [ "AzureAvatar", "GenerationError", "PersonaBase", "HeygenAvatar", "SpriteAvatar", "AudioAvatar", "persona_link_provider", "persona_link_providers" ]
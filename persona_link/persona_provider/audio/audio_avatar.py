@@ -27,6 +27,18 @@ class AudioAvatar(PersonaBase):
         """
         return AudioProviderSettings.get_provider(settings)
         
+    def audio_settings(self, settings: AudioProviderSettings) -> AudioProviderSettings:
+        """
+        Get the settings the avatar synthesizes speech with
+        
+        Parameters:
+            settings (AudioProviderSettings): The settings for the audio provider
+                
+        Returns:
+            the audio provider settings
+        """
+        return settings
+
     async def generate(self, text: str, settings: AudioProviderSettings) -> DataToStore:
         """
         Generate the audio and visemes for the sprite avatar
@@ -48,7 +60,7 @@ class AudioAvatar(PersonaBase):
             visemes=audio.visemes,
             word_timestamps=audio.word_timestamps,
             metadata = Metadata(
-                bit_rate_kbp = settings.bit_rate_kbps,
+                bit_rate_kbps = settings.bit_rate_kbps,
                 sampling_rate_hz = settings.sampling_rate_hz,
                 duration_seconds = audio.duration_seconds
             )
@@ -104,11 +104,12 @@ class AzureAvatar(PersonaBase):
             return None
         bitrate_kbps = result["avatarConfig"]["bitrateKbps"]
         video_url = await self._get_video_url(url)
+        if video_url is None:
+            return None
 
-        content = APIClient().download(video_url)
-
+        # the storage copies the video from the provider, it does not pass through this process
         return DataToStore(
-            binary_data=content,
+            source_url=video_url,
             content_type=ContentType.MP4,
             data_type=AvatarType.VIDEO,
             metadata=Metadata(
@@ -1,10 +1,15 @@
+import asyncio
+import time
 from abc import ABC, abstractmethod
+from typing import Optional
 
 from persona_link.cache.cache import Cache
 from persona_link.cache.models import DataToStore, Record
 
+from .errors import GenerationError
 from .models import (AudioProviderSettings, AvatarType, SpeakingAvatarInstance,
                      Urls, VideoProviderSettings)
+from .segmented import generate_segmented
 
 
 class PersonaBase(ABC):
@@ -45,6 +50,166 @@ class PersonaBase(ABC):
         """
         pass
 
+    def audio_settings(
+        self, settings: AudioProviderSettings | VideoProviderSettings
+    ) -> Optional[AudioProviderSettings]:
+        """
+        Get the settings the avatar synthesizes speech with. Avatars that synthesize
+        speech support the segmented mode of the audio settings.
+
+        Parameters:
+            settings (AudioProviderSettings | VideoProviderSettings): The settings for the provider
+
+        Returns:
+            The audio settings, None if the avatar does not synthesize speech itself
+        """
+        return None
+
+    async def _render(
+        self,
+        cache: Cache,
+        avatar_id: str,
+        text: str,
+        settings: AudioProviderSettings | VideoProviderSettings,
+        provider: str,
+    ) -> tuple[Record, SpeakingAvatarInstance]:
+        text = cache.normalize(avatar_id, text)
+        key = cache.key(avatar_id, text, settings)
+        audio_settings = self.audio_settings(settings)
+        start = time.perf_counter()
+        try:
+            if audio_settings is not None and audio_settings.segmented:
+                data: DataToStore = await generate_segmented(
+                    self, cache, avatar_id, text, settings
+                )
+            else:
+                data: DataToStore = await self.generate(text, settings)
+        except Exception as e:
+            raise self._failed(cache, avatar_id, key, str(e) or type(e).__name__) from e
+        if data is None:
+            raise self._failed(cache, avatar_id, key, "the provider returned no data")
+        if cache.metrics is not None:
+            cache.metrics.since("generate", start, provider)
+        if cache.negative is not None:
+            cache.negative.clear(key)
+
+        record = await cache.put(avatar_id, text, data, settings)
+        urls: Urls = await cache.get_urls(record)
+
+        instance = SpeakingAvatarInstance(
+            avatar_type=self.avatar_type(settings), urls=urls, metadata=data.metadata, provider = provider, from_cache=True,
+            visemes=record.visemes, word_timestamps=record.word_timestamps,
+        )
+        return record, instance
+
+    @staticmethod
+    def _failed(cache: Cache, avatar_id: str, key: str, reason: str) -> GenerationError:
+        print(f"Generation for avatar '{avatar_id}' failed: {reason}")
+        if cache.negative is None:
+            return GenerationError(avatar_id, key, reason)
+        failure = cache.negative.add(key, reason)
+        return GenerationError(
+            avatar_id, key, reason, failure.retry_after, failure.failures
+        )
+
+    @staticmethod
+    def avatar_type(settings: AudioProviderSettings | VideoProviderSettings) -> AvatarType:
+        """
+        Get the type of avatar rendered for the given settings
+
+        Parameters:
+            settings (AudioProviderSettings | VideoProviderSettings): The settings for the provider
+
+        Returns:
+            The avatar type
+        """
+        return (
+            AvatarType.AUDIO
+            if isinstance(settings, AudioProviderSettings)
+            else AvatarType.VIDEO
+        )
+
+    async def render(
+        self,
+        cache: Cache,
+        avatar_id: str,
+        text: str,
+        settings: AudioProviderSettings | VideoProviderSettings,
+        provider: str
+    ) -> tuple[Record, SpeakingAvatarInstance]:
+        """
+        Generate the avatar for the input text and put it in the cache.
+        Concurrent renders of the same text are coalesced so that the avatar is generated only once
+        and every caller receives the same record and instance. A text whose generation failed
+        recently fails fast without calling the provider again.
+
+        Parameters:
+            cache (Cache): The cache object to use
+            avatar_id (str): The avatar ID
+            text (str): The input text to speak
+            settings (AudioProviderSettings | VideoProviderSettings): The settings for the provider
+            provider (str): The name of the provider
+
+        Returns:
+            the cached record and the details of rendered avatar instance
+
+        Raises:
+            GenerationError: If the provider failed to generate the avatar, now or recently
+        """
+        key = cache.key(avatar_id, text, settings)
+        if cache.negative is not None:
+            failure = cache.negative.get(key)
+            if failure is not None:
+                raise GenerationError(
+                    avatar_id, key, failure.reason, failure.retry_after, failure.failures
+                )
+        return await cache.inflight.do(
+            key,
+            lambda: self._render(cache, avatar_id, text, settings, provider),
+        )
+
+    async def _render_teed(
+        self,
+        cache: Cache,
+        avatar_id: str,
+        text: str,
+        settings: AudioProviderSettings | VideoProviderSettings,
+        provider: str,
+    ) -> SpeakingAvatarInstance:
+        """
+        Render the avatar and return as soon as its media is streamed into the cache, with the url
+        of the tee of the media. Media that is not streamed is returned once stored. The use is
+        counted once the record is stored.
+
+        Returns:
+            details of rendered avatar instance
+        """
+        key = cache.key(avatar_id, text, settings)
+
+        async def render() -> SpeakingAvatarInstance:
+            record, instance = await self.render(cache, avatar_id, text, settings, provider)
+            await cache.incrementUsage(record.key)
+            return instance
+
+        rendering = asyncio.ensure_future(render())
+        try:
+            buffer = await cache.tee.first(key, rendering)
+        except asyncio.CancelledError:
+            # the rendering may be shared with other callers, let it finish
+            cache.tee.detach(rendering)
+            raise
+        if buffer is None:
+            return await rendering
+        cache.tee.detach(rendering)
+        return SpeakingAvatarInstance(
+            avatar_type=self.avatar_type(settings),
+            provider=provider,
+            urls=Urls(media_url=cache.tee.url(key)),
+            metadata=buffer.data.metadata,
+            visemes=buffer.data.visemes,
+            word_timestamps=buffer.data.word_timestamps,
+        )
+
     async def speak(
         self,
         cache: Cache,
@@ -54,7 +219,10 @@ class PersonaBase(ABC):
         provider: str
     ) -> SpeakingAvatarInstance:
         """
-        Speak the input text using the avatar with the given slug
+        Speak the input text using the avatar with the given slug.
+        Concurrent cache misses for the same text are coalesced so that the avatar is generated only once
+        and every caller receives the same instance. If the cache has a tee, a miss returns as soon as
+        the media streams in, with the url of the tee.
 
         Parameters:
             cache (Cache): The cache object to use
@@ -64,29 +232,31 @@ class PersonaBase(ABC):
 
         Returns:
              details of rendered avatar instance
+
+        Raises:
+            GenerationError: If the provider failed to generate the avatar, now or recently
         """
-        record: Record = await cache.get(avatar_id, text)
+        record: Record = await cache.get(avatar_id, text, settings)
 
-        avatar_type: AvatarType = (
-            AvatarType.AUDIO
-            if isinstance(settings, AudioProviderSettings)
-            else AvatarType.VIDEO
-        )
+        if cache.metrics is not None:
+            if record is None:
+                cache.metrics.miss(avatar_id, provider)
+            else:
+                cache.metrics.hit(avatar_id, provider)
 
-        if record is None:
-            data: DataToStore = await self.generate(text, settings)
-            record = await cache.put(avatar_id, text, data)
-            urls: Urls = await cache.get_urls(record)
+        if record is None and cache.tee is not None:
+            return await self._render_teed(cache, avatar_id, text, settings, provider)
 
-            instance = SpeakingAvatarInstance(
-                avatar_type=avatar_type, urls=urls, metadata=data.metadata, provider = provider, from_cache=True
-            )
+        if record is None:
+            record, instance = await self.render(cache, avatar_id, text, settings, provider)
         else:
             instance = SpeakingAvatarInstance(
-                avatar_type=avatar_type,
+                avatar_type=self.avatar_type(settings),
                 provider=provider,
                 urls=await cache.get_urls(record),
                 metadata=record.metadata,
+                visemes=record.visemes,
+                word_timestamps=record.word_timestamps,
             )
 
         await cache.incrementUsage(record.key)
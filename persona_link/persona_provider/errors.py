@@ -0,0 +1,37 @@
+"""
+Errors raised by persona providers
+"""
+
+from typing import Optional
+
+
+class GenerationError(Exception):
+    """
+    Raised when a provider failed to generate the audio or video for a text.
+    Callers should not request the same text again before `retry_after` seconds have passed.
+
+    Attributes:
+        avatar_id (str): The avatar ID
+        key (str): The cache key of the text that failed
+        reason (str): Why the generation failed
+        retry_after (Optional[float]): Seconds until the generation may be retried, None if it may be retried right away
+        failures (int): Number of consecutive failures of the generation
+    """
+
+    def __init__(
+        self,
+        avatar_id: str,
+        key: str,
+        reason: str,
+        retry_after: Optional[float] = None,
+        failures: int = 1,
+    ):
+        self.avatar_id = avatar_id
+        self.key = key
+        self.reason = reason
+        self.retry_after = retry_after
+        self.failures = failures
+        message = f"Generation for avatar '{avatar_id}' failed: {reason}"
+        if retry_after is not None:
+            message += f" (retry after {retry_after:.0f}s)"
+        super().__init__(message)
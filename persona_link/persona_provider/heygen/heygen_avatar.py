@@ -120,12 +120,12 @@ class HeygenAvatar(PersonaBase):
 
         retrieve_url = f"{self.retrieve_url}?video_id={video_id}"
         video_url = await self._get_video_url(retrieve_url, headers)
+        if video_url is None:
+            return None
 
-
-        content = APIClient().download(video_url)
-
+        # the storage copies the video from the provider, it does not pass through this process
         return DataToStore(
-            binary_data=content,
+            source_url=video_url,
             content_type=ContentType.MP4,
             data_type=AvatarType.VIDEO,
             metadata=Metadata(
@@ -51,11 +51,13 @@ class Urls(BaseModel):
         media_url (str): URL of the media
         visemes_url (Optional[str]): URL of the visemes
         word_timestamps_url (Optional[str]): URL of the word timestamps
+        sidecar_url (Optional[str]): URL of the binary sidecar with both the visemes and the word timestamps
     """
 
     media_url: str
     visemes_url: Optional[str] = None
     word_timestamps_url: Optional[str] = None
+    sidecar_url: Optional[str] = None
 
 
 class SpeakingAvatarInstance(BaseModel):
@@ -66,6 +68,8 @@ class SpeakingAvatarInstance(BaseModel):
         avatar_type (AvatarType): Type of the avatar
         urls (Urls): URLs of the cached files
         metadata (Optional[Metadata]): Metadata of the cached files
+        visemes (Optional[List[Viseme]]): Visemes, when they are small enough to be sent inline instead of by URL
+        word_timestamps (Optional[List[WordTimestamp]]): Word timestamps, when they are small enough to be sent inline instead of by URL
     """
 
     avatar_type: AvatarType = AvatarType.AUDIO
@@ -73,6 +77,8 @@ class SpeakingAvatarInstance(BaseModel):
     urls: Urls
     metadata: Optional[Metadata] = None
     from_cache: bool = False
+    visemes: Optional[List["Viseme"]] = None
+    word_timestamps: Optional[List["WordTimestamp"]] = None
 
 
 class VideoFormat(str, Enum):
@@ -237,6 +243,7 @@ class CommonAudioSettings(BaseModel):
         sampling_rate_hz (int): Sampling rate of the audio in Hz, default is 16000
         bit_rate_kbps (int): Bit rate of the audio in kbps, default is 32
         audio_format (AudioFormat): Format of the audio, default is MP3
+        segmented (bool): Whether to synthesize and cache each sentence separately and stitch them, default is False
     """
 
     visemes: bool = False
@@ -245,6 +252,7 @@ class CommonAudioSettings(BaseModel):
     sampling_rate_hz: int = 16000
     bit_rate_kbps: int = 32
     audio_format: AudioFormat = AudioFormat.MP3
+    segmented: bool = False
 
 
 registered_audio_provider_settings = {}
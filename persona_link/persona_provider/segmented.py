@@ -0,0 +1,176 @@
+"""
+Segmented generation of audio. Each sentence of a text is looked up in the cache or
+synthesized on its own, in parallel, and the clips are stitched into the audio for the text.
+Replies that share sentences with earlier replies only synthesize the new sentences.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Optional
+
+from persona_link.api_client import APIClient, read_all
+from persona_link.cache.cache import Cache
+from persona_link.cache.models import (EXTENSION_MAPPING, ContentType,
+                                       DataToStore)
+from persona_link.tts.stitching import split_sentences, stitch_mp3, stitch_wav
+
+from .models import (AudioProviderSettings, AvatarType, Metadata,
+                     VideoProviderSettings, Viseme, WordTimestamp)
+
+if TYPE_CHECKING:
+    from .base import PersonaBase
+
+STITCHERS = {
+    ContentType.MP3: stitch_mp3,
+    ContentType.WAV: stitch_wav,
+}
+
+
+@dataclass
+class _Segment:
+    media: bytes
+    content_type: ContentType
+    visemes: Optional[List[Viseme]]
+    word_timestamps: Optional[List[WordTimestamp]]
+    metadata: Optional[Metadata]
+
+
+def _content_type(path: str) -> ContentType:
+    for content_type, extension in EXTENSION_MAPPING.items():
+        if path.endswith(extension):
+            return content_type
+    raise ValueError(f"Unknown content type of '{path}'")
+
+
+async def _synthesize(
+    persona: "PersonaBase",
+    cache: Cache,
+    avatar_id: str,
+    sentence: str,
+    settings: AudioProviderSettings | VideoProviderSettings,
+    semaphore: asyncio.Semaphore,
+) -> _Segment:
+    async with semaphore:
+        data: DataToStore = await persona.generate(sentence, settings)
+    if data is None:
+        raise ValueError(f"the provider returned no data for '{sentence}'")
+    # the clip is needed whole for stitching, so store it from memory rather than a stream
+    media = data.binary_data
+    if media is None:
+        media = APIClient().download(data.source_url)
+    data = data.model_copy(update={"binary_data": await read_all(media), "source_url": None})
+    await cache.put(avatar_id, sentence, data, settings)
+    return _Segment(
+        media=data.binary_data,
+        content_type=data.content_type,
+        visemes=data.visemes,
+        word_timestamps=data.word_timestamps,
+        metadata=data.metadata,
+    )
+
+
+async def _segment(
+    persona: "PersonaBase",
+    cache: Cache,
+    avatar_id: str,
+    sentence: str,
+    settings: AudioProviderSettings | VideoProviderSettings,
+    semaphore: asyncio.Semaphore,
+) -> _Segment:
+    record = await cache.get(avatar_id, sentence, settings)
+    if record is None:
+        # a separate flight key, renders of the same key resolve to a different result type
+        return await cache.inflight.do(
+            f"segment:{cache.key(avatar_id, sentence, settings)}",
+            lambda: _synthesize(persona, cache, avatar_id, sentence, settings, semaphore),
+        )
+    media, (visemes, word_timestamps) = await asyncio.gather(
+        cache.read_media(record), cache.read_sidecars(record)
+    )
+    return _Segment(
+        media=media,
+        content_type=_content_type(record.storage_paths.media_path),
+        visemes=visemes,
+        word_timestamps=word_timestamps,
+        metadata=record.metadata,
+    )
+
+
+async def generate_segmented(
+    persona: "PersonaBase",
+    cache: Cache,
+    avatar_id: str,
+    text: str,
+    settings: AudioProviderSettings | VideoProviderSettings,
+    concurrency: int = 4,
+) -> DataToStore:
+    """
+    Generate the audio for the text sentence by sentence. Sentences found in the cache are reused,
+    the others are synthesized with at most `concurrency` running at a time and cached on their own.
+    MP3 clips are stitched on frame boundaries and WAV clips on sample boundaries, the visemes and
+    word timestamps are shifted to the position of their sentence and the duration is recomputed.
+
+    Parameters:
+        persona (PersonaBase): The persona provider that synthesizes a sentence
+        cache (Cache): The cache for the sentences
+        avatar_id (str): The avatar ID
+        text (str): The normalized text to be spoken by the avatar
+        settings (AudioProviderSettings | VideoProviderSettings): The settings for the provider
+        concurrency (int): Maximum number of sentences synthesized at a time
+
+    Returns:
+        The data to store for the stitched audio
+    """
+    sentences = split_sentences(text)
+    if len(sentences) <= 1:
+        return await persona.generate(text, settings)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    segments: List[_Segment] = await asyncio.gather(
+        *[
+            _segment(persona, cache, avatar_id, sentence, settings, semaphore)
+            for _, sentence in sentences
+        ]
+    )
+
+    content_type = segments[0].content_type
+    if content_type not in STITCHERS or any(
+        s.content_type != content_type for s in segments
+    ):
+        raise ValueError(f"Cannot stitch clips of content type {content_type}")
+    media, durations = STITCHERS[content_type]([s.media for s in segments])
+
+    visemes: Optional[List[Viseme]] = None
+    word_timestamps: Optional[List[WordTimestamp]] = None
+    start = 0.0
+    for (text_offset, _), segment, duration in zip(sentences, segments, durations):
+        shift = round(start * 1000)
+        if segment.visemes is not None:
+            visemes = visemes or []
+            visemes.extend(
+                v.model_copy(update={"offset": v.offset + shift}) for v in segment.visemes
+            )
+        if segment.word_timestamps is not None:
+            word_timestamps = word_timestamps or []
+            word_timestamps.extend(
+                w.model_copy(
+                    update={
+                        "offset": w.offset + shift,
+                        "text_offset": w.text_offset + text_offset,
+                    }
+                )
+                for w in segment.word_timestamps
+            )
+        start += duration
+
+    metadata = (segments[0].metadata or Metadata()).model_copy(
+        update={"duration_seconds": sum(durations)}
+    )
+    return DataToStore(
+        binary_data=media,
+        content_type=content_type,
+        data_type=AvatarType.AUDIO,
+        visemes=visemes,
+        word_timestamps=word_timestamps,
+        metadata=metadata,
+    )
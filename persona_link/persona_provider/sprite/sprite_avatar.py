@@ -1,7 +1,8 @@
 from persona_link.cache.models import ContentType, DataToStore, Metadata
 from persona_link.persona_provider import persona_link_provider
 from persona_link.persona_provider.base import AvatarType, PersonaBase
-from persona_link.persona_provider.models import AudioInstance
+from persona_link.persona_provider.models import (AudioInstance,
+                                                  AudioProviderSettings)
 from persona_link.tts import tts_factory
 
 from .models import SpriteAvatarSettings
@@ -33,6 +34,18 @@ class SpriteAvatar(PersonaBase):
         """
         return SpriteAvatarSettings.validate(settings)
 
+    def audio_settings(self, settings: SpriteAvatarSettings) -> AudioProviderSettings:
+        """
+        Get the settings the avatar synthesizes speech with
+
+        Parameters:
+            settings (SpriteAvatarSettings): The settings for the sprite provider
+
+        Returns:
+            the audio provider settings of the sprite
+        """
+        return settings.audio_settings
+
     async def generate(self, text: str, settings: SpriteAvatarSettings) -> DataToStore:
         """
         Generate the audio and visemes for the sprite avatar
@@ -56,7 +69,7 @@ class SpriteAvatar(PersonaBase):
             visemes=audio.visemes,
             word_timestamps=audio.word_timestamps,
             metadata=Metadata(
-                bit_rate_kbp=settings.audio_settings.bit_rate_kbps,
+                bit_rate_kbps=settings.audio_settings.bit_rate_kbps,
                 sampling_rate_hz=settings.audio_settings.sampling_rate_hz,
                 duration_seconds=audio.duration_seconds,
             ),
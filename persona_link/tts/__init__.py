@@ -1,6 +1,7 @@
 from .azure.azure_tts import AzureTTS
 from .azure.models import AzureTTSVoiceSettings
 from .base import TTSBase
-from .factory import tts_factory
+from .factory import install_synthesis_memo, tts_factory
+from .memo import MemoizedTTS
 
-__all__ = ["AzureTTS", "AzureTTSVoiceSettings", "TTSBase", "tts_factory"]
+__all__ = ["AzureTTS", "AzureTTSVoiceSettings", "MemoizedTTS", "TTSBase", "install_synthesis_memo", "tts_factory"]
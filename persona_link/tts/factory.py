@@ -1,20 +1,51 @@
+from typing import TYPE_CHECKING, Optional
+
 from persona_link.persona_provider.models import AudioProviderSettings
 
 from .base import TTSBase
 
+if TYPE_CHECKING:
+    from persona_link.cache.cache import Cache
+
+_memo_cache: Optional["Cache"] = None
+
+
+def install_synthesis_memo(cache: Optional["Cache"]) -> None:
+    """
+    Memoize the speech synthesized by the providers of the factory in the given cache,
+    so that avatars sharing a voice reuse the audio, visemes and word timestamps of a text.
+    The memo is keyed on the exact text, the texts are normalized by the avatars beforehand.
+    The cache must be content-addressed, so that the audio an avatar stores for a memoized
+    speech references the files of the memo instead of storing them again.
+
+    Parameters:
+        cache (Optional[Cache]): The content-addressed cache for the memo, None to synthesize without memo
+    """
+    global _memo_cache
+    if cache is not None:
+        if not cache.content_addressed:
+            raise ValueError("the synthesis memo requires a content-addressed cache")
+        from persona_link.tts.memo import MemoizedTTS
+        cache.set_normalizer(MemoizedTTS.MEMO_AVATAR, None)
+    _memo_cache = cache
+
 
 def tts_factory(settings: AudioProviderSettings) -> TTSBase:
     """
     Factory method to get the TTS provider
-    
+
     Parameters:
         settings (AudioProviderSettings): The settings for the TTS provider
-        
+
     Returns:
-        TTSBase: The TTS provider instance
+        TTSBase: The TTS provider instance, memoized if a synthesis memo is installed
     """
     if settings.provider_name == "azure":
         from persona_link.tts.azure.azure_tts import AzureTTS
-        return AzureTTS()
+        tts = AzureTTS()
     else:
-        raise ValueError("Invalid TTS provider")
\ No newline at end of file
+        raise ValueError("Invalid TTS provider")
+    if _memo_cache is not None:
+        from persona_link.tts.memo import MemoizedTTS
+        return MemoizedTTS(tts, _memo_cache)
+    return tts
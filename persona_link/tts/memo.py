@@ -0,0 +1,140 @@
+"""
+Voice-level memo of synthesized speech, shared by every avatar that speaks with the same voice
+"""
+
+import asyncio
+import io
+from typing import TYPE_CHECKING
+
+from persona_link.api_client import read_all
+from persona_link.cache.models import ContentType, DataToStore
+from persona_link.persona_provider.models import (AudioFormat, AudioInstance,
+                                                  AudioProviderSettings,
+                                                  AvatarType, Metadata)
+
+from .base import TTSBase
+
+if TYPE_CHECKING:
+    from persona_link.cache.cache import Cache
+
+CONTENT_TYPES = {
+    AudioFormat.MP3: ContentType.MP3,
+    AudioFormat.WAV: ContentType.WAV,
+}
+
+# settings that change how the audio is delivered, not the audio that is synthesized
+UNVOICED_SETTINGS = frozenset({"streaming", "segmented"})
+
+
+def voice_settings(settings: AudioProviderSettings) -> dict:
+    """
+    Get the settings that determine the synthesized speech: the provider, its voice settings
+    such as voice name and language, the output format and whether visemes and word timestamps are included
+
+    Parameters:
+        settings (AudioProviderSettings): The settings for the TTS provider
+
+    Returns:
+        The settings the memo is keyed on
+    """
+    return settings.model_dump(mode="json", exclude=set(UNVOICED_SETTINGS))
+
+
+class MemoizedTTS(TTSBase):
+    """
+    TTS provider that looks up the speech for a text in the cache before synthesizing it.
+
+    The speech is cached under the `MEMO_AVATAR` pseudo avatar and keyed on the voice settings
+    and the text, not on the avatar, so avatars that share a voice synthesize a text only once.
+    Concurrent misses for the same voice and text are coalesced into one synthesis.
+    """
+    MEMO_AVATAR = "_tts"
+
+    def __init__(self, tts: TTSBase, cache: "Cache"):
+        """
+        Constructor for MemoizedTTS class.
+
+        Parameters:
+            tts (TTSBase): The TTS provider that synthesizes on a miss
+            cache (Cache): The cache holding the memo
+        """
+        if tts is None:
+            raise ValueError("tts cannot be None")
+        if cache is None:
+            raise ValueError("cache cannot be None")
+        self.tts = tts
+        self.cache = cache
+
+    async def _load(self, text: str, voice: dict) -> AudioInstance | None:
+        record = await self.cache.get(self.MEMO_AVATAR, text, voice)
+        if record is None:
+            return None
+        media, (visemes, word_timestamps) = await asyncio.gather(
+            self.cache.read_media(record), self.cache.read_sidecars(record)
+        )
+        return AudioInstance(
+            duration_seconds=record.metadata.duration_seconds if record.metadata else None,
+            content=media,
+            visemes=visemes,
+            word_timestamps=word_timestamps,
+        )
+
+    async def _synthesize(
+        self, text: str, settings: AudioProviderSettings, voice: dict
+    ) -> AudioInstance:
+        audio = await self.tts.synthesize_speech(text, settings)
+        audio = AudioInstance(
+            duration_seconds=audio.duration_seconds,
+            content=await read_all(audio.content),
+            visemes=audio.visemes,
+            word_timestamps=audio.word_timestamps,
+        )
+        data = DataToStore(
+            binary_data=audio.content,
+            content_type=CONTENT_TYPES[settings.audio_format],
+            data_type=AvatarType.AUDIO,
+            visemes=audio.visemes,
+            word_timestamps=audio.word_timestamps,
+            metadata=Metadata(
+                bit_rate_kbps=settings.bit_rate_kbps,
+                sampling_rate_hz=settings.sampling_rate_hz,
+                duration_seconds=audio.duration_seconds,
+            ),
+        )
+        try:
+            await self.cache.put(self.MEMO_AVATAR, text, data, voice)
+        except Exception as e:
+            # the memo is an optimization, the speech is still returned to the avatar
+            print(f"Failed to memoize speech for '{text}': {e}")
+        return audio
+
+    async def synthesize_speech(self, text: str, settings: AudioProviderSettings) -> AudioInstance:
+        """
+        Get the speech for the text from the memo, synthesizing and memoizing it on a miss
+
+        Parameters:
+            text (str): The text to synthesize
+            settings (AudioProviderSettings): The settings for the TTS provider
+
+        Returns:
+            AudioInstance: The audio instance, streamed from memory if the settings ask for streaming
+        """
+        if settings.audio_format not in CONTENT_TYPES:
+            return await self.tts.synthesize_speech(text, settings)
+
+        voice = voice_settings(settings)
+        key = self.cache.key(self.MEMO_AVATAR, text, voice)
+        audio = await self._load(text, voice)
+        if audio is None:
+            audio = await self.cache.inflight.do(
+                f"tts:{key}", lambda: self._synthesize(text, settings, voice)
+            )
+        # the memo record is used like any other, so that eviction keeps the speech in use
+        await self.cache.incrementUsage(key)
+        # every caller gets its own instance, coalesced callers share the result of the flight
+        return audio.model_copy(
+            update={
+                "streaming": settings.streaming,
+                "content": io.BytesIO(audio.content) if settings.streaming else audio.content,
+            }
+        )
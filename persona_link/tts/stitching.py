@@ -0,0 +1,196 @@
+"""
+Splitting of text into sentences and stitching of the audio synthesized for them.
+
+MP3 clips are joined on frame boundaries and WAV clips on sample boundaries, so the
+duration of the stitched audio is exactly the sum of the durations of the clips.
+"""
+
+import re
+import struct
+from dataclasses import dataclass
+from typing import List, Tuple
+
+_SENTENCE = re.compile(r"\S.*?(?:[.!?…]+[\"'”’)\]]*(?=\s|$)|$)", re.S)
+
+# MPEG audio tables, indexed by version (1, 2, 2.5) and layer (1, 2, 3)
+_MPEG1, _MPEG2, _MPEG25 = 3, 2, 0
+_SAMPLE_RATES = {
+    _MPEG1: (44100, 48000, 32000),
+    _MPEG2: (22050, 24000, 16000),
+    _MPEG25: (11025, 12000, 8000),
+}
+_BITRATES = {
+    (_MPEG1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (_MPEG1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (_MPEG1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (_MPEG2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (_MPEG2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_BITRATES[(_MPEG2, 3)] = _BITRATES[(_MPEG2, 2)]
+for _layer in (1, 2, 3):
+    _BITRATES[(_MPEG25, _layer)] = _BITRATES[(_MPEG2, _layer)]
+
+
+def split_sentences(text: str) -> List[Tuple[int, str]]:
+    """
+    Split the text into sentences. A sentence ends at `.`, `!`, `?` or `…`
+    followed by whitespace or the end of the text, so decimals such as 3.5 are kept whole.
+
+    Parameters:
+        text (str): The text to split
+
+    Returns:
+        The offset in the text and the text of each sentence
+    """
+    return [(m.start(), m.group().rstrip()) for m in _SENTENCE.finditer(text)]
+
+
+@dataclass
+class Clip:
+    """
+    Audio data of a clip without container headers
+
+    Attributes:
+        data (bytes): MP3 frames or PCM samples of the clip
+        duration_seconds (float): Exact duration of the clip
+    """
+    data: bytes
+    duration_seconds: float
+
+
+def _skip_id3(data: bytes) -> int:
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        return 10 + size + (10 if data[5] & 0x10 else 0)
+    return 0
+
+
+def _mp3_frame(data: bytes, i: int) -> Tuple[int, int, int]:
+    """
+    Parse the MPEG audio frame header at the given position
+
+    Returns:
+        The length of the frame in bytes, its number of samples and the sample rate
+    """
+    if i + 4 > len(data) or data[i] != 0xFF or data[i + 1] & 0xE0 != 0xE0:
+        raise ValueError(f"No MPEG audio frame at byte {i}")
+    version = (data[i + 1] >> 3) & 0x03
+    layer = 4 - ((data[i + 1] >> 1) & 0x03)
+    bitrate_index = data[i + 2] >> 4
+    rate_index = (data[i + 2] >> 2) & 0x03
+    padding = (data[i + 2] >> 1) & 0x01
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        raise ValueError(f"Unsupported MPEG audio frame at byte {i}")
+
+    bitrate = _BITRATES[(version, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    if layer == 3 and version != _MPEG1:
+        return 72 * bitrate // sample_rate + padding, 576, sample_rate
+    return 144 * bitrate // sample_rate + padding, 1152, sample_rate
+
+
+def _is_info_frame(frame: bytes) -> bool:
+    # Xing/Info and VBRI frames carry no audio, only a summary of the stream
+    return any(tag in frame[:64] for tag in (b"Xing", b"Info", b"VBRI"))
+
+
+def mp3_clip(data: bytes) -> Clip:
+    """
+    Get the audio frames of an MP3 file, without ID3 tags and the Xing/Info frame
+
+    Parameters:
+        data (bytes): The MP3 file
+
+    Returns:
+        The frames and their exact duration
+    """
+    i = _skip_id3(data)
+    frames: List[bytes] = []
+    samples = 0
+    sample_rate = None
+    while i + 4 <= len(data):
+        if data[i : i + 3] == b"TAG":  # ID3v1 tag at the end
+            break
+        length, frame_samples, rate = _mp3_frame(data, i)
+        frame = data[i : i + length]
+        if sample_rate is None:
+            sample_rate = rate
+            if _is_info_frame(frame):
+                i += length
+                continue
+        elif rate != sample_rate:
+            raise ValueError("MP3 sample rate changes within the clip")
+        frames.append(frame)
+        samples += frame_samples
+        i += length
+    if sample_rate is None:
+        return Clip(data=b"", duration_seconds=0.0)
+    return Clip(data=b"".join(frames), duration_seconds=samples / sample_rate)
+
+
+def stitch_mp3(clips: List[bytes]) -> Tuple[bytes, List[float]]:
+    """
+    Join MP3 files on frame boundaries
+
+    Parameters:
+        clips (List[bytes]): The MP3 files, with the same sample rate
+
+    Returns:
+        The joined MP3 and the exact duration of each clip in seconds
+    """
+    parsed = [mp3_clip(clip) for clip in clips]
+    return b"".join(c.data for c in parsed), [c.duration_seconds for c in parsed]
+
+
+def _wav_chunks(data: bytes) -> Tuple[bytes, bytes]:
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("Not a WAV file")
+    fmt = samples = None
+    i = 12
+    while i + 8 <= len(data):
+        chunk_id, size = struct.unpack("<4sI", data[i : i + 8])
+        body = data[i + 8 : i + 8 + size]
+        if chunk_id == b"fmt ":
+            fmt = body
+        elif chunk_id == b"data":
+            samples = body
+        i += 8 + size + (size & 1)
+    if fmt is None or samples is None:
+        raise ValueError("WAV file without fmt or data chunk")
+    return fmt, samples
+
+
+def stitch_wav(clips: List[bytes]) -> Tuple[bytes, List[float]]:
+    """
+    Join WAV files on sample boundaries
+
+    Parameters:
+        clips (List[bytes]): The WAV files, with the same format
+
+    Returns:
+        The joined WAV and the exact duration of each clip in seconds
+    """
+    fmt = None
+    parts: List[bytes] = []
+    durations: List[float] = []
+    for clip in clips:
+        clip_fmt, samples = _wav_chunks(clip)
+        if fmt is None:
+            fmt = clip_fmt
+        elif clip_fmt != fmt:
+            raise ValueError("WAV clips have different formats")
+        _, _, sample_rate, _, block_align = struct.unpack("<HHIIH", fmt[:14])
+        samples = samples[: len(samples) - len(samples) % block_align]
+        parts.append(samples)
+        durations.append(len(samples) / block_align / sample_rate)
+
+    data = b"".join(parts)
+    header = (
+        struct.pack("<4sI4s", b"RIFF", 4 + 8 + len(fmt) + 8 + len(data), b"WAVE")
+        + struct.pack("<4sI", b"fmt ", len(fmt))
+        + fmt
+        + struct.pack("<4sI", b"data", len(data))
+    )
+    return header + data, durations
@@ -5,26 +5,31 @@ validation, security measures, and handling multiple tenants.
 """
 
 import json
+import math
 from typing import List
 
-from fastapi import BackgroundTasks, FastAPI, WebSocket
+from fastapi import BackgroundTasks, FastAPI, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from tortoise.contrib.fastapi import register_tortoise
 
 from persona_link.api_client import APIClient
 from persona_link.avatar import Avatar, AvatarInput, get_avatar_info, speak
-from persona_link.avatar.models import AvatarPydantic, AvatarifyRequest
+from persona_link.avatar.models import (AvatarifyRequest, AvatarPydantic,
+                                       PrewarmStatus)
 from persona_link.avatar.utils import call_webhook
-from persona_link.cache import AzureStorage, Cache, RelationalDB, md5hash
+from persona_link.persona_provider import GenerationError
 from persona_link.persona_provider.models import SpeakingAvatarInstance
 
 from .models import (AvatarListModel, ConnectedAvatar, Conversation,
                      ConversationAvatar, ConversationMessage,
                      ConversationPydantic, Feedback, FeedbackPydantic, Message,
                      MessagePydantic, PersonaType)
+from .media import router as media_router
+from .media import stream_router
 from .settings import TORTOISE_ORM
+from .utils import DateTimeEncoder, cache, evictor, prewarmer
 from .ws import connections, router
-from .utils import DateTimeEncoder
 
 app = FastAPI()
 
@@ -38,7 +43,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-cache = Cache(AzureStorage(), RelationalDB(), md5hash)
+# registered before tortoise so that shutdown flushes the cache before the database is closed
+@app.on_event("startup")
+async def startup():
+    await cache.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await prewarmer.stop()
+    await evictor.stop()
+    await cache.close()
+
+
+@app.exception_handler(GenerationError)
+async def generation_error_handler(request: Request, exc: GenerationError):
+    # the provider failed for this text, tell the client when it is worth asking again
+    headers = {}
+    if exc.retry_after is not None:
+        headers["Retry-After"] = str(math.ceil(exc.retry_after))
+    return JSONResponse(
+        status_code=503,
+        content={"error": exc.reason, "retry_after": exc.retry_after},
+        headers=headers,
+    )
+
 
 register_tortoise(
     app,
@@ -48,7 +77,16 @@ register_tortoise(
 )
 
 
+# registered after tortoise so that the first sweep and the queued prewarms find the database
+@app.on_event("startup")
+async def start_background_work():
+    evictor.start()
+    prewarmer.start()
+
+
 app.include_router(router, prefix="/ws")
+app.include_router(media_router, prefix="/media")
+app.include_router(stream_router, prefix="/stream")
 
 
 @app.get("/")
@@ -56,6 +94,24 @@ async def read_root():
     return {"Hello": "World"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """
+    Metrics of the cache and of the generation of avatars in the Prometheus text format
+
+    route: `/metrics`
+    method: GET
+
+    Returns:
+        PlainTextResponse: Hits and misses per avatar and provider, latency histograms and bytes stored per avatar as of the last eviction sweep
+    """
+    # the storage usage is read by the evictor, a scrape never queries the database
+    return PlainTextResponse(
+        cache.metrics.render(evictor.usage),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
 #################################################
 # AVATAR Management Routes
 #################################################
@@ -92,8 +148,10 @@ async def create_avatar(data: ConnectedAvatar) -> AvatarPydantic:
         Avatar: The created avatar
     """
     avatar = await Avatar.create_avatar(
-        data.avatar_settings, data.webhook_settings, data.initial_message
+        data.avatar_settings, data.webhook_settings, data.initial_message, data.phrases
     )
+    # generate the initial message and phrases before the first conversation needs them
+    prewarmer.enqueue(avatar.slug)
     return AvatarPydantic(
         name=avatar.name,
         provider=avatar.provider,
@@ -120,9 +178,11 @@ async def update_avatar(avatar_slug: str, data: ConnectedAvatar) -> AvatarPydant
     if avatar is None:
         raise ValueError(f"Avatar '{avatar_slug}' not found")
 
+    previous_key = prewarmer.initial_message_key(avatar)
     avatar = await avatar.update_avatar(
-        data.avatar_settings, data.webhook_settings, data.initial_message
+        data.avatar_settings, data.webhook_settings, data.initial_message, data.phrases
     )
+    prewarmer.enqueue(avatar.slug, unpin=[previous_key])
     return AvatarPydantic(
         name=avatar.name,
         provider=avatar.provider,
@@ -130,6 +190,45 @@ async def update_avatar(avatar_slug: str, data: ConnectedAvatar) -> AvatarPydant
     )
 
 
+@app.get("/avatar/{avatar_slug}/prewarm/")
+async def get_prewarm_status(avatar_slug: str) -> PrewarmStatus:
+    """
+    Get the status of the background generation of the initial message and phrases of the avatar
+
+    route: `/avatar/{avatar_slug}/prewarm/`
+    method: GET
+
+    Parameters:
+        avatar_slug (str): The slug of the avatar
+
+    Returns:
+        PrewarmStatus: The status of the latest prewarm of the avatar
+    """
+    status = prewarmer.status(avatar_slug)
+    if status is None:
+        raise ValueError(f"Avatar '{avatar_slug}' has no prewarm")
+    return status
+
+
+@app.post("/avatar/{avatar_slug}/prewarm/")
+async def start_prewarm(avatar_slug: str) -> PrewarmStatus:
+    """
+    Queue the generation of the initial message and phrases of the avatar
+
+    route: `/avatar/{avatar_slug}/prewarm/`
+    method: POST
+
+    Parameters:
+        avatar_slug (str): The slug of the avatar
+
+    Returns:
+        PrewarmStatus: The status of the queued prewarm
+    """
+    if not await Avatar.exists(slug=avatar_slug):
+        raise ValueError(f"Avatar '{avatar_slug}' not found")
+    return prewarmer.enqueue(avatar_slug)
+
+
 @app.delete("/avatar/{avatar_slug}/")
 async def delete_avatar(avatar_slug: str) -> dict:
     """
@@ -166,6 +265,14 @@ async def create_avatar_and_call_webhook(avatar_slug: str, request: AvatarifyReq
           "error": None
         }
         await APIClient().post_request(request.callback_url, request.headers, data)
+    except GenerationError as e:
+        data = {
+          "model": None,
+          "status": "error",
+          "error": str(e),
+          "retry_after": e.retry_after
+        }
+        await APIClient().post_request(request.callback_url, request.headers, data)
     except Exception as e:
         data = {
           "model": None,
@@ -301,6 +408,9 @@ async def construct_and_send(input: AvatarInput, websocket: WebSocket, conversat
         media_url=speech.urls.media_url,
         visemes_url=speech.urls.visemes_url,
         word_timestamps_url=speech.urls.word_timestamps_url,
+        sidecar_url=speech.urls.sidecar_url,
+        visemes=[v.model_dump() for v in speech.visemes] if speech.visemes is not None else None,
+        word_timestamps=[w.model_dump() for w in speech.word_timestamps] if speech.word_timestamps is not None else None,
         metadata=speech.metadata.model_dump(),
         media_type=speech.avatar_type,
     )
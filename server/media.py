@@ -0,0 +1,194 @@
+"""
+Serving of the media of a local storage cache over HTTP, for urls signed by `LocalStorage.get`,
+and of the media streamed into the cache through its tee
+"""
+
+import mimetypes
+import os
+import re
+import stat
+from email.utils import formatdate
+from typing import Optional, Tuple
+
+import anyio
+from fastapi import APIRouter, Request
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from persona_link.cache import LocalStorage
+
+from .utils import cache
+
+router = APIRouter()
+stream_router = APIRouter()
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+def _byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]] | bool:
+    """
+    Parse a Range header with a single range
+
+    Returns:
+        The first and last byte of the range, None to serve the whole file, False if the range cannot be satisfied
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if match is None:
+        # multiple or other ranges, the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            return False
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        return False
+    return first, last
+
+
+class MediaResponse(Response):
+    """
+    Response with a file of the cache, or a range of it.
+
+    Files of the cache never change under the same name, so they are sent with a strong ETag and
+    an immutable Cache-Control. A whole file is handed to the server with the ASGI pathsend
+    extension where the server supports it, so that it is sent with sendfile without passing
+    through Python. Ranges, and whole files on other servers, are read in large chunks.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, path: str, request: Request, max_age: int = 31536000):
+        super().__init__(status_code=200)
+        self.path = path
+        self.request = request
+        self.max_age = max_age
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+        except FileNotFoundError:
+            stat_result = None
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            await Response(status_code=404)(scope, receive, send)
+            return
+
+        size = stat_result.st_size
+        etag = f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{size:x}"'
+        headers = {
+            "accept-ranges": "bytes",
+            "cache-control": f"public, max-age={self.max_age}, immutable",
+            "etag": etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "content-type": mimetypes.guess_type(self.path)[0] or "application/octet-stream",
+        }
+        if_none_match = self.request.headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in if_none_match):
+            await Response(status_code=304, headers=headers)(scope, receive, send)
+            return
+
+        byte_range = _byte_range(self.request.headers.get("range"), size)
+        if byte_range is False:
+            headers["content-range"] = f"bytes */{size}"
+            await Response(status_code=416, headers=headers)(scope, receive, send)
+            return
+
+        status = 200
+        first, last = 0, size - 1
+        if byte_range is not None and self.request.headers.get("if-range", etag) == etag:
+            first, last = byte_range
+            status = 206
+            headers["content-range"] = f"bytes {first}-{last}/{size}"
+        headers["content-length"] = str(last - first + 1)
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(k.encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()],
+            }
+        )
+        if scope["method"].upper() == "HEAD" or size == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        elif status == 200 and "http.response.pathsend" in scope.get("extensions", {}):
+            await send({"type": "http.response.pathsend", "path": self.path})
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(first)
+                remaining = last - first + 1
+                while remaining > 0:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": remaining > 0}
+                    )
+                if remaining > 0:
+                    # the file shrank while it was read, end the response anyway
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD"])
+async def media(path: str, expires: int, signature: str, request: Request) -> Response:
+    """
+    Serve a file of the local storage of the cache, for a url signed by the storage.
+    Supports Range, If-Range and If-None-Match requests.
+
+    route: `/media/{path}?expires=...&signature=...`
+    method: GET, HEAD
+
+    Parameters:
+        path (str): The path of the file relative to the storage
+        expires (int): The expiry of the url, in seconds since the epoch
+        signature (str): The signature of the url
+
+    Returns:
+        MediaResponse: The file or the requested range of it, 403 if the url is not valid
+    """
+    storage = cache.storage
+    full_path = storage.verify(path, expires, signature) if isinstance(storage, LocalStorage) else None
+    if full_path is None:
+        return Response(status_code=403)
+    return MediaResponse(full_path, request)
+
+
+@stream_router.get("/{key}")
+async def stream(key: str, expires: int, signature: str) -> Response:
+    """
+    Stream the media of a record while it is put in the cache, for a url signed by the tee.
+    Readers that join late get the media received so far first. Media the storage copies from
+    the provider itself is served by a redirect to the provider's url while it is copied.
+    Once the record is stored this redirects to its media.
+
+    route: `/stream/{key}?expires=...&signature=...`
+    method: GET
+
+    Parameters:
+        key (str): The key of the record
+        expires (int): The expiry of the url, in seconds since the epoch
+        signature (str): The signature of the url
+
+    Returns:
+        StreamingResponse: The media, a redirect to the stored media, 404 if there is no such record, 403 if the url is not valid
+    """
+    if cache.tee is None or not cache.tee.verify(key, expires, signature):
+        return Response(status_code=403)
+    buffer = cache.tee.get(key)
+    if buffer is not None and buffer.redirect is not None:
+        return RedirectResponse(buffer.redirect, status_code=307)
+    if buffer is not None:
+        return StreamingResponse(
+            buffer.read(),
+            media_type=buffer.data.content_type.value,
+            headers={"cache-control": "no-store"},
+        )
+    record = await cache.db.get(key)
+    if record is None:
+        return Response(status_code=404)
+    urls = await cache.get_urls(record)
+    return RedirectResponse(urls.media_url, status_code=307)
@@ -0,0 +1,43 @@
+"""
+Command line tool to move the files of a local storage cache from the flat `avatarId/filename`
+layout into the sharded layout. The records keep their paths, and the server can keep running
+while the files are moved.
+
+Run as
+python -m server.migrate_storage
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from typing import List
+
+from persona_link.cache import LocalStorage
+
+
+async def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Move the files of the local storage into the sharded layout")
+    parser.add_argument("--io-workers", type=int, default=32, help="threads running the filesystem calls")
+    args = parser.parse_args(argv)
+
+    storage = LocalStorage(io_workers=args.io_workers)
+    start = time.monotonic()
+    moved = 0
+
+    def progress(files: int) -> None:
+        nonlocal moved
+        moved += files
+        print(f"{moved} files moved", flush=True)
+
+    try:
+        await storage.start()
+        total = await storage.migrate_layout(progress)
+    finally:
+        await storage.close()
+    print(f"Moved {total} files into the sharded layout in {time.monotonic() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 
 from pydantic import BaseModel, ConfigDict
 from tortoise import fields
@@ -18,10 +18,12 @@ class ConnectedAvatar(BaseModel):
         avatar_settings (Optional[AvatarPydantic]): Settings of the Avatar. Defaults to None.
         webhook_settings (Optional[WebhookPydantic]): Settings of the Webhook. Defaults to None.
         initial_message (Optional[str]): Initial message for Avatar to speak. Defaults to None.
+        phrases (Optional[List[str]]): Phrases the Avatar often speaks, generated ahead of time. Defaults to None.
     """
     avatar_settings: Optional[AvatarPydantic] = None
     webhook_settings: Optional[WebhookPydantic] = None
     initial_message: Optional[str] = None
+    phrases: Optional[List[str]] = None
     
 class AvatarListModel(BaseModel):
     """
@@ -60,6 +62,9 @@ class Message(Model):
         media_url (str): media url or audio or video
         visemes_url (str): visemes url from agent
         word_timestamps_url (str): word timestamps url from agent
+        sidecar_url (str): binary sidecar url from agent, with both the visemes and the word timestamps
+        visemes (list): visemes from agent, when sent inline instead of by url
+        word_timestamps (list): word timestamps from agent, when sent inline instead of by url
         metadata (dict): metadata for the message
         media_type (AvatarType): type of media
         created_at (datetime): Creation timestamp
@@ -71,6 +76,9 @@ class Message(Model):
     media_url = fields.CharField(255, description="media url or audio or video", null=True)
     visemes_url = fields.CharField(255, description="visemes url from agent", null=True)
     word_timestamps_url = fields.CharField(255, description="word timestamps url from agent", null=True)
+    sidecar_url = fields.CharField(255, description="binary sidecar url from agent", null=True)
+    visemes = fields.JSONField(description="visemes from agent, when sent inline", null=True)
+    word_timestamps = fields.JSONField(description="word timestamps from agent, when sent inline", null=True)
     metadata = fields.JSONField(description="metadata for the message", null=True)
     media_type = fields.CharEnumField(AvatarType, description="type of media", null=True)
 
@@ -89,6 +97,9 @@ class MessagePydantic(pydantic_model_creator(Message, name="MessagePydantic")):
         media_url (str): media url or audio or video
         visemes_url (str): visemes url from agent
         word_timestamps_url (str): word timestamps url from agent
+        sidecar_url (str): binary sidecar url from agent, with both the visemes and the word timestamps
+        visemes (list): visemes from agent, when sent inline instead of by url
+        word_timestamps (list): word timestamps from agent, when sent inline instead of by url
         metadata (dict): metadata for the message
         media_type (AvatarType): type of media
         created_at (datetime): Creation timestamp
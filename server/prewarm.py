@@ -0,0 +1,105 @@
+"""
+Command line tool to fill the cache of an avatar with a catalog of scripted lines.
+
+Run as
+python -m server.prewarm <avatar_slug> lines.txt --concurrency 8
+
+The file holds one text per line, or one JSON object per line with a `text` field (NDJSON).
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Iterator, List
+
+from tortoise import Tortoise
+
+from persona_link.avatar import PrewarmProgress, prewarm
+
+from .settings import TORTOISE_ORM
+from .utils import cache
+
+
+def read_texts(path: str) -> Iterator[str]:
+    """
+    Read the texts to prewarm from a plain text or NDJSON file
+
+    Parameters:
+        path (str): Path of the file, `-` for stdin
+
+    Returns:
+        Iterator over the texts in the file
+    """
+    f = sys.stdin if path == "-" else open(path, encoding="utf-8")
+    try:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                yield json.loads(line)["text"]
+            else:
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+class ProgressPrinter:
+    """
+    Prints the prewarm progress at most once per interval
+    """
+
+    def __init__(self, interval: float = 1.0):
+        self.interval = interval
+        self.last = 0.0
+
+    def __call__(self, status: PrewarmProgress):
+        now = time.monotonic()
+        if now - self.last < self.interval and status.done < status.total:
+            return
+        self.last = now
+        print(
+            f"{status.done}/{status.total} done "
+            f"(cached {status.cached}, generated {status.generated}, failed {status.failed}) "
+            f"{status.rate:.2f} texts/s",
+            flush=True,
+        )
+
+
+async def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Fill the cache of an avatar with a catalog of texts")
+    parser.add_argument("avatar_slug", help="slug of the avatar to prewarm")
+    parser.add_argument("file", help="file with one text per line or NDJSON with a text field, - for stdin")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of texts generated at a time")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between progress reports")
+    args = parser.parse_args(argv)
+
+    await Tortoise.init(config=TORTOISE_ORM)
+    try:
+        await cache.start()
+        try:
+            status = await prewarm(
+                args.avatar_slug,
+                cache,
+                read_texts(args.file),
+                concurrency=args.concurrency,
+                progress=ProgressPrinter(args.interval),
+            )
+        finally:
+            # flushes the buffered usage counts, so before the connections close
+            await cache.close()
+    finally:
+        await Tortoise.close_connections()
+
+    print(
+        f"Prewarmed {status.total} texts in {status.elapsed_seconds:.1f}s: "
+        f"{status.cached} already cached, {status.generated} generated, {status.failed} failed"
+    )
+    return 1 if status.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,21 +1,64 @@
 import json
+import os
 from datetime import datetime
 from persona_link.persona_provider.models import SpeakingAvatarInstance
 from .models import (AvatarListModel, ConnectedAvatar, Conversation,
                      ConversationAvatar, ConversationMessage,
                      ConversationPydantic, Feedback, FeedbackPydantic, Message,
                      MessagePydantic, PersonaType)
-from persona_link.avatar import Avatar, AvatarInput, get_avatar_info, speak
+from persona_link.avatar import (Avatar, AvatarInput, Prewarmer, get_avatar_info,
+                                 speak)
 from persona_link.avatar.models import AvatarPydantic
 from fastapi import FastAPI, WebSocket
-from persona_link.cache import AzureStorage, Cache, RelationalDB, md5hash
+from persona_link.cache import (AzureStorage, Cache, CacheEvictor,
+                                CacheMetrics, EvictionPolicy, LocalStorage,
+                                MediaTee, MemoryCache, NegativeCache, Quota,
+                                RelationalDB, SidecarFormat, TextNormalizer,
+                                UsageAggregator, blake2bhash)
+from persona_link.tts import install_synthesis_memo
 
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
             return obj.isoformat()
         return super(DateTimeEncoder, self).default(obj)
-cache = Cache(AzureStorage(), RelationalDB(), md5hash)
+
+
+def _env_int(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+db = RelationalDB()
+cache = Cache(
+    LocalStorage(io_workers=_env_int("LOCAL_STORAGE_IO_WORKERS") or 32)
+    if os.getenv("CACHE_STORAGE") == "local"
+    else AzureStorage(),
+    db,
+    blake2bhash,
+    memory=MemoryCache(),
+    normalizer=TextNormalizer(canonicalize_quotes=True),
+    usage=UsageAggregator(db),
+    negative=NegativeCache(),
+    content_addressed=os.getenv("CACHE_CONTENT_ADDRESSED", "").lower() == "true",
+    sidecar_format=SidecarFormat(os.getenv("CACHE_SIDECAR_FORMAT") or "json"),
+    inline_sidecar_bytes=_env_int("CACHE_INLINE_SIDECAR_BYTES") or 0,
+    metrics=CacheMetrics(),
+    tee=MediaTee(os.getenv("CACHE_TEE_BASE_URL")) if os.getenv("CACHE_TEE_BASE_URL") else None,
+)
+
+# without content addressing the avatars would store a second copy of the memoized audio
+if (os.getenv("CACHE_SYNTHESIS_MEMO") or str(cache.content_addressed)).lower() == "true":
+    install_synthesis_memo(cache)
+
+prewarmer = Prewarmer(cache)
+
+evictor = CacheEvictor(
+    cache,
+    policy=EvictionPolicy(os.getenv("CACHE_EVICTION_POLICY") or "lru"),
+    quota=Quota(max_bytes=_env_int("CACHE_MAX_BYTES")),
+    avatar_quota=Quota(max_bytes=_env_int("CACHE_AVATAR_MAX_BYTES")),
+)
 async def construct_and_send(input: AvatarInput, websocket: WebSocket, conversation: Conversation):
     speech: SpeakingAvatarInstance = await speak(conversation.avatar_slug, cache, input)
 
@@ -26,6 +69,9 @@ async def construct_and_send(input: AvatarInput, websocket: WebSocket, conversat
         media_url=speech.urls.media_url,
         visemes_url=speech.urls.visemes_url,
         word_timestamps_url=speech.urls.word_timestamps_url,
+        sidecar_url=speech.urls.sidecar_url,
+        visemes=[v.model_dump() for v in speech.visemes] if speech.visemes is not None else None,
+        word_timestamps=[w.model_dump() for w in speech.word_timestamps] if speech.word_timestamps is not None else None,
         metadata=speech.metadata.model_dump(),
         media_type=speech.avatar_type,
     )
@@ -6,6 +6,14 @@ from tortoise import Tortoise
 from server.settings import TORTOISE_ORM
 
 
+@pytest.fixture(scope="session")
+def event_loop():
+    # the database connection is shared by the session, so share its event loop too
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
 @pytest.fixture(scope="session", autouse=True)
 def db(request) -> None:
     config = TORTOISE_ORM
@@ -1,12 +1,41 @@
+import asyncio
+import base64
+import os
+import struct
+import time
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
 import pytest
+from azure.core.exceptions import AzureError
 from dotenv import load_dotenv
 
+from persona_link.api_client import APIClient
+from persona_link.avatar import Avatar, AvatarPydantic, Prewarmer, PrewarmState
+
 from persona_link.cache.cache import Cache
-from persona_link.cache.db import RelationalDB
-from persona_link.cache.hashing import md5hash
+from persona_link.cache.db import Blob, RelationalDB
+from persona_link.cache.eviction import CacheEvictor, Quota
+from persona_link.cache.hashing import blake2bhash, derive_key, md5hash
+from persona_link.cache.memory import MemoryCache
+from persona_link.cache.metrics import CacheMetrics
+from persona_link.cache.negative import NegativeCache
+from persona_link.cache.tee import MediaTee
+from persona_link.cache.sidecar import SidecarFormat, decode_sidecar, encode_sidecar
+from persona_link.cache.normalization import TextNormalizer
+from persona_link.cache.usage import UsageAggregator
 from persona_link.cache.models import ContentType, DataToStore, Record
 from persona_link.cache.storage import AzureStorage, LocalStorage
-from persona_link.persona_provider.models import AvatarType, Urls, Viseme
+from persona_link.persona_provider.base import PersonaBase
+from persona_link.persona_provider.errors import GenerationError
+from persona_link.persona_provider.models import (AudioInstance, AvatarType,
+                                                  Metadata, Urls, Viseme,
+                                                  WordTimestamp)
+from persona_link.tts import MemoizedTTS, TTSBase, install_synthesis_memo
+from persona_link.tts.memo import voice_settings
+from persona_link.tts.azure.models import AzureTTSVoiceSettings
+from persona_link.tts.stitching import split_sentences, stitch_wav
 
 load_dotenv()
 
@@ -39,6 +68,322 @@ async def test_cache_local(cache):
     assert await cache.get("avatarId", "text") is None
 
 
+@pytest.mark.asyncio
+async def test_cache_memory_tier():
+    local_storage = LocalStorage()
+    sqlite_db = RelationalDB()
+    memory = MemoryCache(max_entries=1)
+
+    cache = Cache(local_storage, sqlite_db, md5hash, memory=memory)
+    data: DataToStore = DataToStore(
+        binary_data=b"data",
+        content_type=ContentType.MP3,
+        data_type=AvatarType.AUDIO,
+    )
+
+    await cache.deleteAll("avatarId")
+
+    record: Record = await cache.put("avatarId", "text", data)
+    urls: Urls = await cache.get_urls(record)
+    # warm hits are served from memory even if the database row is gone
+    await sqlite_db.delete(record.key)
+    assert await cache.get("avatarId", "text") == record
+    assert await cache.get_urls(record) == urls
+    assert memory.hits == 1
+    assert memory.url_hits == 1
+
+    # least recently used record is evicted beyond max_entries
+    await cache.put("avatarId", "other text", data)
+    assert await cache.get("avatarId", "text") is None
+    assert memory.evictions == 1
+
+    await cache.deleteAll("avatarId")
+    assert len(memory) == 0
+
+
+class FailingSidecarStorage(LocalStorage):
+    async def put(self, avatarId, data, filename, content_type):
+        if content_type == ContentType.JSON:
+            raise IOError("sidecar upload failed")
+        return await super().put(avatarId, data, filename, content_type)
+
+
+@pytest.mark.asyncio
+async def test_cache_put_cleans_up_partial_uploads():
+    storage = FailingSidecarStorage()
+    cache = Cache(storage, RelationalDB(), md5hash)
+    data: DataToStore = DataToStore(
+        binary_data=b"data",
+        content_type=ContentType.MP3,
+        data_type=AvatarType.AUDIO,
+        visemes=[Viseme(offset=0, viseme=21)],
+    )
+    await cache.deleteAll("avatarId")
+
+    with pytest.raises(IOError):
+        await cache.put("avatarId", "text", data)
+
+    key = cache.key("avatarId", "text")
+    assert await storage.get(f"avatarId/{key}.mp3") is None
+    assert await cache.get("avatarId", "text") is None
+
+
+class CountingAvatar(PersonaBase):
+    def __init__(self):
+        self.calls = 0
+
+    @classmethod
+    def validate(cls, settings: dict):
+        return AzureTTSVoiceSettings.validate(settings)
+
+    async def generate(self, text, settings) -> DataToStore:
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        return DataToStore(
+            binary_data=text.encode(),
+            content_type=ContentType.MP3,
+            data_type=AvatarType.AUDIO,
+        )
+
+
+@pytest.mark.asyncio
+async def test_speak_coalesces_concurrent_misses():
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash)
+    await cache.deleteAll("avatarId")
+
+    avatar = CountingAvatar()
+    settings = AzureTTSVoiceSettings(name="en-US-JennyNeural")
+    results = await asyncio.gather(
+        *[avatar.speak(cache, "avatarId", "same reply", settings, "Audio") for _ in range(10)]
+    )
+
+    assert avatar.calls == 1
+    assert all(result is results[0] for result in results)
+    assert len(cache.inflight) == 0
+    assert await cache.getUsageCount(cache.key("avatarId", "same reply", settings)) == 10
+    await cache.deleteAll("avatarId")
+
+
+class RejectingAvatar(CountingAvatar):
+    async def generate(self, text, settings) -> DataToStore:
+        self.calls += 1
+        return None
+
+
+@pytest.mark.asyncio
+async def test_speak_backs_off_failed_generations():
+    negative = NegativeCache(base_seconds=30, factor=2)
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash, negative=negative)
+    avatar = RejectingAvatar()
+    settings = AzureTTSVoiceSettings(name="en-US-JennyNeural")
+
+    with pytest.raises(GenerationError) as first:
+        await avatar.speak(cache, "avatarId", "rejected", settings, "Audio")
+    assert 29 < first.value.retry_after <= 30
+    # fails fast without calling the provider again
+    with pytest.raises(GenerationError) as second:
+        await avatar.speak(cache, "avatarId", "rejected", settings, "Audio")
+    assert avatar.calls == 1
+    assert second.value.key == first.value.key
+    assert await cache.get("avatarId", "rejected", settings) is None
+
+    # consecutive failures back off exponentially
+    assert negative.add(first.value.key, "again").failures == 2
+    assert 59 < negative.get(first.value.key).retry_after <= 60
+
+    negative.clear(first.value.key)
+    with pytest.raises(GenerationError):
+        await avatar.speak(cache, "avatarId", "rejected", settings, "Audio")
+    assert avatar.calls == 2
+
+
+# MPEG-2 layer III, 32 kbps, 16 kHz, mono: 144 bytes and 36 ms per frame
+MP3_FRAME = bytes([0xFF, 0xF3, 0x48, 0xC4]) + bytes(140)
+
+
+class SegmentAvatar(CountingAvatar):
+    def audio_settings(self, settings):
+        return settings
+
+    async def generate(self, text, settings) -> DataToStore:
+        self.calls += 1
+        words = text.split()
+        return DataToStore(
+            binary_data=MP3_FRAME * len(words),
+            content_type=ContentType.MP3,
+            data_type=AvatarType.AUDIO,
+            visemes=[Viseme(offset=0, viseme=1), Viseme(offset=10, viseme=2)],
+            word_timestamps=[
+                WordTimestamp(word=w, offset=36 * i, duration=36, text_offset=text.index(w), word_length=len(w))
+                for i, w in enumerate(words)
+            ],
+            metadata=Metadata(duration_seconds=0.036 * len(words)),
+        )
+
+
+def test_split_sentences():
+    assert split_sentences("Sure, I can help.  It costs 3.5 dollars! Ok?") == [
+        (0, "Sure, I can help."),
+        (19, "It costs 3.5 dollars!"),
+        (41, "Ok?"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_speak_segmented_reuses_sentences():
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash)
+    await cache.deleteAll("avatarId")
+    avatar = SegmentAvatar()
+    settings = AzureTTSVoiceSettings(name="en-US-JennyNeural", segmented=True)
+
+    await avatar.speak(cache, "avatarId", "Sure, I can help. Tell me more.", settings, "Audio")
+    assert avatar.calls == 2
+    await avatar.speak(cache, "avatarId", "Sure, I can help. Something new!", settings, "Audio")
+    assert avatar.calls == 3
+
+    record = await cache.get("avatarId", "Sure, I can help. Something new!", settings)
+    media = await cache.read_media(record)
+    assert media == MP3_FRAME * 6
+    assert record.metadata.duration_seconds == pytest.approx(6 * 0.036)
+    visemes, word_timestamps = await cache.read_sidecars(record)
+    assert [v.offset for v in visemes] == [0, 10, 144, 154]
+    assert [(w.word, w.offset, w.text_offset) for w in word_timestamps[3:]] == [
+        ("help.", 108, 12),
+        ("Something", 144, 18),
+        ("new!", 180, 28),
+    ]
+    # segments are shared with non-segmented renders of the same sentence
+    assert await cache.get("avatarId", "Sure, I can help.", settings.model_copy(update={"segmented": False}))
+    await cache.deleteAll("avatarId")
+
+
+def test_stitch_wav():
+    def wav(samples: bytes) -> bytes:
+        fmt = struct.pack("<HHIIHH", 1, 1, 16000, 32000, 2, 16)
+        return (
+            struct.pack("<4sI4s", b"RIFF", 4 + 24 + 8 + len(samples), b"WAVE")
+            + struct.pack("<4sI", b"fmt ", 16) + fmt
+            + struct.pack("<4sI", b"data", len(samples)) + samples
+        )
+
+    stitched, durations = stitch_wav([wav(b"\x01\x00" * 160), wav(b"\x02\x00" * 320)])
+    assert stitched == wav(b"\x01\x00" * 160 + b"\x02\x00" * 320)
+    assert durations == [0.01, 0.02]
+
+
+@pytest.mark.asyncio
+async def test_cache_get_many_put_many():
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash)
+    await cache.deleteAll("avatarId")
+
+    items = {
+        text: DataToStore(
+            binary_data=text.encode(),
+            content_type=ContentType.MP3,
+            data_type=AvatarType.AUDIO,
+        )
+        for text in ["one", "two", "three"]
+    }
+    records = await cache.put_many("avatarId", items, concurrency=2)
+    assert set(records.keys()) == set(items.keys())
+
+    found = await cache.get_many("avatarId", ["one", "three", "four"])
+    assert found["one"].key == records["one"].key
+    assert found["three"].key == records["three"].key
+    assert found["four"] is None
+    await cache.deleteAll("avatarId")
+
+
+@pytest.mark.asyncio
+async def test_cache_normalizes_text():
+    metrics = CacheMetrics()
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash, normalizer=TextNormalizer(), metrics=metrics)
+    cache.set_normalizer("verbatimId", None)
+    data: DataToStore = DataToStore(
+        binary_data=b"data",
+        content_type=ContentType.MP3,
+        data_type=AvatarType.AUDIO,
+    )
+    await cache.deleteAll("avatarId")
+
+    record = await cache.put("avatarId", "Hello, how can I help?", data)
+    assert (await cache.get("avatarId", "Hello,  how can I help? ")).key == record.key
+    assert (await cache.get("avatarId", "Hello,\nhow can I help?")).key == record.key
+    # misses and texts that were already normalized merge nothing
+    assert await cache.get("avatarId", "Goodbye ") is None
+    await cache.get_many("avatarId", ["Hello, how can I help?", "Hello, how  can I help?", "Bye "])
+    assert metrics.merges["avatarId"] == 3
+    assert 'persona_link_cache_merged_total{avatar="avatarId"} 3' in metrics.render()
+    assert cache.key("verbatimId", "Hello ") != cache.key("verbatimId", "Hello")
+    await cache.deleteAll("avatarId")
+
+
+@pytest.mark.asyncio
+async def test_cache_buffers_usage():
+    sqlite_db = RelationalDB()
+    usage = UsageAggregator(sqlite_db, flush_interval=60, max_buffer=100)
+    cache = Cache(LocalStorage(), sqlite_db, md5hash, usage=usage)
+    data: DataToStore = DataToStore(
+        binary_data=b"data",
+        content_type=ContentType.MP3,
+        data_type=AvatarType.AUDIO,
+    )
+    await cache.deleteAll("avatarId")
+    await cache.start()
+
+    record = await cache.put("avatarId", "text", data)
+    for _ in range(5):
+        await cache.incrementUsage(record.key)
+    assert await sqlite_db.getUsageCount(record.key) == 0
+    assert await cache.getUsageCount(record.key) == 5
+
+    await cache.close()
+    assert await sqlite_db.getUsageCount(record.key) == 5
+    await cache.deleteAll("avatarId")
+
+
+@pytest.mark.asyncio
+async def test_cache_usage_rollups():
+    sqlite_db = RelationalDB()
+    cache = Cache(LocalStorage(), sqlite_db, md5hash)
+    data: DataToStore = DataToStore(
+        binary_data=b"data",
+        content_type=ContentType.MP3,
+        data_type=AvatarType.AUDIO,
+    )
+    await cache.deleteAll("avatarId")
+
+    record = await cache.put("avatarId", "text", data)
+    await sqlite_db.incrementUsageMany({record.key: 3, "missing": 2})
+    await cache.incrementUsage(record.key)
+
+    assert await cache.getUsageCount(record.key) == 4
+    assert (await sqlite_db.get(record.key)).last_used_at is not None
+    assert await cache.getDailyUsage(record.key) == {datetime.now(UTC).date(): 4}
+
+    # raw logs are pruned but the counts survive
+    assert await sqlite_db.pruneUsageLogs(datetime.now(UTC) + timedelta(seconds=1)) == 4
+    assert await cache.getUsageCount(record.key) == 4
+
+    # existing rollups with the same count are updated together
+    other = await cache.put("avatarId", "other", data)
+    await cache.incrementUsage(other.key)
+    await sqlite_db.incrementUsageMany({record.key: 2, other.key: 2})
+    assert await cache.getDailyUsage(record.key) == {datetime.now(UTC).date(): 6}
+    assert await cache.getDailyUsage(other.key) == {datetime.now(UTC).date(): 3}
+    await cache.deleteAll("avatarId")
+
+
+def test_derive_key():
+    settings = AzureTTSVoiceSettings(name="en-US-JennyNeural")
+    assert derive_key("a", "bc") != derive_key("ab", "c")
+    assert derive_key("a", "bc", settings) == derive_key("a", "bc", settings.model_dump())
+    assert derive_key("a", "bc", settings) != derive_key(
+        "a", "bc", AzureTTSVoiceSettings(name="en-US-AriaNeural")
+    )
+    assert len(derive_key("a", "bc", settings)) == len(blake2bhash("")) == 32
+
+
 @pytest.mark.asyncio
 async def test_cache_azure(cache):
     azure_storage = AzureStorage()
@@ -67,4 +412,660 @@ async def test_cache_azure(cache):
     await cache.delete(record.key)
     assert await cache.get("avatarId", "text") == None
     await azure_storage.deleteAll("avatarId")
-    await sqlite_db.deleteAll("avatarId")
\ No newline at end of file
+    await sqlite_db.deleteAll("avatarId")
+
+@pytest.mark.asyncio
+async def test_cache_eviction():
+    sqlite_db = RelationalDB()
+    cache = Cache(LocalStorage(), sqlite_db, md5hash)
+    await cache.deleteAll("avatarId")
+
+    async def stream():
+        yield b"da"
+        yield b"ta"
+
+    records = {}
+    for text in ["a", "b", "c"]:
+        records[text] = await cache.put(
+            "avatarId",
+            text,
+            DataToStore(binary_data=stream(), content_type=ContentType.MP3, data_type=AvatarType.AUDIO),
+        )
+    assert records["a"].size_bytes == 4
+    await cache.pin(records["a"].key)
+    await cache.incrementUsage(records["b"].key)
+
+    evictor = CacheEvictor(cache, avatar_quota=Quota(max_records=2), headroom=0)
+    assert evictor.usage is None
+    assert await evictor.sweep() == 1
+    # the usage after the eviction is kept for the metrics
+    assert [(u.avatarId, u.records, u.size_bytes) for u in evictor.usage] == [("avatarId", 2, 8)]
+    # the pinned record and the recently used record are kept
+    assert await cache.get("avatarId", "a") is not None
+    assert await cache.get("avatarId", "b") is not None
+    assert await cache.get("avatarId", "c") is None
+    assert evictor.evicted_bytes == 4
+
+    evictor.set_quota("avatarId", Quota(max_bytes=0))
+    assert await evictor.sweep() == 1
+    assert await cache.get("avatarId", "a") is not None
+    await cache.deleteAll("avatarId")
+
+
+@pytest.mark.asyncio
+async def test_prewarmer_pins_initial_message():
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash)
+    avatar = await Avatar.create_avatar(
+        AvatarPydantic(
+            name="Prewarmed",
+            provider="Audio",
+            settings={"provider_name": "azure", "name": "en-US-JennyNeural"},
+        ),
+        initial_message="Hello there.",
+        phrases=["How can I help?"],
+    )
+    settings = avatar.instance().validate(avatar.settings)
+    data = DataToStore(binary_data=b"data", content_type=ContentType.MP3, data_type=AvatarType.AUDIO)
+    for text in ["Hello there.", "How can I help?"]:
+        await cache.put(avatar.slug, text, data, settings)
+
+    prewarmer = Prewarmer(cache)
+    assert prewarmer.enqueue(avatar.slug) is prewarmer.enqueue(avatar.slug)
+    prewarmer.start()
+    await prewarmer.join()
+    await prewarmer.stop()
+
+    status = prewarmer.status(avatar.slug)
+    assert status.state == PrewarmState.DONE
+    assert status.progress.cached == 2
+    assert (await cache.get(avatar.slug, "Hello there.", settings)).pinned
+    assert not (await cache.get(avatar.slug, "How can I help?", settings)).pinned
+
+    await cache.deleteAll(avatar.slug)
+    await avatar.delete()
+
+
+@pytest.mark.asyncio
+async def test_cache_content_addressed():
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash, content_addressed=True)
+    await cache.deleteAll("avatarA")
+    await cache.deleteAll("avatarB")
+
+    async def stream():
+        yield b"da"
+        yield b"ta"
+
+    def data(binary_data) -> DataToStore:
+        return DataToStore(
+            binary_data=binary_data,
+            content_type=ContentType.MP3,
+            data_type=AvatarType.AUDIO,
+            visemes=[Viseme(offset=0, viseme=21)],
+        )
+
+    a = await cache.put("avatarA", "text", data(b"data"))
+    b = await cache.put("avatarB", "text", data(stream()))
+    c = await cache.put("avatarB", "other text", data(b"data"))
+    assert a.storage_paths == b.storage_paths == c.storage_paths
+    assert a.size_bytes == b.size_bytes == 4 + len(b'[{"offset": 0, "viseme": 21}]')
+    # the temporary upload of the stream is gone
+    blobs = os.path.join(os.environ["LOCAL_STORAGE_PATH"], Cache.BLOB_FOLDER)
+    assert not [name for _, _, names in os.walk(blobs) for name in names if name.endswith(".tmp")]
+
+    await cache.delete(a.key)
+    assert os.path.exists(a.storage_paths.media_path)
+    await cache.deleteAll("avatarB")
+    assert not os.path.exists(a.storage_paths.media_path)
+    assert not os.path.exists(a.storage_paths.visemes_path)
+    assert await Blob.all().count() == 0
+
+    # a put that loses the insert to another writer releases its blobs
+    first = await cache.put("avatarA", "text", data(b"data"))
+    blobs = await Blob.all().count()
+    second = await cache.put("avatarA", "text", data(b"other data"))
+    assert second.storage_paths == first.storage_paths
+    assert await Blob.all().count() == blobs
+    assert set(await Blob.all().values_list("refcount", flat=True)) == {1}
+    await cache.deleteAll("avatarA")
+    assert await Blob.all().count() == 0
+
+    # a put of the same content between the release and the drop of a blob revives it
+    d = await cache.put("avatarA", "text", data(b"data"))
+    released = await cache.db.releaseBlobs([d.storage_paths.media_path])
+    assert released == [d.storage_paths.media_path]
+    e = await cache.put("avatarB", "text", data(b"data"))
+    assert e.storage_paths.media_path == d.storage_paths.media_path
+    assert not await cache.db.dropBlob(d.storage_paths.media_path, cache.storage.delete)
+    assert await cache.read_media(e) == b"data"
+    await cache.deleteAll("avatarB")
+    await cache.deleteAll("avatarA")
+    assert await Blob.all().count() == 0
+
+    # a put of the same content while the file of a blob is deleted stores a file of its own
+    f = await cache.put("avatarA", "text", data(b"data"))
+    await cache.db.releaseBlobs([f.storage_paths.media_path])
+    name = await Blob.filter(path=f.storage_paths.media_path).first().values_list("name", flat=True)
+    puts = []
+
+    async def remove(path):
+        assert await cache.db.acquireBlob(name) is None
+        puts.append(await cache.put("avatarB", "text", data(b"data")))
+        await cache.storage.delete(path)
+
+    assert await cache.db.dropBlob(f.storage_paths.media_path, remove)
+    assert puts[0].storage_paths.media_path != f.storage_paths.media_path
+    assert await cache.read_media(puts[0]) == b"data"
+    assert await Blob.filter(path=puts[0].storage_paths.media_path, refcount=1).exists()
+    await cache.deleteAll("avatarB")
+    await cache.deleteAll("avatarA")
+    assert await Blob.all().count() == 0
+
+
+class CountingTTS(TTSBase):
+    def __init__(self):
+        self.calls = 0
+
+    async def synthesize_speech(self, text, settings):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return AudioInstance(
+            duration_seconds=1.0,
+            content=f"{settings.name}:{text}".encode(),
+            visemes=[Viseme(offset=0, viseme=21)] if settings.visemes else None,
+            word_timestamps=None,
+        )
+
+
+@pytest.mark.asyncio
+async def test_synthesis_memo_shared_across_avatars():
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash)
+    await cache.deleteAll(MemoizedTTS.MEMO_AVATAR)
+    inner = CountingTTS()
+    tts = MemoizedTTS(inner, cache)
+    jenny = AzureTTSVoiceSettings(name="en-US-JennyNeural", visemes=True)
+
+    first, second = await asyncio.gather(
+        tts.synthesize_speech("Hello.", jenny),
+        tts.synthesize_speech("Hello.", jenny),
+    )
+    assert inner.calls == 1
+    assert first.content == second.content == b"en-US-JennyNeural:Hello."
+
+    # delivery settings do not change the speech, the voice and the flags do
+    streamed = await tts.synthesize_speech(
+        "Hello.", jenny.model_copy(update={"streaming": True, "segmented": True})
+    )
+    assert inner.calls == 1
+    assert streamed.streaming and streamed.content.read() == first.content
+    assert streamed.visemes == [Viseme(offset=0, viseme=21)]
+    assert streamed.duration_seconds == 1.0
+
+    await tts.synthesize_speech("Hello.", jenny.model_copy(update={"visemes": False}))
+    await tts.synthesize_speech("Hello.", jenny.model_copy(update={"name": "en-US-GuyNeural"}))
+    assert inner.calls == 3
+    # every use of the memo is counted, hits and the coalesced misses alike
+    record = await cache.get(MemoizedTTS.MEMO_AVATAR, "Hello.", voice_settings(jenny))
+    assert await cache.getUsageCount(record.key) == 3
+    assert record.metadata.bit_rate_kbps == jenny.bit_rate_kbps
+    await cache.deleteAll(MemoizedTTS.MEMO_AVATAR)
+
+    # avatars would store a second copy of the memoized audio
+    with pytest.raises(ValueError):
+        install_synthesis_memo(cache)
+
+
+@pytest.mark.asyncio
+async def test_cache_binary_sidecar():
+    visemes = [Viseme(offset=o, viseme=o % 22) for o in range(0, 2000, 50)]
+    words = [
+        WordTimestamp(word=w, offset=i * 300, duration=250, text_offset=i * 6, word_length=len(w))
+        for i, w in enumerate(["Hello", "wörld", "again"] * 10)
+    ]
+    sidecar = encode_sidecar(visemes, words)
+    assert decode_sidecar(sidecar) == (visemes, words)
+    # smaller than the word timestamps alone as JSON
+    assert len(sidecar) < len(b"".join(w.model_dump_json().encode() for w in words))
+    assert decode_sidecar(encode_sidecar(None, [], compress=False)) == (None, [])
+
+    json_cache = Cache(LocalStorage(), RelationalDB(), md5hash)
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash, sidecar_format=SidecarFormat.BINARY)
+    await cache.deleteAll("avatarId")
+    data = DataToStore(
+        binary_data=b"data",
+        content_type=ContentType.MP3,
+        data_type=AvatarType.AUDIO,
+        visemes=visemes,
+        word_timestamps=words,
+    )
+
+    record = await cache.put("avatarId", "text", data)
+    assert record.storage_paths.visemes_path is record.storage_paths.word_timestamps_path is None
+    assert record.size_bytes == 4 + len(sidecar)
+    urls = await cache.get_urls(record)
+    assert urls.sidecar_url is not None and urls.visemes_url is None
+    assert await cache.read_sidecars(record) == (visemes, words)
+
+    # records stored as JSON are still read
+    legacy = await json_cache.put("avatarId", "legacy", data)
+    assert legacy.storage_paths.sidecar_path is None
+    assert await cache.read_sidecars(legacy) == (visemes, words)
+
+    await cache.delete(record.key)
+    assert not os.path.exists(record.storage_paths.sidecar_path)
+    await cache.deleteAll("avatarId")
+
+
+@pytest.mark.asyncio
+async def test_cache_inline_sidecars():
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash, inline_sidecar_bytes=256)
+    await cache.deleteAll("avatarId")
+
+    def data(n: int) -> DataToStore:
+        return DataToStore(
+            binary_data=b"data",
+            content_type=ContentType.MP3,
+            data_type=AvatarType.AUDIO,
+            visemes=[Viseme(offset=i * 50, viseme=21) for i in range(n)],
+        )
+
+    small = await cache.put("avatarId", "small", data(2))
+    assert small.storage_paths.all() == [small.storage_paths.media_path]
+    assert small.size_bytes == 4
+    assert (await cache.get("avatarId", "small")).visemes == data(2).visemes
+    assert await cache.read_sidecars(small) == (data(2).visemes, None)
+    assert (await cache.get_urls(small)).visemes_url is None
+
+    large = await cache.put("avatarId", "large", data(20))
+    assert large.visemes is None and large.storage_paths.visemes_path is not None
+    assert await cache.read_sidecars(large) == (data(20).visemes, None)
+    await cache.deleteAll("avatarId")
+
+
+@pytest.mark.asyncio
+async def test_cache_metrics():
+    metrics = CacheMetrics()
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash, metrics=metrics)
+    await cache.deleteAll("avatarId")
+    avatar = CountingAvatar()
+    settings = AzureTTSVoiceSettings(name="en-US-JennyNeural")
+
+    assert metrics.hit_ratio() is None
+    await avatar.speak(cache, "avatarId", "reply", settings, "Audio")
+    await avatar.speak(cache, "avatarId", "reply", settings, "Audio")
+    await avatar.speak(cache, "avatarId", "reply", settings, "Audio")
+    assert metrics.hit_ratio("avatarId") == 2 / 3
+    assert metrics.bytes_written["avatarId"] == len(b"reply")
+    assert metrics.latencies[("generate", "Audio")].count == 1
+    assert metrics.latencies[("db_get", "")].count == 3
+
+    text = metrics.render(await cache.db.getStorageUsage())
+    assert 'persona_link_cache_lookups_total{avatar="avatarId",provider="Audio",result="hit"} 2' in text
+    assert 'persona_link_cache_stored_bytes{avatar="avatarId"} 5' in text
+    assert 'persona_link_operation_seconds_bucket{operation="generate",provider="Audio",le="+Inf"} 1' in text
+    await cache.deleteAll("avatarId")
+
+
+@pytest.mark.asyncio
+async def test_cache_delete_all_in_chunks(monkeypatch):
+    db = RelationalDB()
+    monkeypatch.setattr(db, "QUERY_CHUNK_SIZE", 3)
+    cache = Cache(LocalStorage(), db, md5hash)
+    await cache.deleteAll("avatarId")
+    await cache.deleteAll("avatarId2")
+    data = DataToStore(
+        binary_data=b"data",
+        content_type=ContentType.MP3,
+        data_type=AvatarType.AUDIO,
+        visemes=[Viseme(offset=0, viseme=21)],
+    )
+    await cache.put_many("avatarId", {f"text {i}": data for i in range(10)})
+    other = await cache.put("avatarId2", "text", data)
+
+    deleted = []
+    await cache.deleteAll("avatarId", progress=deleted.append)
+    assert deleted == [20]
+    assert await db.getStoragePaths("avatarId") == []
+    # an avatar whose ID starts with the purged ID keeps its records and files
+    assert (await cache.get("avatarId2", "text")).key == other.key
+    assert os.path.exists(other.storage_paths.media_path)
+    await cache.deleteAll("avatarId2")
+
+    # the blobs of a content-addressed cache are released chunk by chunk
+    cache = Cache(LocalStorage(), db, md5hash, content_addressed=True)
+    records = await cache.put_many(
+        "avatarId", {f"text {i}": data.model_copy(update={"binary_data": f"{i}".encode()}) for i in range(10)}
+    )
+    released = []
+    release_blobs = db.releaseBlobs
+
+    async def counted(paths):
+        released.append(len(paths))
+        return await release_blobs(paths)
+
+    monkeypatch.setattr(db, "releaseBlobs", counted)
+    await cache.deleteAll("avatarId")
+    # the media and visemes of each chunk of 3 records
+    assert released == [6, 6, 6, 2]
+    assert await Blob.all().count() == 0
+    assert not any(os.path.exists(record.storage_paths.media_path) for record in records.values())
+
+
+@pytest.mark.asyncio
+async def test_azure_signed_urls_are_reused(monkeypatch):
+    key = base64.b64encode(b"k" * 32).decode()
+    monkeypatch.setenv(
+        "AZURE_STORAGE_CONNECTION_STRING",
+        f"DefaultEndpointsProtocol=https;AccountName=account;AccountKey={key};EndpointSuffix=core.windows.net",
+    )
+    monkeypatch.setenv("AZURE_STORAGE_CONTAINER_NAME", "container")
+    storage = AzureStorage(url_refresh_seconds=900, url_cache_size=1)
+
+    url = await storage.get("avatarId/key.mp3")
+    assert await storage.get("avatarId/key.mp3") == url
+    # another process signs the same url within the same bucket
+    assert await AzureStorage().get("avatarId/key.mp3") == url
+    assert await storage.get("avatarId/other.mp3") != url
+    assert list(storage._urls) == ["avatarId/other.mp3"]
+
+    # every operation shares the client created at start, until the storage is closed
+    await storage.start()
+    client = storage._client
+    assert await storage._container() is await storage._container()
+    await storage.start()
+    assert storage._client is client
+    await storage.close()
+    assert storage._client is None
+
+
+
+@pytest.mark.asyncio
+async def test_local_signed_urls(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOCAL_STORAGE_PATH", str(tmp_path))
+    monkeypatch.setenv("LOCAL_STORAGE_BASE_URL", "http://localhost:8000/media/")
+    monkeypatch.setenv("LOCAL_STORAGE_URL_SECRET", "secret")
+    storage = LocalStorage()
+    path = await storage.put("avatarId", b"data", "key.mp3", ContentType.MP3)
+    relative_path = os.path.relpath(path, tmp_path)
+
+    url = await storage.get(path)
+    assert url.startswith(f"http://localhost:8000/media/{relative_path}?expires=")
+    assert await storage.get(path) == url
+    query = dict(part.split("=", 1) for part in url.split("?", 1)[1].split("&"))
+    expires, signature = int(query["expires"]), query["signature"]
+
+    assert storage.verify(relative_path, expires, signature) == os.path.realpath(path)
+    assert storage.verify("avatarId/other.mp3", expires, signature) is None
+    assert storage.verify(relative_path, expires + 1, signature) is None
+    expired = int(time.time()) - 1
+    assert storage.verify(relative_path, expired, storage._signature(relative_path, expired)) is None
+    assert storage.verify("../key.mp3", expires, storage._signature("../key.mp3", expires)) is None
+
+    monkeypatch.delenv("LOCAL_STORAGE_BASE_URL")
+    assert await LocalStorage().get(path) == path
+
+
+@pytest.mark.asyncio
+async def test_local_sharded_layout(monkeypatch, tmp_path):
+    monkeypatch.setenv("LOCAL_STORAGE_PATH", str(tmp_path))
+    storage = LocalStorage(io_workers=2)
+
+    path = await storage.put("avatarId", b"data", "key.mp3", ContentType.MP3)
+    assert len(os.path.relpath(path, tmp_path).split(os.sep)) == 2 + LocalStorage.SHARD_LEVELS
+    assert storage.folder(path) == "avatarId"
+    assert os.listdir(os.path.dirname(path)) == ["key.mp3"]
+
+    # a failed write leaves neither the file nor its temporary file behind
+    async def failing():
+        yield b"partial"
+        raise IOError("stream failed")
+
+    with pytest.raises(IOError):
+        await storage.put("avatarId", failing(), "other.mp3", ContentType.MP3)
+    assert [name for _, _, names in os.walk(tmp_path) for name in names] == ["key.mp3"]
+
+    # files of the flat layout are found under their old paths, before and after the migration
+    flat = [os.path.join(tmp_path, "avatarId", f"flat{i}.mp3") for i in range(3)]
+    for i, file in enumerate(flat):
+        with open(file, "wb") as f:
+            f.write(b"flat %d" % i)
+    open(os.path.join(tmp_path, "avatarId", ".flat.mp3.0.tmp"), "wb").close()
+    assert await storage.get(flat[0]) == flat[0]
+
+    moved = []
+    assert await storage.migrate_layout(moved.append) == 3
+    assert moved == [3]
+    assert all(entry.is_dir() for entry in os.scandir(os.path.join(tmp_path, "avatarId")))
+    assert await storage.read(flat[1]) == b"flat 1"
+    assert await storage.get(flat[2]) == storage._legacy_path(flat[2])
+    await storage.delete(flat[2])
+    assert await storage.get(flat[2]) is None
+    assert await storage.migrate_layout() == 0
+
+    deleted = []
+    await storage.deleteAll("avatarId", deleted.append)
+    assert deleted == [3]
+    assert os.listdir(tmp_path) == []
+    await storage.close()
+
+
+class FakeBlobClient:
+    def __init__(self, container):
+        self.container = container
+
+    async def stage_block(self, block_id, data, length):
+        self.container.staging += 1
+        self.container.peak_staging = max(self.container.peak_staging, self.container.staging)
+        await asyncio.sleep(0.01)
+        self.container.staging -= 1
+        if self.container.failures:
+            self.container.failures -= 1
+            raise AzureError("block failed")
+        self.container.blocks[block_id] = data
+
+    async def commit_block_list(self, blocks, content_settings):
+        self.container.committed = b"".join(self.container.blocks[b.id] for b in blocks)
+
+
+class FakeContainerClient:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.blocks = {}
+        self.committed = None
+        self.staging = self.peak_staging = 0
+
+    def get_blob_client(self, path):
+        return FakeBlobClient(self)
+
+    async def upload_blob(self, path, data, overwrite, content_settings, **kwargs):
+        self.committed = data
+
+
+@pytest.mark.asyncio
+async def test_azure_streams_blocks_in_parallel(monkeypatch):
+    key = base64.b64encode(b"k" * 32).decode()
+    monkeypatch.setenv(
+        "AZURE_STORAGE_CONNECTION_STRING",
+        f"DefaultEndpointsProtocol=https;AccountName=account;AccountKey={key};EndpointSuffix=core.windows.net",
+    )
+    monkeypatch.setenv("AZURE_STORAGE_CONTAINER_NAME", "container")
+    monkeypatch.setattr(AzureStorage, "RETRY_BACKOFF_SECONDS", 0)
+    storage = AzureStorage(block_size=100, upload_concurrency=3)
+    container = FakeContainerClient(failures=2)
+    storage._container_client = container
+    transfers = []
+    storage.on_transfer = transfers.append
+    data = bytes(range(256)) * 4
+
+    async def stream(data, size=30):
+        for i in range(0, len(data), size):
+            yield data[i : i + size]
+
+    assert await storage.put("avatarId", stream(data), "key.mp4", ContentType.MP4) == "avatarId/key.mp4"
+    assert container.committed == data
+    assert container.peak_staging == 3
+    (stats,) = transfers
+    assert (stats.size_bytes, stats.blocks, stats.retries) == (len(data), 11, 2)
+    # the blocks being staged and the one being read, plus the last chunk read
+    assert stats.peak_buffered_bytes <= 4 * 100 + 30
+
+    # a block that keeps failing fails the upload without committing
+    container = storage._container_client = FakeContainerClient(failures=100)
+    with pytest.raises(AzureError):
+        await storage.put("avatarId", stream(data), "key.mp4", ContentType.MP4)
+    assert container.committed is None
+
+    # a stream shorter than a block is uploaded in one request
+    await storage.put("avatarId", stream(data[:50]), "small.mp4", ContentType.MP4)
+    assert storage._container_client.committed == data[:50]
+    assert transfers[-1].blocks == 1
+
+
+class StreamingAvatar(CountingAvatar):
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def generate(self, text, settings) -> DataToStore:
+        self.calls += 1
+
+        async def stream():
+            yield b"first "
+            await self.release.wait()
+            yield b"second"
+
+        return DataToStore(
+            binary_data=stream(),
+            content_type=ContentType.MP4,
+            data_type=AvatarType.VIDEO,
+            visemes=[Viseme(offset=0, viseme=21)],
+        )
+
+
+@pytest.mark.asyncio
+async def test_speak_tees_streamed_media(monkeypatch):
+    monkeypatch.setenv("CACHE_TEE_URL_SECRET", "secret")
+    tee = MediaTee("http://localhost:8000/stream/")
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash, tee=tee)
+    await cache.deleteAll("avatarId")
+    avatar = StreamingAvatar()
+    settings = AzureTTSVoiceSettings(name="en-US-JennyNeural")
+    key = cache.key("avatarId", "streamed", settings)
+
+    # the instance is returned while the media is still streaming in
+    instance = await asyncio.wait_for(avatar.speak(cache, "avatarId", "streamed", settings, "Video"), 1)
+    url = urlparse(instance.urls.media_url)
+    assert url.geturl().startswith(f"http://localhost:8000/stream/{key}?")
+    query = parse_qs(url.query)
+    expires, signature = int(query["expires"][0]), query["signature"][0]
+    assert tee.verify(key, expires, signature)
+    assert not tee.verify(key, expires, signature[:-1])
+    assert not tee.verify("other", expires, signature)
+    assert not tee.verify(key, int(time.time()) - 1, tee._signature(key, int(time.time()) - 1))
+    assert instance.visemes == [Viseme(offset=0, viseme=21)]
+    assert await cache.get("avatarId", "streamed", settings) is None
+
+    buffer = tee.get(key)
+    early = buffer.read()
+    assert await early.__anext__() == b"first "
+    again = await avatar.speak(cache, "avatarId", "streamed", settings, "Video")
+    assert again.urls == instance.urls and avatar.calls == 1
+
+    avatar.release.set()
+    assert await early.__anext__() == b"second"
+    # a late joiner reads the buffered prefix
+    assert b"".join([chunk async for chunk in buffer.read()]) == b"first second"
+    while tee.get(key) is not None or tee._tasks:
+        await asyncio.sleep(0.01)
+    record = await cache.get("avatarId", "streamed", settings)
+    assert await cache.read_media(record) == b"first second"
+    assert await cache.getUsageCount(key) == 2
+    await cache.deleteAll("avatarId")
+
+
+class FakeCopyBlobClient:
+    def __init__(self, polls):
+        self.blob_name = "avatarId/key.mp4"
+        self.polls = polls
+        self.content_settings = None
+
+    async def start_copy_from_url(self, url):
+        self.url = url
+        return {"copy_id": "copy", "copy_status": "pending"}
+
+    async def get_blob_properties(self):
+        self.polls -= 1
+        status = "pending" if self.polls > 0 else "success"
+        return SimpleNamespace(size=1234, copy=SimpleNamespace(status=status, status_description=None))
+
+    async def set_http_headers(self, content_settings):
+        self.content_settings = content_settings
+
+
+@pytest.mark.asyncio
+async def test_cache_put_from_source_url(monkeypatch):
+    async def download(self, url, chunk_size=None):
+        assert url == "https://provider/video.mp4"
+        yield b"provider "
+        yield b"video"
+
+    monkeypatch.setattr(APIClient, "download", download)
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash)
+    await cache.deleteAll("avatarId")
+    data = DataToStore(
+        source_url="https://provider/video.mp4",
+        content_type=ContentType.MP4,
+        data_type=AvatarType.VIDEO,
+    )
+
+    # storages without a copy of their own stream the file
+    record = await cache.put("avatarId", "text", data)
+    assert await cache.read_media(record) == b"provider video"
+    assert record.size_bytes == len(b"provider video")
+    with pytest.raises(ValueError):
+        await cache.put("avatarId", "other", DataToStore(content_type=ContentType.MP4, data_type=AvatarType.VIDEO))
+    await cache.deleteAll("avatarId")
+
+    # with a tee, the streamed file is served while it is stored
+    monkeypatch.setenv("CACHE_TEE_URL_SECRET", "secret")
+    tee = MediaTee("http://localhost:8000/stream")
+    cache = Cache(LocalStorage(), RelationalDB(), md5hash, tee=tee)
+    key = cache.key("avatarId", "text")
+    teed = []
+
+    async def watched(self, url, chunk_size=None):
+        yield b"provider "
+        teed.append(tee.get(key).size)
+        yield b"video"
+
+    monkeypatch.setattr(APIClient, "download", watched)
+    record = await cache.put("avatarId", "text", data)
+    assert teed == [len(b"provider ")] and tee.get(key) is None
+    await cache.deleteAll("avatarId")
+
+    # storages that copy the file themselves send readers of the tee to the source url meanwhile
+    class CopyingStorage(LocalStorage):
+        copies_from_url = True
+
+        async def put_from_url(self, avatarId, url, filename, content_type):
+            assert tee.get(key).redirect == url
+            return await self.put(avatarId, b"copied", filename, content_type), len(b"copied")
+
+    cache = Cache(CopyingStorage(), RelationalDB(), md5hash, tee=tee)
+    record = await cache.put("avatarId", "text", data)
+    assert await cache.read_media(record) == b"copied" and tee.get(key) is None
+    await cache.deleteAll("avatarId")
+
+    key = base64.b64encode(b"k" * 32).decode()
+    monkeypatch.setenv(
+        "AZURE_STORAGE_CONNECTION_STRING",
+        f"DefaultEndpointsProtocol=https;AccountName=account;AccountKey={key};EndpointSuffix=core.windows.net",
+    )
+    monkeypatch.setenv("AZURE_STORAGE_CONTAINER_NAME", "container")
+    storage = AzureStorage()
+    blob_client = FakeCopyBlobClient(polls=2)
+    storage._container_client = SimpleNamespace(get_blob_client=lambda path: blob_client)
+
+    path, size = await storage.put_from_url("avatarId", "https://provider/video.mp4", "key.mp4", ContentType.MP4)
+    assert (path, size) == ("avatarId/key.mp4", 1234)
+    assert blob_client.url == "https://provider/video.mp4"
+    assert blob_client.content_settings.content_type == ContentType.MP4